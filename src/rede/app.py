@@ -5,6 +5,11 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from src.rede.controllers.api import router
 from src.rede.services.scheduler import SchedulerService
+from src.rede.services.token import RenovadorToken
+from src.rede.services.rede_async import VendasServiceAsync
+from src.rede.services.rotina import RotinaService
+from src.rede.services.job import obter_executor_jobs, encerrar_executor_jobs
+from src.rede.utils.http import fechar_transporte, fechar_transporte_async
 from contextlib import asynccontextmanager
 from src.rede.utils.log import set_logger
 logger = set_logger(__name__)
@@ -18,13 +23,26 @@ if not any([api_title,api_description,api_version]):
     raise ValueError("API config not found.")
 
 sch = SchedulerService()
+renovador = RenovadorToken()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup code
+    # Serviços compartilhados entre as requisições, com os pools HTTP e o cache de tokens do processo
+    app.state.vendas = VendasServiceAsync()
+    app.state.rotina = RotinaService()
+    app.state.jobs = obter_executor_jobs(rotina=app.state.rotina)
     sch.start_scheduler()
+    renovador.registrar(app.state.rotina.rede_venda)
+    renovador.registrar(app.state.rotina.snk_pgto)
+    renovador.iniciar()
+    app.state.jobs.marcar_interrompidos()
     yield
     # Shutdown code
+    renovador.parar()
     sch.stop_scheduler()
+    encerrar_executor_jobs()
+    fechar_transporte()
+    await fechar_transporte_async()
 
 app = FastAPI(title=api_title,
               description=api_description,
@@ -1,14 +1,20 @@
-from typing import Literal
+import json
+from typing import Literal, AsyncIterator
 from datetime import date
 from dotenv import load_dotenv
-from fastapi import APIRouter, HTTPException, Response, status, Depends
+from fastapi import APIRouter, HTTPException, Request, Response, status, Depends
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, model_validator
 from src.rede.services.rede import *
+from src.rede.services.rede_async import AutenticacaoServiceAsync, VendasServiceAsync
 from src.rede.services.rotina import RotinaService
+from src.rede.services.job import ExecutorJobs, obter_executor_jobs
+from src.rede.utils.metricas import metricas
 load_dotenv()
 
 COMPANY_NUMBER_LIST = [int(x) for x in os.getenv("COMPANY_NUMBER_LIST", "").split(",") if x.isdigit()]
+MAX_ITENS_LOTE = int(os.getenv("REDE_MAX_ITENS_LOTE", "1000"))
 
 class AutenticacaoModel(BaseModel):
     ambiente: Literal['trn', 'prd']
@@ -52,6 +58,35 @@ class VendasModel(BaseModel):
             raise ValueError("Company Number inválido")
         return model         
 
+class ItemLoteModel(BaseModel):
+    companyNumber:int
+    nsu:int
+    saleDate:date
+
+    @model_validator(mode="after")
+    def validar_nsu(cls, model):
+        if len(str(model.nsu)) < 8:
+            raise ValueError("NSU inválido. Deve conter pelo menos 8 dígitos.")
+        return model
+
+    @model_validator(mode="after")
+    def validar_companynumber(cls, model):
+        if model.companyNumber not in COMPANY_NUMBER_LIST:
+            raise ValueError("Company Number inválido")
+        return model
+
+class VendasLoteModel(BaseModel):
+    ambiente:Literal['trn', 'prd']
+    itens:list[ItemLoteModel]
+
+    @model_validator(mode="after")
+    def validar_itens(cls, model):
+        if not model.itens:
+            raise ValueError("Nenhum item informado")
+        if len(model.itens) > MAX_ITENS_LOTE:
+            raise ValueError(f"Máximo de {MAX_ITENS_LOTE} itens por requisição")
+        return model
+
 class RotinaVendaModel(BaseModel):
     companyNumber:int
     startDate:date
@@ -80,6 +115,7 @@ class RotinaPagamentoModel(BaseModel):
     companyNumber:int
     startDate:date
     endDate:date
+    forcar:bool=False
     
     @model_validator(mode="after")
     def validar_periodo(cls, model):
@@ -93,6 +129,24 @@ class RotinaPagamentoModel(BaseModel):
             raise ValueError("Company Number inválido")
         return model     
 
+class JobPagamentoModel(BaseModel):
+    companyNumbers:list[int]
+    startDate:date
+    endDate:date
+    forcar:bool=False
+
+    @model_validator(mode="after")
+    def validar_periodo(cls, model):
+        if model.startDate > model.endDate:
+            raise ValueError("startDate não pode ser maior que endDate")
+        return model
+
+    @model_validator(mode="after")
+    def validar_companynumber(cls, model):
+        if not model.companyNumbers or any(cn not in COMPANY_NUMBER_LIST for cn in model.companyNumbers):
+            raise ValueError("Company Number inválido")
+        return model
+
 class VendasPgtoId(BaseModel):
     ambiente:Literal['trn', 'prd']
     companyNumber:int
@@ -106,6 +160,55 @@ def validar_token(credentials: HTTPAuthorizationCredentials = Depends(security))
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token de autenticação inválido")
     return credentials.credentials
 
+def obter_vendas(request:Request) -> VendasServiceAsync:
+    """ Serviço de vendas criado no lifespan da aplicação """
+    vendas = getattr(request.app.state, 'vendas', None)
+    if vendas is None:
+        vendas = request.app.state.vendas = VendasServiceAsync()
+    return vendas
+
+def obter_rotina(request:Request) -> RotinaService:
+    """ Serviço de rotinas criado no lifespan da aplicação """
+    rotina = getattr(request.app.state, 'rotina', None)
+    if rotina is None:
+        rotina = request.app.state.rotina = RotinaService()
+    return rotina
+
+def obter_jobs(request:Request) -> ExecutorJobs:
+    """ Executor de jobs criado no lifespan da aplicação """
+    jobs = getattr(request.app.state, 'jobs', None)
+    if jobs is None:
+        jobs = request.app.state.jobs = obter_executor_jobs(rotina=obter_rotina(request))
+    return jobs
+
+async def transmitir_ndjson(paginas:AsyncIterator[list[dict]]) -> StreamingResponse:
+    """
+    Retorna os registros das páginas como NDJSON, um registro por linha, à medida que as páginas chegam.
+    A primeira página é buscada antes da resposta, para que erros na consulta ainda retornem HTTP 500;
+    um erro nas páginas seguintes é informado em uma última linha {"erro": ...}.
+    """
+    try:
+        primeira = await anext(paginas, [])
+    except Exception as e:
+        await paginas.aclose()
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    finally:
+        pass
+
+    async def gerar():
+        try:
+            for item in primeira:
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+            async for pagina in paginas:
+                for item in pagina:
+                    yield json.dumps(item, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"erro": str(e)}, ensure_ascii=False) + "\n"
+        finally:
+            await paginas.aclose()
+
+    return StreamingResponse(gerar(), media_type="application/x-ndjson")
+
 @router.get("/info", status_code=status.HTTP_200_OK)
 def info():
     return {
@@ -114,16 +217,20 @@ def info():
         "version": "1.0.0"
     }
 
+@router.get("/metrics", status_code=status.HTTP_200_OK, response_class=PlainTextResponse)
+def exportar_metricas():
+    return PlainTextResponse(metricas.exportar(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @router.post("/auth/generate-token", status_code=status.HTTP_200_OK)
-def gerar_token(body:AutenticacaoModel) -> dict:
+async def gerar_token(body:AutenticacaoModel) -> dict:
     res:dict={}
-    auth = AutenticacaoService(
+    auth = AutenticacaoServiceAsync(
         ambiente=body.ambiente,
         pacote=body.pacote,
         auth=body.auth
     )
     try:
-        res = auth.gerar_token()
+        res = await auth.gerar_token()
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
     finally:
@@ -131,11 +238,20 @@ def gerar_token(body:AutenticacaoModel) -> dict:
     return res
 
 @router.post("/vendas/consulta-parcelas", status_code=status.HTTP_200_OK)
-def consulta_parcelas(body:VendasModel, token:str=Depends(validar_token)) -> dict:
+async def consulta_parcelas(body:VendasModel, token:str=Depends(validar_token), stream:bool=False, vendas:VendasServiceAsync=Depends(obter_vendas)):
     res:dict={}
-    vendas = VendasService()
+    if stream:
+        return await transmitir_ndjson(vendas.iterar_vendas_parceladas(
+            ambiente=body.ambiente,
+            token=token,
+            companyNumber=body.companyNumber,
+            nsu=body.nsu,
+            startDate=body.startDate,
+            endDate=body.endDate,
+            prefetch=True
+        ))
     try:
-        res = vendas.consultar_vendas_parceladas(
+        res = await vendas.consultar_vendas_parceladas(
             ambiente=body.ambiente,
             token=token,
             companyNumber=body.companyNumber,
@@ -149,12 +265,40 @@ def consulta_parcelas(body:VendasModel, token:str=Depends(validar_token)) -> dic
         pass
     return res
 
+@router.post("/vendas/consulta-parcelas-lote", status_code=status.HTTP_200_OK)
+async def consulta_parcelas_lote(body:VendasLoteModel, token:str=Depends(validar_token), vendas:VendasServiceAsync=Depends(obter_vendas)) -> dict:
+    res:list[dict]=[]
+    try:
+        res = await vendas.consultar_vendas_parceladas_lote(
+            itens=[item.model_dump() for item in body.itens],
+            ambiente=body.ambiente,
+            token=token
+        )
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    finally:
+        pass
+    return {
+        "total": len(res),
+        "sucesso": sum(1 for r in res if r.get('sucesso')),
+        "falhas": sum(1 for r in res if not r.get('sucesso')),
+        "resultados": res
+    }
+
 @router.post("/vendas/consulta-pgto-oc", status_code=status.HTTP_200_OK)
-def consulta_pagamentos_oc(body:VendasModel, token:str=Depends(validar_token)) -> dict:
+async def consulta_pagamentos_oc(body:VendasModel, token:str=Depends(validar_token), stream:bool=False, vendas:VendasServiceAsync=Depends(obter_vendas)):
     res:dict={}
-    vendas = VendasService()        
+    if stream:
+        return await transmitir_ndjson(vendas.iterar_pagamentos_oc(
+            ambiente=body.ambiente,
+            token=token,
+            companyNumber=body.companyNumber,
+            startDate=body.startDate,
+            endDate=body.endDate,
+            prefetch=True
+        ))
     try:
-        res = vendas.consultar_pagamentos_oc(
+        res = await vendas.consultar_pagamentos_oc(
             ambiente=body.ambiente,
             token=token,
             companyNumber=body.companyNumber,
@@ -168,11 +312,10 @@ def consulta_pagamentos_oc(body:VendasModel, token:str=Depends(validar_token)) -
     return res
 
 @router.post("/vendas/consulta-pgto-id", status_code=status.HTTP_200_OK)
-def consulta_pagamentos_id(body:VendasPgtoId, token: str = Depends(validar_token)) -> dict:
+async def consulta_pagamentos_id(body:VendasPgtoId, token: str = Depends(validar_token), vendas:VendasServiceAsync=Depends(obter_vendas)) -> dict:
     res:dict={}
-    vendas = VendasService()        
     try:
-        res = vendas.consultar_pagamentos_id(
+        res = await vendas.consultar_pagamentos_id(
             ambiente=body.ambiente,
             token=token,
             companyNumber=body.companyNumber,
@@ -185,9 +328,8 @@ def consulta_pagamentos_id(body:VendasPgtoId, token: str = Depends(validar_token
     return res
 
 @router.post("/rotina/registra-pagamento", status_code=status.HTTP_200_OK)
-def registra_pagamento(body:RotinaVendaModel) -> dict:
+def registra_pagamento(body:RotinaVendaModel, rotina:RotinaService=Depends(obter_rotina)) -> dict:
     res:dict={}   
-    rotina = RotinaService() 
     try:        
         res = rotina.registrar_dados_pagamento(
             companyNumber=body.companyNumber,
@@ -203,14 +345,14 @@ def registra_pagamento(body:RotinaVendaModel) -> dict:
     return res
 
 @router.post("/rotina/atualiza-pagamento", status_code=status.HTTP_200_OK)
-def atualiza_pagamento(body:RotinaPagamentoModel) -> dict:
+def atualiza_pagamento(body:RotinaPagamentoModel, rotina:RotinaService=Depends(obter_rotina)) -> dict:
     res:dict={}
-    rotina = RotinaService()
     try:        
-        res = rotina.atualizar_dados_pagamento(
+        res = rotina.atualizar_dados_pagamento_incremental(
             companyNumber=body.companyNumber,
             startDate=body.startDate,
-            endDate=body.endDate
+            endDate=body.endDate,
+            forcar=body.forcar
         )
         if res.get('sucesso') and res.get('mensagem'):
             return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -221,4 +363,47 @@ def atualiza_pagamento(body:RotinaPagamentoModel) -> dict:
     finally:
         pass
     return res
-    
\ No newline at end of file
+
+@router.post("/jobs/atualiza-pagamento", status_code=status.HTTP_202_ACCEPTED)
+def job_atualiza_pagamento(body:JobPagamentoModel, jobs:ExecutorJobs=Depends(obter_jobs)) -> dict:
+    job_id:str=''
+    try:
+        job_id = jobs.submeter_atualizacao_pagamento(
+            companyNumbers=body.companyNumbers,
+            startDate=body.startDate,
+            endDate=body.endDate,
+            forcar=body.forcar
+        )
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    finally:
+        pass
+    return {"job_id": job_id, "status": "pendente"}
+
+@router.post("/jobs/registra-pagamento", status_code=status.HTTP_202_ACCEPTED)
+def job_registra_pagamento(body:RotinaVendaModel, jobs:ExecutorJobs=Depends(obter_jobs)) -> dict:
+    job_id:str=''
+    try:
+        job_id = jobs.submeter_registro_pagamento(
+            companyNumber=body.companyNumber,
+            dataVendas=body.startDate,
+            nsu=body.nsu
+        )
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    finally:
+        pass
+    return {"job_id": job_id, "status": "pendente"}
+
+@router.get("/jobs/{job_id}", status_code=status.HTTP_200_OK)
+def consulta_job(job_id:str, jobs:ExecutorJobs=Depends(obter_jobs)) -> dict:
+    res:dict=None
+    try:
+        res = jobs.consultar(job_id)
+    except Exception as e:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    finally:
+        pass
+    if not res:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job não encontrado")
+    return res
@@ -1,19 +1,26 @@
-from datetime import datetime, timezone, timedelta
-from sqlalchemy import String, DateTime, Integer
+from datetime import date, datetime, timezone, timedelta
+from sqlalchemy import String, Text, Date, DateTime, Integer, LargeBinary, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column
 
 from .database import Base
 
 class Token(Base):
     __tablename__ = "tokens"
+    __table_args__ = (
+        UniqueConstraint("sistema", "ambiente", "pacote", name="uq_tokens_sistema_ambiente_pacote"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
 
     # sankhya | rede
-    sistema: Mapped[str] = mapped_column(String(20), unique=True)
+    sistema: Mapped[str] = mapped_column(String(20), nullable=False)
+    # trn | prd
+    ambiente: Mapped[str] = mapped_column(String(10), nullable=False, default="prd")
+    # rede: pgto | vendas ; sankhya: api
+    pacote: Mapped[str] = mapped_column(String(20), nullable=False, default="")
 
-    access_token: Mapped[str] = mapped_column(String, nullable=False)
-    refresh_token: Mapped[str] = mapped_column(String, nullable=True)
+    access_token: Mapped[str] = mapped_column(Text, nullable=False)
+    refresh_token: Mapped[str] = mapped_column(Text, nullable=True)
 
     expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=True)
 
@@ -21,4 +28,86 @@ class Token(Base):
         DateTime(timezone=True),
         default=lambda: datetime.now(timezone(timedelta(hours=-3))),
         onupdate=lambda: datetime.now(timezone(timedelta(hours=-3))),
-    )
\ No newline at end of file
+    )
+
+class Watermark(Base):
+    __tablename__ = "watermarks"
+    __table_args__ = (
+        UniqueConstraint("rotina", "company_number", name="uq_watermarks_rotina_company_number"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    # nome da rotina sincronizada, ex.: atualizar_dados_pagamento
+    rotina: Mapped[str] = mapped_column(String(50), nullable=False)
+    company_number: Mapped[int] = mapped_column(Integer, nullable=False)
+
+    # última data conciliada com sucesso
+    ultima_data: Mapped[date] = mapped_column(Date, nullable=False)
+
+    # execuções seguidas com falha no dia seguinte a ultima_data
+    falhas: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
+
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone(timedelta(hours=-3))),
+        onupdate=lambda: datetime.now(timezone(timedelta(hours=-3))),
+    )
+
+class RespostaCache(Base):
+    __tablename__ = "respostas_cache"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+
+    # sha256 de (endpoint, ambiente, company_number, data_inicial, data_final, nsu)
+    chave: Mapped[str] = mapped_column(String(64), unique=True, nullable=False)
+
+    # vendas_parceladas | pagamentos_oc
+    endpoint: Mapped[str] = mapped_column(String(50), nullable=False)
+    ambiente: Mapped[str] = mapped_column(String(10), nullable=False)
+    company_number: Mapped[int] = mapped_column(Integer, nullable=False)
+    data_inicial: Mapped[date] = mapped_column(Date, nullable=False)
+    data_final: Mapped[date] = mapped_column(Date, nullable=False)
+    nsu: Mapped[str] = mapped_column(String(20), nullable=True)
+
+    # corpo da resposta em JSON compactado com zlib
+    conteudo: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, index=True)
+
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone(timedelta(hours=-3))),
+        onupdate=lambda: datetime.now(timezone(timedelta(hours=-3))),
+    )
+
+class Job(Base):
+    __tablename__ = "jobs"
+
+    # uuid4 em hexadecimal
+    id: Mapped[str] = mapped_column(String(32), primary_key=True)
+
+    # atualiza-pagamento | registra-pagamento
+    tipo: Mapped[str] = mapped_column(String(50), nullable=False)
+    # pendente | executando | concluido | falha | interrompido
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default="pendente", index=True)
+
+    # JSON com os parâmetros da requisição
+    parametros: Mapped[str] = mapped_column(Text, nullable=False)
+    # JSON {companyNumber: {AAAA-MM-DD: status}}
+    progresso: Mapped[str] = mapped_column(Text, nullable=False, default="{}")
+    # JSON com o retorno da rotina
+    resultado: Mapped[str] = mapped_column(Text, nullable=True)
+    mensagem: Mapped[str] = mapped_column(Text, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone(timedelta(hours=-3))),
+    )
+    started_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+    finished_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone(timedelta(hours=-3))),
+        onupdate=lambda: datetime.now(timezone(timedelta(hours=-3))),
+    )
@@ -0,0 +1,82 @@
+import os, json, zlib, hashlib
+from datetime import date, datetime, timedelta
+from sqlalchemy.orm import Session
+from src.rede.database.models import RespostaCache
+
+class CacheRespostaService:
+    """
+    Cache persistente das respostas do merchant-statement da Rede.
+    O prazo de validade depende da idade do período: dados de hoje e de dias
+    recentes ainda podem mudar, enquanto dias já liquidados são mantidos por mais tempo.
+    """
+
+    def __init__(self, db: Session):
+        self.db = db
+        self.ttl_hoje = int(os.getenv('REDE_CACHE_TTL_HOJE', '300'))
+        self.ttl_recente = int(os.getenv('REDE_CACHE_TTL_RECENTE', '3600'))
+        self.ttl_antigo = int(os.getenv('REDE_CACHE_TTL_ANTIGO', '2592000'))
+        self.dias_recentes = int(os.getenv('REDE_CACHE_DIAS_RECENTES', '7'))
+
+    @staticmethod
+    def gerar_chave(endpoint: str, ambiente: str, company_number: int, data_inicial: date, data_final: date, nsu: int | None = None) -> str:
+        return hashlib.sha256(
+            json.dumps([endpoint, ambiente, int(company_number), data_inicial.isoformat(), data_final.isoformat(), str(nsu or '')]).encode()
+        ).hexdigest()
+
+    def calcular_ttl(self, data_final: date) -> int:
+        dias = (date.today() - data_final).days
+        if dias <= 0:
+            return self.ttl_hoje
+        if dias <= self.dias_recentes:
+            return self.ttl_recente
+        return self.ttl_antigo
+
+    def obter(self, endpoint: str, ambiente: str, company_number: int, data_inicial: date, data_final: date, nsu: int | None = None) -> dict | None:
+        registro = (
+            self.db.query(RespostaCache)
+            .filter(RespostaCache.chave == self.gerar_chave(endpoint, ambiente, company_number, data_inicial, data_final, nsu))
+            .first()
+        )
+        if not registro or registro.expires_at <= datetime.now():
+            return None
+        return json.loads(zlib.decompress(registro.conteudo))
+
+    def salvar(self, conteudo: dict, endpoint: str, ambiente: str, company_number: int, data_inicial: date, data_final: date, nsu: int | None = None) -> RespostaCache:
+        chave = self.gerar_chave(endpoint, ambiente, company_number, data_inicial, data_final, nsu)
+        compactado = zlib.compress(json.dumps(conteudo, separators=(',', ':')).encode())
+        expires_at = datetime.now() + timedelta(seconds=self.calcular_ttl(data_final))
+
+        registro = (
+            self.db.query(RespostaCache)
+            .filter(RespostaCache.chave == chave)
+            .first()
+        )
+
+        if registro:
+            registro.conteudo = compactado
+            registro.expires_at = expires_at
+        else:
+            registro = RespostaCache(
+                chave=chave,
+                endpoint=endpoint,
+                ambiente=ambiente,
+                company_number=int(company_number),
+                data_inicial=data_inicial,
+                data_final=data_final,
+                nsu=str(nsu) if nsu else None,
+                conteudo=compactado,
+                expires_at=expires_at,
+            )
+            self.db.add(registro)
+
+        self.db.commit()
+        return registro
+
+    def limpar_expirados(self) -> int:
+        removidos = (
+            self.db.query(RespostaCache)
+            .filter(RespostaCache.expires_at <= datetime.now())
+            .delete()
+        )
+        self.db.commit()
+        return removidos
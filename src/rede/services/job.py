@@ -0,0 +1,256 @@
+import os, json, uuid, threading
+from datetime import date, datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.orm import Session
+from dotenv import load_dotenv
+from src.rede.database.database import get_session
+from src.rede.database.models import Job
+from src.rede.services.rotina import RotinaService
+from src.rede.utils.log import set_logger
+logger = set_logger(__name__)
+load_dotenv()
+
+def agora() -> datetime:
+    return datetime.now(timezone(timedelta(hours=-3)))
+
+class JobService:
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def criar(self, tipo: str, parametros: dict, progresso: dict) -> Job:
+        job = Job(
+            id=uuid.uuid4().hex,
+            tipo=tipo,
+            status="pendente",
+            parametros=json.dumps(parametros, default=str),
+            progresso=json.dumps(progresso, default=str),
+        )
+        self.db.add(job)
+        self.db.commit()
+        self.db.refresh(job)
+        return job
+
+    def obter(self, job_id: str) -> Job | None:
+        return (
+            self.db.query(Job)
+            .filter(Job.id == job_id)
+            .first()
+        )
+
+    def atualizar(self, job_id: str, **campos) -> Job | None:
+        job = self.obter(job_id)
+        if not job:
+            return None
+        for campo, valor in campos.items():
+            if campo in ("progresso", "resultado") and not isinstance(valor, str):
+                valor = json.dumps(valor, default=str)
+            setattr(job, campo, valor)
+        self.db.commit()
+        self.db.refresh(job)
+        return job
+
+    def marcar_interrompidos(self) -> int:
+        """ Jobs em execução quando o processo foi encerrado não serão retomados """
+
+        interrompidos = (
+            self.db.query(Job)
+            .filter(Job.status.in_(["pendente", "executando"]))
+            .update({"status": "interrompido", "mensagem": "Processo encerrado antes da conclusão.", "finished_at": agora()},
+                    synchronize_session=False)
+        )
+        self.db.commit()
+        return interrompidos
+
+    @staticmethod
+    def formatar(job: Job) -> dict:
+        return {
+            "job_id": job.id,
+            "tipo": job.tipo,
+            "status": job.status,
+            "parametros": json.loads(job.parametros or "{}"),
+            "progresso": json.loads(job.progresso or "{}"),
+            "resultado": json.loads(job.resultado) if job.resultado else None,
+            "mensagem": job.mensagem,
+            "created_at": job.created_at,
+            "started_at": job.started_at,
+            "finished_at": job.finished_at,
+        }
+
+class ExecutorJobs:
+    """
+    Executa as rotinas longas fora da requisição HTTP, em até JOBS_MAX_WORKERS threads.
+    O estado e o progresso de cada job (por empresa e por dia) ficam na tabela jobs.
+    """
+
+    def __init__(self, max_workers: int | None = None, rotina: RotinaService | None = None):
+        self.max_workers = max_workers or int(os.getenv('JOBS_MAX_WORKERS', '2'))
+        self.rotina = rotina or RotinaService()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+        # Sinalizado no encerramento: os jobs em execução param na próxima etapa sem avançar a última data conciliada
+        self.cancelamento = threading.Event()
+
+    def registrar(self, tipo: str, parametros: dict, progresso: dict) -> str:
+        with get_session() as session:
+            try:
+                return JobService(db=session).criar(tipo=tipo, parametros=parametros, progresso=progresso).id
+            finally:
+                session.close()
+
+    def atualizar_job(self, job_id: str, **campos) -> bool:
+        status: bool = False
+        with get_session() as session:
+            try:
+                JobService(db=session).atualizar(job_id, **campos)
+                status = True
+            except Exception as e:
+                logger.error(f"Erro ao atualizar o job {job_id}: {e}")
+            finally:
+                session.close()
+        return status
+
+    def consultar(self, job_id: str) -> dict | None:
+        with get_session() as session:
+            try:
+                job = JobService(db=session).obter(job_id)
+                return JobService.formatar(job) if job else None
+            finally:
+                session.close()
+
+    def marcar_interrompidos(self) -> int:
+        interrompidos: int = 0
+        with get_session() as session:
+            try:
+                interrompidos = JobService(db=session).marcar_interrompidos()
+                if interrompidos:
+                    logger.warning(f"{interrompidos} job(s) marcado(s) como interrompido(s).")
+            except Exception as e:
+                logger.error(f"Erro ao marcar jobs interrompidos: {e}")
+            finally:
+                session.close()
+        return interrompidos
+
+    def submeter_atualizacao_pagamento(self, companyNumbers: list[int], startDate: date, endDate: date, forcar: bool = False) -> str:
+        """
+        Enfileira a atualização de dados de pagamento, processada empresa a empresa, com o progresso por dia.
+            :return str: id do job.
+        """
+        dias = [(startDate + timedelta(days=i)).isoformat() for i in range((endDate - startDate).days + 1)]
+        job_id = self.registrar(
+            tipo="atualiza-pagamento",
+            parametros={"companyNumbers": companyNumbers, "startDate": startDate, "endDate": endDate, "forcar": forcar},
+            progresso={str(cn): {dia: "pendente" for dia in dias} for cn in companyNumbers},
+        )
+        self.executor.submit(self.executar_atualizacao_pagamento, job_id, companyNumbers, dias, forcar)
+        logger.info(f"Job {job_id} de atualização de pagamentos enfileirado ({len(companyNumbers)} empresa(s), {len(dias)} dia(s)).")
+        return job_id
+
+    def submeter_registro_pagamento(self, companyNumber: int, dataVendas: date, nsu: int) -> str:
+        """
+        Enfileira o registro de dados de pagamento de uma venda.
+            :return str: id do job.
+        """
+        job_id = self.registrar(
+            tipo="registra-pagamento",
+            parametros={"companyNumber": companyNumber, "dataVendas": dataVendas, "nsu": nsu},
+            progresso={str(companyNumber): {dataVendas.isoformat(): "pendente"}},
+        )
+        self.executor.submit(self.executar_registro_pagamento, job_id, companyNumber, dataVendas, nsu)
+        logger.info(f"Job {job_id} de registro de pagamento enfileirado.")
+        return job_id
+
+    def executar_atualizacao_pagamento(self, job_id: str, companyNumbers: list[int], dias: list[str], forcar: bool):
+
+        progresso: dict = {str(cn): {dia: "pendente" for dia in dias} for cn in companyNumbers}
+        resultado: dict = {}
+        self.atualizar_job(job_id, status="executando", started_at=agora())
+        try:
+            rotina = self.rotina
+            for cn in companyNumbers:
+                # Uma única execução por empresa, para todo o período ainda não conciliado
+                retorno = rotina.atualizar_dados_pagamento_incremental(companyNumber=cn,
+                                                                       startDate=date.fromisoformat(dias[0]),
+                                                                       endDate=date.fromisoformat(dias[-1]),
+                                                                       forcar=forcar,
+                                                                       cancelamento=self.cancelamento)
+                resultado[str(cn)] = retorno
+                progresso[str(cn)] = self.calcular_progresso_dias(dias=dias, retorno=retorno)
+                self.atualizar_job(job_id, progresso=progresso)
+            falhas = [cn for cn, dias_cn in progresso.items() if any(st != "concluido" for st in dias_cn.values())]
+            self.atualizar_job(job_id,
+                               status="falha" if falhas else "concluido",
+                               resultado=resultado,
+                               mensagem=f"Falha ao atualizar as empresas {falhas}." if falhas else "",
+                               finished_at=agora())
+        except Exception as e:
+            logger.error(f"Erro no job {job_id}: {e}", exc_info=True)
+            self.atualizar_job(job_id, status="falha", progresso=progresso, resultado=resultado, mensagem=str(e), finished_at=agora())
+        finally:
+            pass
+
+    @staticmethod
+    def calcular_progresso_dias(dias: list[str], retorno: dict) -> dict:
+        """
+        Progresso por dia a partir do resultado da execução da empresa: os dias anteriores ao período
+        pendente já estavam conciliados; no período pendente, os dias até 'concluido_ate' foram concluídos,
+        o dia seguinte falhou e os demais não foram processados.
+        """
+        if retorno.get("sucesso"):
+            return {dia: "concluido" for dia in dias}
+        periodo: dict = retorno.get("periodo") or {}
+        inicio: str = periodo.get("startDate").isoformat() if periodo.get("startDate") else dias[0]
+        concluido_ate: str = retorno.get("concluido_ate").isoformat() if retorno.get("concluido_ate") else ""
+        progresso: dict = {}
+        falhou: bool = False
+        for dia in dias:
+            if dia < inicio or dia <= concluido_ate:
+                progresso[dia] = "concluido"
+            elif not falhou:
+                progresso[dia] = "falha"
+                falhou = True
+            else:
+                progresso[dia] = "ignorado"
+        return progresso
+
+    def executar_registro_pagamento(self, job_id: str, companyNumber: int, dataVendas: date, nsu: int):
+
+        self.atualizar_job(job_id, status="executando", started_at=agora())
+        try:
+            retorno = self.rotina.registrar_dados_pagamento(companyNumber=companyNumber, dataVendas=dataVendas, nsu=nsu)
+            self.atualizar_job(job_id,
+                               status="concluido" if retorno.get("sucesso") else "falha",
+                               progresso={str(companyNumber): {dataVendas.isoformat(): "concluido" if retorno.get("sucesso") else "falha"}},
+                               resultado=retorno,
+                               mensagem=retorno.get("mensagem"),
+                               finished_at=agora())
+        except Exception as e:
+            logger.error(f"Erro no job {job_id}: {e}", exc_info=True)
+            self.atualizar_job(job_id, status="falha", mensagem=str(e), finished_at=agora())
+        finally:
+            pass
+
+    def encerrar(self):
+        self.cancelamento.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+_executor_jobs: ExecutorJobs = None
+_executor_jobs_lock = threading.Lock()
+
+def obter_executor_jobs(rotina: RotinaService | None = None) -> ExecutorJobs:
+    """ Retorna o executor de jobs do processo, criando-o na primeira chamada """
+
+    global _executor_jobs
+    if _executor_jobs is None:
+        with _executor_jobs_lock:
+            if _executor_jobs is None:
+                _executor_jobs = ExecutorJobs(rotina=rotina)
+    return _executor_jobs
+
+def encerrar_executor_jobs():
+    """ Encerra o executor de jobs; jobs ainda não iniciados são descartados """
+
+    global _executor_jobs
+    with _executor_jobs_lock:
+        if _executor_jobs is not None:
+            _executor_jobs.encerrar()
+            _executor_jobs = None
@@ -1,17 +1,70 @@
-import os, base64, requests, json
-from typing import Literal
+import os, base64, requests, json, hashlib, threading, time
+from typing import Literal, Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime, timedelta
 from dotenv import load_dotenv
 from src.rede.utils.log import set_logger
-from src.rede.services.token import TokenService
+from src.rede.services.token import TokenService, cache_token
+from src.rede.services.cache_resposta import CacheRespostaService
 from src.rede.database.database import get_session
+from src.rede.utils.http import TransporteHttp, obter_transporte, resposta_ok
+from src.rede.utils.concorrencia import mapear_em_ordem
+from src.rede.utils.metricas import tokens_gerados, registros_buscados
 logger = set_logger(__name__)
 load_dotenv()
 
+class TokensValidados:
+    """
+    Tokens informados pelos chamadores que já consultaram uma empresa com sucesso na Rede.
+    Um token só é atendido pelo cache de respostas enquanto a validação estiver vigente:
+    no máximo REDE_TOKEN_VALIDADO_TTL segundos, limitado ao prazo do cache do período consultado.
+    Depois disso a consulta volta a passar pela Rede, que recusa tokens expirados ou revogados.
+    """
+
+    def __init__(self,ttl:int=None,maximo:int=None):
+        self.ttl:int = ttl or int(os.getenv('REDE_TOKEN_VALIDADO_TTL', '300'))
+        self.maximo:int = maximo or int(os.getenv('REDE_TOKENS_VALIDADOS_MAX', '10000'))
+        # (hash do token, companyNumber) -> instante (monotonic) em que a validação expira
+        self.validades:dict[tuple[str,int],float] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def gerar_chave(token:str,companyNumber:int) -> tuple[str,int]:
+        return (hashlib.sha256(token.encode()).hexdigest(), int(companyNumber))
+
+    def registrar(self,token:str,companyNumber:int,ttl:int=None):
+        agora = time.monotonic()
+        with self._lock:
+            self.remover_expirados(agora)
+            chave = self.gerar_chave(token,companyNumber)
+            self.validades.pop(chave, None)
+            self.validades[chave] = agora + min(self.ttl, ttl if ttl is not None else self.ttl)
+            # Limite de tamanho: descarta as validações mais antigas
+            while len(self.validades) > self.maximo:
+                self.validades.pop(next(iter(self.validades)))
+
+    def valido(self,token:str,companyNumber:int) -> bool:
+        chave = self.gerar_chave(token,companyNumber)
+        with self._lock:
+            validade = self.validades.get(chave)
+            if validade is None:
+                return False
+            if validade <= time.monotonic():
+                del self.validades[chave]
+                return False
+            return True
+
+    def remover_expirados(self,agora:float):
+        for chave in [chave for chave, validade in self.validades.items() if validade <= agora]:
+            del self.validades[chave]
+
+tokens_validados = TokensValidados()
+
 class AutenticacaoService:
 
-    def __init__(self,ambiente: Literal['trn', 'prd']='prd',pacote: Literal['pgto', 'vendas']='vendas',auth:str=''):
+    def __init__(self,ambiente: Literal['trn', 'prd']='prd',pacote: Literal['pgto', 'vendas']='vendas',auth:str='',transporte:TransporteHttp=None):
         self.sistema = 'rede'
+        self.http = transporte or obter_transporte()
         self.ambiente = ambiente
         self.pacote = pacote
         self.auth = os.getenv('BASIC_CLIENT_SP',auth)
@@ -90,45 +143,46 @@ class AutenticacaoService:
             pass
         return True
 
-    def gerar_token(self) -> dict:
-        
+    def montar_requisicao_token(self) -> dict:
+
         self.dados_ambiente = self.validar_ambiente_auth()
-        res:requests.Response=None
-        dados:dict={}
-        header:dict={}
-        body:dict={}
+        assert isinstance(self.dados_ambiente,dict)
+        if not self.dados_ambiente:
+            raise ValueError("Não foi possível validar o ambiente")
 
-        try:
-            assert isinstance(self.dados_ambiente,dict)
-            if not self.dados_ambiente:
-                raise ValueError("Não foi possível validar o ambiente")
-            
-            if not self.dados_ambiente:
-                raise ValueError("Não foi possível validar o ambiente")
-            
-            header={
+        return {
+            "url": self.dados_ambiente.get('url'),
+            "headers": {
                 "Authorization": self.dados_ambiente.get('authorization'),
                 "Content-Type": "application/x-www-form-urlencoded"
-            }
-
-            body={
+            },
+            "data": {
                 "grant_type":"client_credentials"
             }
-            
-            res = requests.post(
-                url=self.dados_ambiente.get('url'),
-                headers=header,
-                data=body
-            )
+        }
+
+    def tratar_retorno_token(self,res) -> dict:
+
+        dados:dict={}
+        if res is not None and resposta_ok(res):
+            dados = res.json()
+            self.calcular_expiracao(dados=dados)
+        elif res is not None:
+            raise ConnectionError(f"Erro {res.status_code}: {res.text}")
+        else:
+            raise ConnectionError("Erro na requisição do token: sem resposta")
+        return dados
+
+    def gerar_token(self) -> dict:
+
+        res:requests.Response=None
+        try:
+            res = self.http.post(**self.montar_requisicao_token())
         except Exception as e:
             logger.error(f"Erro na requisição do token: {e}")
         finally:
-            if res and res.ok:
-                dados = res.json()
-                self.calcular_expiracao(dados=dados)
-            else:           
-                raise ConnectionError(f"Erro {res.status_code}: {res.text}")
-        return dados
+            pass
+        return self.tratar_retorno_token(res)
 
     def salvar_token_arquivo(self, token: dict) -> bool:
         """
@@ -162,7 +216,9 @@ class AutenticacaoService:
                     sistema=self.sistema,
                     access_token=token.get('access_token', ''),
                     refresh_token=token.get('refresh_token', ''),
-                    expires_at=datetime.strptime(token['expire_time'], '%Y-%m-%d %H:%M:%S') if token.get('expire_time') else None
+                    expires_at=datetime.strptime(token['expire_time'], '%Y-%m-%d %H:%M:%S') if token.get('expire_time') else None,
+                    ambiente=self.ambiente,
+                    pacote=self.pacote
                 )
                 status = True
             except Exception as e:
@@ -198,7 +254,7 @@ class AutenticacaoService:
         with get_session() as session:
             token_servicedb = TokenService(db=session)
             try:
-                token = token_servicedb.obter_token(sistema=self.sistema)
+                token = token_servicedb.obter_token(sistema=self.sistema,ambiente=self.ambiente,pacote=self.pacote)
                 if token:
                     return token.__dict__
                 else:
@@ -227,28 +283,46 @@ class AutenticacaoService:
             self.token = token.get('access_token', '')
             return token.get('access_token', '')
 
+    def chave_token(self) -> tuple:
+        return (self.sistema, self.ambiente, self.pacote)
+
+    def registrar_token_gerado(self,token:dict) -> dict:
+        """
+        Persiste o token recém-gerado e o converte para o formato do cache de tokens.
+            :param token: retorno de gerar_token.
+            :return dict: {access_token, expires_at}.
+        """
+        tokens_gerados.incrementar(sistema=self.sistema,ambiente=self.ambiente,pacote=self.pacote,resultado="sucesso" if token else "falha")
+        if not token:
+            return {}
+        self.salvar_token(token)
+        return {
+            "access_token": token.get('access_token', ''),
+            "expires_at": datetime.strptime(token['expire_time'], '%Y-%m-%d %H:%M:%S') if token.get('expire_time') else None
+        }
+
+    def renovar_token(self) -> dict:
+        return self.registrar_token_gerado(self.gerar_token())
+
     def autenticar(self) -> bool:
         """
         Realiza o processo de autenticação, verificando se o token existente é válido ou se é necessário solicitar um novo token.
-            :return str: token de acesso válido para uso nas requisições à API.
+        O token é mantido no cache do processo; o banco de dados só é lido na primeira chamada e gravado quando o token é renovado.
+            :return bool: True se há um token de acesso válido em self.token.
         """
-        token:dict = self.carregar_token()
-        if not token or not token.get('expires_at') or token.get('expires_at') <= datetime.now():
-            token = self.gerar_token()
-            if token:
-                self.salvar_token(token)
-                self.token = token.get('access_token', '')
-                return True
-            else:
-                return False
-        else:
-            self.token = token.get('access_token', '')
-            return True
+        cache_token.registrar_renovacao(self.chave_token(), self.renovar_token)
+        token:dict = cache_token.obter_ou_renovar(chave=self.chave_token(),
+                                                  carregar=self.carregar_token,
+                                                  gerar=self.renovar_token)
+        if not token:
+            return False
+        self.token = token.get('access_token', '')
+        return True
 
 class LinkPagamentoService(AutenticacaoService):
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self,transporte:TransporteHttp=None):
+        super().__init__(transporte=transporte)
 
     def validar_ambiente_link(self,ambiente: Literal['trn', 'prd']=None) -> str:
         ambientes_validos = ['trn','prd']
@@ -275,61 +349,59 @@ class LinkPagamentoService(AutenticacaoService):
             pass
         return url
 
+    def montar_cabecalho(self,companyNumber:str,token:str=None) -> dict:
+
+        if not token:
+            token = self.token
+
+        return {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+            "Company-number": str(companyNumber)
+        }
+
+    def tratar_retorno_link(self,res,descricao:str) -> dict:
+
+        if res is None:
+            raise ConnectionError(f"Erro na {descricao}: sem resposta")
+        if not resposta_ok(res):
+            raise ConnectionError(f"Erro {res.status_code} na {descricao}: {res.text}")
+        return res.json()
+
     def consultar_detalhes_link(self,paymentLinkId:str,companyNumber:str,ambiente: Literal['trn', 'prd']=None,token:str=None) -> dict:
 
-        data:dict={}
         url:str=''
         header:dict={}
         res:requests.Response=None
 
         url=self.validar_ambiente_link(ambiente=ambiente)
         url+=f'/details/{paymentLinkId}'
-
-        header={
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-            "Company-number": str(companyNumber)
-        }
-        
-        if not token:
-            token = self.token        
+        header=self.montar_cabecalho(companyNumber=companyNumber,token=token)
 
         try:
-            res=requests.get(
+            res=self.http.get(
                 url=url,
                 headers=header
             )
         except Exception as e:
             raise ConnectionError(f"Erro na consulta do link de pagamento {paymentLinkId}: {e}")
         finally:
-            if res.ok:
-                data = res.json()
-            else:
-                raise ConnectionError(f"Erro {res.status_code} na consulta do link de pagamento {paymentLinkId}: {res.text}")
-        
-        return data
+            pass
+
+        return self.tratar_retorno_link(res,descricao=f"consulta do link de pagamento {paymentLinkId}")
 
     def criar_link(self,companyNumber:str,body:dict,ambiente: Literal['trn', 'prd']=None,token:str=None) -> dict:
 
-        data:dict={}
         url:str=''
         header:dict={}
         res:requests.Response=None
 
         url = self.validar_ambiente_link(ambiente=ambiente)
         url+='/create'
-        
-        if not token:
-            token = self.token        
-
-        header={
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json",
-            "Company-number": str(companyNumber)
-        }
+        header=self.montar_cabecalho(companyNumber=companyNumber,token=token)
 
         try:
-            res = requests.post(
+            res = self.http.post(
                 url=url,
                 headers=header,
                 json=body
@@ -337,17 +409,92 @@ class LinkPagamentoService(AutenticacaoService):
         except Exception as e:
             raise ConnectionError(f"Erro na criação do link de pagamento: {e}")
         finally:
-            if res.ok:
-                data = res.json()
-            else:
-                raise ConnectionError(f"Erro {res.status_code} na criação do link de pagamento: {res.text}")
-        
-        return data
+            pass
+
+        return self.tratar_retorno_link(res,descricao="criação do link de pagamento")
 
 class VendasService(AutenticacaoService):
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self,transporte:TransporteHttp=None):
+        super().__init__(transporte=transporte)
+        self.dias_por_lote:int = int(os.getenv('REDE_DIAS_POR_LOTE', '1'))
+        self.max_workers:int = int(os.getenv('REDE_MAX_WORKERS', '4'))
+        self.cache_ativo:bool = os.getenv('REDE_CACHE_ATIVO', '1') == '1'
+        self.limite_lote:int = int(os.getenv('REDE_LIMITE_LOTE', '10'))
+
+    def ler_cache(self,endpoint:str,companyNumber:int,startDate:date,endDate:date,nsu:int=None,token:str=None,ambiente:Literal['trn', 'prd']=None) -> dict | None:
+        """
+        Lê do cache persistente a resposta de uma janela do merchant-statement.
+            :return dict | None: resposta armazenada, ou None se não houver resposta válida.
+        """
+        data:dict = None
+        if not self.cache_ativo:
+            return data
+        if token and not tokens_validados.valido(token,companyNumber):
+            return data
+        with get_session() as session:
+            cache_servicedb = CacheRespostaService(db=session)
+            try:
+                data = cache_servicedb.obter(endpoint=endpoint,ambiente=ambiente or self.ambiente,company_number=companyNumber,
+                                             data_inicial=startDate,data_final=endDate,nsu=nsu)
+            except Exception as e:
+                logger.error(f"Erro ao ler o cache de respostas: {e}")
+            finally:
+                session.close()
+        if data is not None:
+            logger.info(f"Consulta de {endpoint} da empresa {companyNumber} ({startDate} a {endDate}) atendida pelo cache.")
+        return data
+
+    def gravar_cache(self,data:dict,endpoint:str,companyNumber:int,startDate:date,endDate:date,nsu:int=None,token:str=None,ambiente:Literal['trn', 'prd']=None) -> bool:
+        """ Grava no cache persistente a resposta completa (todas as páginas) de uma janela do merchant-statement """
+
+        status:bool = False
+        self.registrar_token_validado(token=token,companyNumber=companyNumber,endDate=endDate)
+        if not self.cache_ativo:
+            return status
+        with get_session() as session:
+            cache_servicedb = CacheRespostaService(db=session)
+            try:
+                cache_servicedb.salvar(conteudo=data,endpoint=endpoint,ambiente=ambiente or self.ambiente,company_number=companyNumber,
+                                       data_inicial=startDate,data_final=endDate,nsu=nsu)
+                status = True
+            except Exception as e:
+                logger.error(f"Erro ao gravar o cache de respostas: {e}")
+            finally:
+                session.close()
+        return status
+
+    def registrar_token_validado(self,token:str,companyNumber:int,endDate:date):
+        """ Marca o token do chamador como aceito pela Rede para a empresa, pelo prazo do cache do período """
+
+        if token:
+            tokens_validados.registrar(token,companyNumber,ttl=CacheRespostaService(db=None).calcular_ttl(endDate))
+
+    def dividir_periodo(self,startDate:date,endDate:date,dias:int=None) -> list[tuple[date,date]]:
+        """
+        Divide o período em janelas consecutivas de até `dias` dias.
+            :param startDate: data inicial.
+            :param endDate: data final.
+            :param dias: tamanho de cada janela. Padrão: REDE_DIAS_POR_LOTE.
+            :return list[tuple[date,date]]: janelas (início, fim) em ordem cronológica.
+        """
+        dias = max(1, dias or self.dias_por_lote)
+        periodos:list[tuple[date,date]] = []
+        inicio = startDate
+        while inicio <= endDate:
+            fim = min(inicio + timedelta(days=dias-1), endDate)
+            periodos.append((inicio, fim))
+            inicio = fim + timedelta(days=1)
+        return periodos
+
+    def juntar_periodos(self,resultados:list[dict],chave:str,mensagem:str) -> dict:
+
+        data:dict={}
+        for resultado in resultados:
+            data = self.acumular_pagina(data=data,pagina=resultado,chave=chave)
+        if 'content' not in data:
+            data = {"message": mensagem}
+        return data
 
     def validar_ambiente_vendas(self,ambiente: Literal['trn', 'prd']=None) -> str:
 
@@ -370,124 +517,375 @@ class VendasService(AutenticacaoService):
                 raise ValueError(f"Ambiente inválido:\n>>{ambiente}")           
         return url
 
-    def consultar_vendas_parceladas(self,companyNumber:int,startDate:date,endDate:date,nsu:int=None,token:str=None,ambiente:Literal['trn', 'prd']=None) -> dict:
+    def montar_cabecalho(self,token:str=None) -> dict:
 
-        data:dict={}
-        url:str=''
-        header:dict={}
-        res:requests.Response=None
+        if not token:
+            token = self.token
 
-        url=self.validar_ambiente_vendas(ambiente=ambiente)
+        return {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json"
+        }
+
+    def montar_url_vendas_parceladas(self,companyNumber:int,startDate:date,endDate:date,nsu:int=None,ambiente:Literal['trn', 'prd']=None) -> str:
+
+        url:str=self.validar_ambiente_vendas(ambiente=ambiente)
         if nsu:
             url+=f"/v2/payments/installments/{companyNumber}?saleDate={startDate.strftime('%Y-%m-%d')}&nsu={nsu}"
         else:
             url+=f"/v1/sales/installments?parentCompanyNumber={companyNumber}&subsidiaries={companyNumber}&startDate={startDate.strftime('%Y-%m-%d')}&endDate={endDate.strftime('%Y-%m-%d')}"
+        return url
 
-        if not token:
-            token = self.token
+    def tratar_retorno_vendas_parceladas(self,res,startDate:date,nsu:int=None) -> dict:
 
-        header={
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
+        data:dict={}
+        if res is None:
+            raise ConnectionError("Erro na consulta de vendas parceladas: sem resposta")
+        match res.status_code:
+            case 200:
+                data = res.json()
+            case 204:
+                data = {
+                    "message": f"A consulta não retornou dados. NSU: {nsu}. Data: {startDate.strftime('%d/%m/%Y')}"
+                    }
+            case _:
+                raise ConnectionError(f"Erro {res.status_code} na consulta de vendas parceladas: {res.text}")
+        return data
+
+    def montar_url_pagina(self,url:str,pageKey:str=None) -> str:
+        """
+        Acrescenta os parâmetros de paginação do merchant-statement à URL.
+            :param url: URL da consulta, já com a query string.
+            :param pageKey: chave da página retornada no cursor da página anterior.
+        """
+        tamanho_pagina = os.getenv('REDE_TAMANHO_PAGINA')
+        if tamanho_pagina:
+            url+=f"&size={tamanho_pagina}"
+        if pageKey:
+            url+=f"&pageKey={pageKey}"
+        return url
 
+    def obter_proxima_pagina(self,data:dict) -> str:
+        cursor:dict = data.get('cursor') or {}
+        if cursor.get('hasNextKey') and cursor.get('nextKey'):
+            return cursor.get('nextKey')
+        return None
+
+    def acumular_pagina(self,data:dict,pagina:dict,chave:str) -> dict:
+        """
+        Junta os registros de uma página ao resultado acumulado da consulta.
+            :param data: resultado acumulado até a página anterior.
+            :param pagina: página recebida da API.
+            :param chave: lista de registros dentro de 'content' (installments, paymentsCreditOrders).
+            :return dict: resultado acumulado.
+        """
+        if not data or 'content' not in data:
+            return pagina
+        data['content'].setdefault(chave,[]).extend(pagina.get('content',{}).get(chave,[]))
+        data['cursor'] = pagina.get('cursor')
+        return data
+
+    def registrar_pagina(self,pagina:dict) -> dict:
+        """ Contabiliza nas métricas os registros recebidos em uma página do merchant-statement """
+
+        for chave, itens in (pagina.get('content') or {}).items():
+            if isinstance(itens, list):
+                registros_buscados.incrementar(len(itens),origem=f"rede.{chave}")
+        return pagina
+
+    def buscar_pagina(self,url:str,header:dict,tratar_retorno:Callable,pageKey:str=None,descricao:str='consulta paginada') -> dict:
+
+        res:requests.Response=None
         try:
-            res = requests.get(
-                url=url,
+            res = self.http.get(
+                url=self.montar_url_pagina(url=url,pageKey=pageKey),
                 headers=header
             )
         except Exception as e:
-            raise ConnectionError(f"Erro na consulta de vendas parceladas: {e}")
+            raise ConnectionError(f"Erro na {descricao}: {e}")
         finally:
-            match res.status_code:
-                case 200:
-                    data = res.json()
-                    self.dados_vendas_parceladas = data.get("content",{}).get("installments",[])
-                case 204:
-                    data = {
-                        "message": f"A consulta não retornou dados. NSU: {nsu}. Data: {startDate.strftime('%d/%m/%Y')}"
-                        }
-                case _:
-                    raise ConnectionError(f"Erro {res.status_code} na consulta de vendas parceladas: {res.text}")
-        return data
-    
-    def consultar_pagamentos_oc(self,companyNumber:int,startDate:date,endDate:date,token:str=None,ambiente:Literal['trn', 'prd']=None) -> dict:
+            pass
+        return self.registrar_pagina(tratar_retorno(res))
 
-        data:dict={}
-        url:str=''
-        header:dict={}
-        res:requests.Response=None    
+    def iterar_paginas(self,url:str,header:dict,tratar_retorno:Callable,prefetch:bool=False,descricao:str='consulta paginada') -> Iterator[dict]:
+        """
+        Percorre as páginas de uma consulta do merchant-statement seguindo o cursor da resposta.
+            :param url: URL da consulta.
+            :param header: cabeçalhos da requisição.
+            :param tratar_retorno: função que valida a resposta e retorna o corpo.
+            :param prefetch: busca a próxima página em segundo plano enquanto a atual é processada.
+            :param descricao: descrição da consulta usada nas mensagens de erro.
+            :return Iterator[dict]: corpo de cada página.
+        """
+        executor:ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+        try:
+            pagina = self.buscar_pagina(url=url,header=header,tratar_retorno=tratar_retorno,descricao=descricao)
+            while True:
+                pageKey = self.obter_proxima_pagina(pagina)
+                futuro = executor.submit(self.buscar_pagina,url,header,tratar_retorno,pageKey,descricao) if executor and pageKey else None
+                yield pagina
+                if not pageKey:
+                    break
+                pagina = futuro.result() if futuro else self.buscar_pagina(url=url,header=header,tratar_retorno=tratar_retorno,pageKey=pageKey,descricao=descricao)
+        finally:
+            if executor:
+                executor.shutdown(wait=False,cancel_futures=True)
 
-        url=self.validar_ambiente_vendas(ambiente=ambiente)
-        url+=f'/v1/payments/credit-orders?parentCompanyNumber={companyNumber}&subsidiaries={companyNumber}&startDate={startDate.strftime('%Y-%m-%d')}&endDate={endDate.strftime('%Y-%m-%d')}'
-        
-        if not token:
-            token = self.token
+    def consultar_periodo(self,consulta:dict) -> dict:
+        """
+        Consulta todas as páginas de uma janela, usando o cache de respostas.
+            :param consulta: parâmetros da janela (montar_consulta_vendas_parceladas, montar_consulta_pagamentos_oc).
+            :return dict: resposta única com os registros de todas as páginas.
+        """
+        data:dict = self.ler_cache(**consulta['cache'])
+        if data is not None:
+            return data
+
+        data = {}
+        for pagina in self.iterar_paginas(url=consulta['url'],
+                                          header=consulta['header'],
+                                          tratar_retorno=consulta['tratar_retorno'],
+                                          descricao=consulta['descricao']):
+            data = self.acumular_pagina(data=data,pagina=pagina,chave=consulta['chave'])
+
+        self.gravar_cache(data,**consulta['cache'])
+        return data
 
-        header={
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
+    def iterar_periodo(self,consulta:dict,prefetch:bool=False) -> Iterator[list[dict]]:
+        """
+        Retorna os registros de uma janela, página a página.
+        Lê o cache de respostas, mas não o grava: as páginas não são acumuladas em memória.
+        """
+        data:dict = self.ler_cache(**consulta['cache'])
+        if data is not None:
+            yield data.get("content",{}).get(consulta['chave'],[])
+            return
+
+        for pagina in self.iterar_paginas(url=consulta['url'],
+                                          header=consulta['header'],
+                                          tratar_retorno=consulta['tratar_retorno'],
+                                          prefetch=prefetch,
+                                          descricao=consulta['descricao']):
+            yield pagina.get("content",{}).get(consulta['chave'],[])
+        self.registrar_token_validado(token=consulta['cache']['token'],companyNumber=consulta['cache']['companyNumber'],endDate=consulta['cache']['endDate'])
+
+    def consultar_janelas(self,consultar_janela:Callable[[tuple[date,date]],dict],periodos:list[tuple[date,date]],chave:str,mensagem:str) -> dict:
+        """ Consulta as janelas em paralelo e junta os resultados em ordem cronológica """
+
+        return self.juntar_periodos(resultados=mapear_em_ordem(consultar_janela,periodos,self.max_workers),chave=chave,mensagem=mensagem)
+
+    def iterar_janelas(self,iterar_janela:Callable[[tuple[date,date]],Iterator[list[dict]]],periodos:list[tuple[date,date]]) -> Iterator[list[dict]]:
+        """ Consulta as janelas em paralelo e retorna os registros de cada uma em ordem cronológica """
+
+        yield from mapear_em_ordem(lambda periodo: [item for pagina in iterar_janela(periodo) for item in pagina],periodos,self.max_workers)
+
+    def montar_consulta_vendas_parceladas(self,companyNumber:int,startDate:date,endDate:date,nsu:int=None,token:str=None,ambiente:Literal['trn', 'prd']=None) -> dict:
+        """ Parâmetros de uma janela da consulta de vendas parceladas """
+
+        return {
+            "cache": dict(endpoint="vendas_parceladas",companyNumber=companyNumber,startDate=startDate,endDate=endDate,nsu=nsu,token=token,ambiente=ambiente),
+            "url": self.montar_url_vendas_parceladas(companyNumber=companyNumber,startDate=startDate,endDate=endDate,nsu=nsu,ambiente=ambiente),
+            "header": self.montar_cabecalho(token=token),
+            "tratar_retorno": lambda res: self.tratar_retorno_vendas_parceladas(res,startDate=startDate,nsu=nsu),
+            "descricao": "consulta de vendas parceladas",
+            "chave": "installments"
         }
 
+    def iterar_vendas_parceladas_periodo(self,companyNumber:int,startDate:date,endDate:date,nsu:int=None,token:str=None,ambiente:Literal['trn', 'prd']=None,prefetch:bool=False) -> Iterator[list[dict]]:
+        """ Retorna as parcelas de uma única janela da consulta de vendas parceladas, página a página """
+
+        return self.iterar_periodo(self.montar_consulta_vendas_parceladas(companyNumber=companyNumber,startDate=startDate,endDate=endDate,nsu=nsu,token=token,ambiente=ambiente),
+                                   prefetch=prefetch)
+
+    def consultar_vendas_parceladas_periodo(self,companyNumber:int,startDate:date,endDate:date,nsu:int=None,token:str=None,ambiente:Literal['trn', 'prd']=None) -> dict:
+
+        return self.consultar_periodo(self.montar_consulta_vendas_parceladas(companyNumber=companyNumber,startDate=startDate,endDate=endDate,nsu=nsu,token=token,ambiente=ambiente))
+
+    def iterar_vendas_parceladas(self,companyNumber:int,startDate:date,endDate:date,nsu:int=None,token:str=None,ambiente:Literal['trn', 'prd']=None,prefetch:bool=False) -> Iterator[list[dict]]:
+        """
+        Retorna as parcelas da consulta de vendas parceladas.
+        Sem NSU, períodos longos são divididos em janelas consultadas em paralelo e
+        retornadas em ordem cronológica, uma lista de parcelas por janela.
+        """
+        periodos = self.dividir_periodo(startDate=startDate,endDate=endDate)
+        if nsu or len(periodos) == 1:
+            return self.iterar_vendas_parceladas_periodo(companyNumber=companyNumber,startDate=startDate,endDate=endDate,nsu=nsu,token=token,ambiente=ambiente,prefetch=prefetch)
+
+        return self.iterar_janelas(lambda periodo: self.iterar_vendas_parceladas_periodo(companyNumber=companyNumber,startDate=periodo[0],endDate=periodo[1],token=token,ambiente=ambiente),
+                                   periodos)
+
+    def consultar_vendas_parceladas(self,companyNumber:int,startDate:date,endDate:date,nsu:int=None,token:str=None,ambiente:Literal['trn', 'prd']=None) -> dict:
+
+        periodos = self.dividir_periodo(startDate=startDate,endDate=endDate)
+        if nsu or len(periodos) == 1:
+            return self.consultar_vendas_parceladas_periodo(companyNumber=companyNumber,startDate=startDate,endDate=endDate,nsu=nsu,token=token,ambiente=ambiente)
+
+        return self.consultar_janelas(lambda periodo: self.consultar_vendas_parceladas_periodo(companyNumber=companyNumber,
+                                                                                             startDate=periodo[0],
+                                                                                             endDate=periodo[1],
+                                                                                             token=token,
+                                                                                             ambiente=ambiente),
+                                      periodos,
+                                      chave="installments",
+                                      mensagem=f"A consulta não retornou dados. NSU: {nsu}. Data: {startDate.strftime('%d/%m/%Y')}")
+
+    def consultar_item_lote(self,item:dict,token:str=None,ambiente:Literal['trn', 'prd']=None) -> dict:
+        """
+        Consulta as parcelas de um item da consulta em lote.
+            :param item: {companyNumber, nsu, saleDate}.
+            :return dict: item com o resultado em 'dados' ou a mensagem de erro em 'erro'.
+        """
+        resultado:dict = {**item, "sucesso": False, "dados": None, "erro": ""}
         try:
-            res = requests.get(
-                url=url,
-                headers=header
-            )
+            resultado['dados'] = self.consultar_vendas_parceladas(companyNumber=item['companyNumber'],
+                                                                  startDate=item['saleDate'],
+                                                                  endDate=item['saleDate'],
+                                                                  nsu=item['nsu'],
+                                                                  token=token,
+                                                                  ambiente=ambiente)
+            resultado['sucesso'] = True
         except Exception as e:
-            raise ConnectionError(f"Erro na consulta de pagamentos: {e}")
+            resultado['erro'] = str(e)
         finally:
-            if res.ok and res.text:
-                data = res.json()
-            elif res.ok and not res.text:
-                data = {
-                    "message": f"A consulta não retornou dados. Período: {startDate.strftime('%d/%m/%Y')} - {endDate.strftime('%d/%m/%Y')}"
-                }
-            else:
-                raise ConnectionError(f"Erro {res.status_code} na consulta de pagamentos: {res.text}")
-        
+            pass
+        return resultado
+
+    def deduplicar_lote(self,itens:list[dict]) -> list[dict]:
+        return list({(item['companyNumber'], item['nsu'], item['saleDate']): item for item in itens}.values())
+
+    def ordenar_lote(self,itens:list[dict],resultados:list[dict]) -> list[dict]:
+        # Devolve um resultado por item de entrada, repetindo o resultado dos itens duplicados
+        por_item = {(r['companyNumber'], r['nsu'], r['saleDate']): r for r in resultados}
+        return [por_item[(item['companyNumber'], item['nsu'], item['saleDate'])] for item in itens]
+
+    def consultar_vendas_parceladas_lote(self,itens:list[dict],token:str=None,ambiente:Literal['trn', 'prd']=None,limite:int=None) -> list[dict]:
+        """
+        Consulta as parcelas de vários (companyNumber, nsu, saleDate), com até `limite` consultas simultâneas.
+        Itens repetidos são consultados uma única vez.
+            :param itens: lista de {companyNumber, nsu, saleDate}.
+            :param limite: consultas simultâneas. Padrão: REDE_LIMITE_LOTE.
+            :return list[dict]: resultado de cada item, na ordem de entrada.
+        """
+        return self.ordenar_lote(itens,mapear_em_ordem(lambda item: self.consultar_item_lote(item=item,token=token,ambiente=ambiente),
+                                                       self.deduplicar_lote(itens),
+                                                       limite or self.limite_lote))
+
+    def montar_url_pagamentos_oc(self,companyNumber:int,startDate:date,endDate:date,ambiente:Literal['trn', 'prd']=None) -> str:
+
+        url:str=self.validar_ambiente_vendas(ambiente=ambiente)
+        url+=f'/v1/payments/credit-orders?parentCompanyNumber={companyNumber}&subsidiaries={companyNumber}&startDate={startDate.strftime('%Y-%m-%d')}&endDate={endDate.strftime('%Y-%m-%d')}'
+        return url
+
+    def tratar_retorno_pagamentos_oc(self,res,startDate:date,endDate:date) -> dict:
+
+        data:dict={}
+        if res is None:
+            raise ConnectionError("Erro na consulta de pagamentos: sem resposta")
+        if resposta_ok(res) and res.text:
+            data = res.json()
+        elif resposta_ok(res) and not res.text:
+            data = {
+                "message": f"A consulta não retornou dados. Período: {startDate.strftime('%d/%m/%Y')} - {endDate.strftime('%d/%m/%Y')}"
+            }
+        else:
+            raise ConnectionError(f"Erro {res.status_code} na consulta de pagamentos: {res.text}")
         return data
 
-    def consultar_pagamentos_id(self,companyNumber:int,paymentId:str,token:str=None,ambiente:Literal['trn', 'prd']=None) -> dict:
+    def montar_consulta_pagamentos_oc(self,companyNumber:int,startDate:date,endDate:date,token:str=None,ambiente:Literal['trn', 'prd']=None) -> dict:
+        """ Parâmetros de uma janela da consulta de pagamentos """
+
+        return {
+            "cache": dict(endpoint="pagamentos_oc",companyNumber=companyNumber,startDate=startDate,endDate=endDate,token=token,ambiente=ambiente),
+            "url": self.montar_url_pagamentos_oc(companyNumber=companyNumber,startDate=startDate,endDate=endDate,ambiente=ambiente),
+            "header": self.montar_cabecalho(token=token),
+            "tratar_retorno": lambda res: self.tratar_retorno_pagamentos_oc(res,startDate=startDate,endDate=endDate),
+            "descricao": "consulta de pagamentos",
+            "chave": "paymentsCreditOrders"
+        }
+
+    def iterar_pagamentos_oc_periodo(self,companyNumber:int,startDate:date,endDate:date,token:str=None,ambiente:Literal['trn', 'prd']=None,prefetch:bool=False) -> Iterator[list[dict]]:
+        """ Retorna as ordens de crédito de uma única janela da consulta de pagamentos, página a página """
+
+        return self.iterar_periodo(self.montar_consulta_pagamentos_oc(companyNumber=companyNumber,startDate=startDate,endDate=endDate,token=token,ambiente=ambiente),
+                                   prefetch=prefetch)
+
+    def consultar_pagamentos_oc_periodo(self,companyNumber:int,startDate:date,endDate:date,token:str=None,ambiente:Literal['trn', 'prd']=None) -> dict:
+
+        return self.consultar_periodo(self.montar_consulta_pagamentos_oc(companyNumber=companyNumber,startDate=startDate,endDate=endDate,token=token,ambiente=ambiente))
+
+    def iterar_pagamentos_oc(self,companyNumber:int,startDate:date,endDate:date,token:str=None,ambiente:Literal['trn', 'prd']=None,prefetch:bool=False) -> Iterator[list[dict]]:
+        """
+        Retorna as ordens de crédito da consulta de pagamentos.
+        Períodos longos são divididos em janelas consultadas em paralelo e
+        retornadas em ordem cronológica, uma lista de ordens de crédito por janela.
+        """
+        periodos = self.dividir_periodo(startDate=startDate,endDate=endDate)
+        if len(periodos) == 1:
+            return self.iterar_pagamentos_oc_periodo(companyNumber=companyNumber,startDate=startDate,endDate=endDate,token=token,ambiente=ambiente,prefetch=prefetch)
+
+        return self.iterar_janelas(lambda periodo: self.iterar_pagamentos_oc_periodo(companyNumber=companyNumber,startDate=periodo[0],endDate=periodo[1],token=token,ambiente=ambiente),
+                                   periodos)
+
+    def consultar_pagamentos_oc(self,companyNumber:int,startDate:date,endDate:date,token:str=None,ambiente:Literal['trn', 'prd']=None) -> dict:
+
+        periodos = self.dividir_periodo(startDate=startDate,endDate=endDate)
+        if len(periodos) == 1:
+            return self.consultar_pagamentos_oc_periodo(companyNumber=companyNumber,startDate=startDate,endDate=endDate,token=token,ambiente=ambiente)
+
+        return self.consultar_janelas(lambda periodo: self.consultar_pagamentos_oc_periodo(companyNumber=companyNumber,
+                                                                                         startDate=periodo[0],
+                                                                                         endDate=periodo[1],
+                                                                                         token=token,
+                                                                                         ambiente=ambiente),
+                                      periodos,
+                                      chave="paymentsCreditOrders",
+                                      mensagem=f"A consulta não retornou dados. Período: {startDate.strftime('%d/%m/%Y')} - {endDate.strftime('%d/%m/%Y')}")
+
+    def montar_url_pagamentos_id(self,companyNumber:int,paymentId:str,ambiente:Literal['trn', 'prd']=None) -> str:
+
+        url:str=self.validar_ambiente_vendas(ambiente=ambiente)
+        url+=f'/v1/payments/{companyNumber}/{paymentId}'
+        return url
+
+    def tratar_retorno_pagamentos_id(self,res,paymentId:str) -> dict:
 
         data:dict={}
+        if res is None:
+            raise ConnectionError("Erro na consulta de pagamentos por ID: sem resposta")
+        if resposta_ok(res) and res.text:
+            data = res.json()
+        elif resposta_ok(res) and not res.text:
+            data = {
+                "message": f"A consulta não retornou dados. ID Pagamento: {paymentId}"
+            }
+        else:
+            raise ConnectionError(f"Erro {res.status_code} na consulta de pagamentos por ID: {res.text}")
+        return data
+
+    def consultar_pagamentos_id(self,companyNumber:int,paymentId:str,token:str=None,ambiente:Literal['trn', 'prd']=None) -> dict:
+
         url:str=''
         header:dict={}
         res:requests.Response=None
 
-        url=self.validar_ambiente_vendas(ambiente=ambiente)
-        url+=f'/v1/payments/{companyNumber}/{paymentId}'
-
-        if not token:
-            token = self.token
-
-        header={
-            "Authorization": f"Bearer {token}",
-            "Content-Type": "application/json"
-        }
+        url=self.montar_url_pagamentos_id(companyNumber=companyNumber,paymentId=paymentId,ambiente=ambiente)
+        header=self.montar_cabecalho(token=token)
 
         try:
-            res = requests.get(
+            res = self.http.get(
                 url=url,
                 headers=header
             )
         except Exception as e:
             raise ConnectionError(f"Erro na consulta de pagamentos por ID: {e}")
         finally:
-            if res.ok and res.text:
-                data = res.json()
-            elif res.ok and not res.text:
-                data = {
-                    "message": f"A consulta não retornou dados. ID Pagamento: {paymentId}"
-                }
-            else:
-                raise ConnectionError(f"Erro {res.status_code} na consulta de pagamentos por ID: {res.text}")
-        
-        return data
+            pass
+
+        return self.tratar_retorno_pagamentos_id(res,paymentId=paymentId)
     
-    def formatar_payload_consulta_vendas_parceladas(self,dados_vendas:dict=None) -> list[dict]:
+    def formatar_payload_consulta_vendas_parceladas(self,dados_vendas:dict) -> list[dict]:
         
-        vendas:list[dict] = dados_vendas.get("content",{}).get("installments",[]) if dados_vendas else self.dados_vendas_parceladas
+        vendas:list[dict] = (dados_vendas or {}).get("content",{}).get("installments",[])
         try:            
             return [
                 {
@@ -0,0 +1,312 @@
+import asyncio, httpx
+from typing import Literal, Callable, Awaitable, AsyncIterator
+from datetime import date
+from dotenv import load_dotenv
+from src.rede.utils.log import set_logger
+from src.rede.services.token import cache_token
+from src.rede.utils.http import TransporteHttp, TransporteHttpAsync, obter_transporte_async
+from src.rede.utils.concorrencia import mapear_async, mapear_em_ordem_async
+from src.rede.services.rede import AutenticacaoService, LinkPagamentoService, VendasService
+logger = set_logger(__name__)
+load_dotenv()
+
+class AutenticacaoServiceAsync(AutenticacaoService):
+    """
+    Variante assíncrona do AutenticacaoService da Rede.
+    As chamadas HTTP usam o transporte httpx compartilhado e o acesso ao banco
+    de tokens é delegado para uma thread, sem bloquear o event loop.
+    """
+
+    def __init__(self,*args,transporte_async:TransporteHttpAsync=None,**kwargs):
+        super().__init__(*args,**kwargs)
+        self.http_async = transporte_async or obter_transporte_async()
+
+    async def gerar_token(self) -> dict:
+
+        res:httpx.Response=None
+        try:
+            res = await self.http_async.post(**self.montar_requisicao_token())
+        except Exception as e:
+            logger.error(f"Erro na requisição do token: {e}")
+        finally:
+            pass
+        return self.tratar_retorno_token(res)
+
+    def renovar_token(self) -> dict:
+        """ Renovação síncrona, usada pelo renovador de tokens em segundo plano """
+        return self.registrar_token_gerado(AutenticacaoService.gerar_token(self))
+
+    async def autenticar(self) -> bool:
+
+        cache_token.registrar_renovacao(self.chave_token(), self.renovar_token)
+        token:dict = cache_token.obter(self.chave_token())
+        if not token:
+            # A renovação passa pelo cache compartilhado com os serviços síncronos (uma única renovação por chave);
+            # a chamada HTTP continua sendo feita pelo cliente assíncrono, no event loop atual
+            loop = asyncio.get_running_loop()
+            renovar = lambda: self.registrar_token_gerado(asyncio.run_coroutine_threadsafe(self.gerar_token(), loop).result())
+            token = await asyncio.to_thread(cache_token.obter_ou_renovar, self.chave_token(), self.carregar_token, renovar)
+        if not token:
+            return False
+        self.token = token.get('access_token', '')
+        return True
+
+class LinkPagamentoServiceAsync(AutenticacaoServiceAsync, LinkPagamentoService):
+
+    def __init__(self,transporte:TransporteHttp=None,transporte_async:TransporteHttpAsync=None):
+        super().__init__(transporte=transporte,transporte_async=transporte_async)
+
+    async def consultar_detalhes_link(self,paymentLinkId:str,companyNumber:str,ambiente: Literal['trn', 'prd']=None,token:str=None) -> dict:
+
+        url:str=''
+        header:dict={}
+        res:httpx.Response=None
+
+        url=self.validar_ambiente_link(ambiente=ambiente)
+        url+=f'/details/{paymentLinkId}'
+        header=self.montar_cabecalho(companyNumber=companyNumber,token=token)
+
+        try:
+            res = await self.http_async.get(
+                url=url,
+                headers=header
+            )
+        except Exception as e:
+            raise ConnectionError(f"Erro na consulta do link de pagamento {paymentLinkId}: {e}")
+        finally:
+            pass
+
+        return self.tratar_retorno_link(res,descricao=f"consulta do link de pagamento {paymentLinkId}")
+
+    async def criar_link(self,companyNumber:str,body:dict,ambiente: Literal['trn', 'prd']=None,token:str=None) -> dict:
+
+        url:str=''
+        header:dict={}
+        res:httpx.Response=None
+
+        url = self.validar_ambiente_link(ambiente=ambiente)
+        url+='/create'
+        header=self.montar_cabecalho(companyNumber=companyNumber,token=token)
+
+        try:
+            res = await self.http_async.post(
+                url=url,
+                headers=header,
+                json=body
+            )
+        except Exception as e:
+            raise ConnectionError(f"Erro na criação do link de pagamento: {e}")
+        finally:
+            pass
+
+        return self.tratar_retorno_link(res,descricao="criação do link de pagamento")
+
+class VendasServiceAsync(AutenticacaoServiceAsync, VendasService):
+    """
+    Variante assíncrona do VendasService.
+    Montagem das consultas, divisão em janelas, cache e tratamento das respostas vêm do
+    serviço síncrono; aqui são sobrescritas as etapas que aguardam E/S e os métodos
+    públicos que as encadeiam, que precisam ser corrotinas ou iteradores assíncronos.
+    """
+
+    def __init__(self,transporte:TransporteHttp=None,transporte_async:TransporteHttpAsync=None):
+        super().__init__(transporte=transporte,transporte_async=transporte_async)
+
+    async def buscar_pagina(self,url:str,header:dict,tratar_retorno:Callable,pageKey:str=None,descricao:str='consulta paginada') -> dict:
+
+        res:httpx.Response=None
+        try:
+            res = await self.http_async.get(
+                url=self.montar_url_pagina(url=url,pageKey=pageKey),
+                headers=header
+            )
+        except Exception as e:
+            raise ConnectionError(f"Erro na {descricao}: {e}")
+        finally:
+            pass
+        return self.registrar_pagina(tratar_retorno(res))
+
+    async def iterar_paginas(self,url:str,header:dict,tratar_retorno:Callable,prefetch:bool=False,descricao:str='consulta paginada') -> AsyncIterator[dict]:
+        """ Versão assíncrona de VendasService.iterar_paginas """
+
+        proxima:asyncio.Task = None
+        try:
+            pagina = await self.buscar_pagina(url=url,header=header,tratar_retorno=tratar_retorno,descricao=descricao)
+            while True:
+                pageKey = self.obter_proxima_pagina(pagina)
+                if prefetch and pageKey:
+                    proxima = asyncio.create_task(self.buscar_pagina(url=url,header=header,tratar_retorno=tratar_retorno,pageKey=pageKey,descricao=descricao))
+                yield pagina
+                if not pageKey:
+                    break
+                if proxima:
+                    pagina = await proxima
+                    proxima = None
+                else:
+                    pagina = await self.buscar_pagina(url=url,header=header,tratar_retorno=tratar_retorno,pageKey=pageKey,descricao=descricao)
+        finally:
+            if proxima and not proxima.done():
+                proxima.cancel()
+
+    async def consultar_periodo(self,consulta:dict) -> dict:
+        """ Versão assíncrona de VendasService.consultar_periodo """
+
+        data:dict = await asyncio.to_thread(lambda: self.ler_cache(**consulta['cache']))
+        if data is not None:
+            return data
+
+        data = {}
+        async for pagina in self.iterar_paginas(url=consulta['url'],
+                                                header=consulta['header'],
+                                                tratar_retorno=consulta['tratar_retorno'],
+                                                descricao=consulta['descricao']):
+            data = self.acumular_pagina(data=data,pagina=pagina,chave=consulta['chave'])
+
+        await asyncio.to_thread(lambda: self.gravar_cache(data,**consulta['cache']))
+        return data
+
+    async def iterar_periodo(self,consulta:dict,prefetch:bool=False) -> AsyncIterator[list[dict]]:
+        """ Versão assíncrona de VendasService.iterar_periodo """
+
+        data:dict = await asyncio.to_thread(lambda: self.ler_cache(**consulta['cache']))
+        if data is not None:
+            yield data.get("content",{}).get(consulta['chave'],[])
+            return
+
+        async for pagina in self.iterar_paginas(url=consulta['url'],
+                                                header=consulta['header'],
+                                                tratar_retorno=consulta['tratar_retorno'],
+                                                prefetch=prefetch,
+                                                descricao=consulta['descricao']):
+            yield pagina.get("content",{}).get(consulta['chave'],[])
+        self.registrar_token_validado(token=consulta['cache']['token'],companyNumber=consulta['cache']['companyNumber'],endDate=consulta['cache']['endDate'])
+
+    async def consultar_janelas(self,consultar_janela:Callable[[tuple[date,date]],Awaitable[dict]],periodos:list[tuple[date,date]],chave:str,mensagem:str) -> dict:
+
+        return self.juntar_periodos(resultados=await mapear_async(consultar_janela,periodos,self.max_workers),chave=chave,mensagem=mensagem)
+
+    async def iterar_janelas(self,iterar_janela:Callable[[tuple[date,date]],AsyncIterator[list[dict]]],periodos:list[tuple[date,date]]) -> AsyncIterator[list[dict]]:
+
+        async def consultar_janela(periodo:tuple[date,date]) -> list[dict]:
+            return [item async for pagina in iterar_janela(periodo) for item in pagina]
+
+        async for janela in mapear_em_ordem_async(consultar_janela,periodos,self.max_workers):
+            yield janela
+
+    async def iterar_vendas_parceladas_periodo(self,companyNumber:int,startDate:date,endDate:date,nsu:int=None,token:str=None,ambiente:Literal['trn', 'prd']=None,prefetch:bool=False) -> AsyncIterator[list[dict]]:
+
+        async for registros in self.iterar_periodo(self.montar_consulta_vendas_parceladas(companyNumber=companyNumber,startDate=startDate,endDate=endDate,nsu=nsu,token=token,ambiente=ambiente),
+                                                   prefetch=prefetch):
+            yield registros
+
+    async def consultar_vendas_parceladas_periodo(self,companyNumber:int,startDate:date,endDate:date,nsu:int=None,token:str=None,ambiente:Literal['trn', 'prd']=None) -> dict:
+
+        return await self.consultar_periodo(self.montar_consulta_vendas_parceladas(companyNumber=companyNumber,startDate=startDate,endDate=endDate,nsu=nsu,token=token,ambiente=ambiente))
+
+    async def iterar_vendas_parceladas(self,companyNumber:int,startDate:date,endDate:date,nsu:int=None,token:str=None,ambiente:Literal['trn', 'prd']=None,prefetch:bool=False) -> AsyncIterator[list[dict]]:
+        """ Versão assíncrona de VendasService.iterar_vendas_parceladas """
+
+        periodos = self.dividir_periodo(startDate=startDate,endDate=endDate)
+        if nsu or len(periodos) == 1:
+            janelas = self.iterar_vendas_parceladas_periodo(companyNumber=companyNumber,startDate=startDate,endDate=endDate,nsu=nsu,token=token,ambiente=ambiente,prefetch=prefetch)
+        else:
+            janelas = self.iterar_janelas(lambda periodo: self.iterar_vendas_parceladas_periodo(companyNumber=companyNumber,startDate=periodo[0],endDate=periodo[1],token=token,ambiente=ambiente),
+                                          periodos)
+        async for registros in janelas:
+            yield registros
+
+    async def consultar_vendas_parceladas(self,companyNumber:int,startDate:date,endDate:date,nsu:int=None,token:str=None,ambiente:Literal['trn', 'prd']=None) -> dict:
+
+        periodos = self.dividir_periodo(startDate=startDate,endDate=endDate)
+        if nsu or len(periodos) == 1:
+            return await self.consultar_vendas_parceladas_periodo(companyNumber=companyNumber,startDate=startDate,endDate=endDate,nsu=nsu,token=token,ambiente=ambiente)
+
+        return await self.consultar_janelas(lambda periodo: self.consultar_vendas_parceladas_periodo(companyNumber=companyNumber,
+                                                                                                   startDate=periodo[0],
+                                                                                                   endDate=periodo[1],
+                                                                                                   token=token,
+                                                                                                   ambiente=ambiente),
+                                            periodos,
+                                            chave="installments",
+                                            mensagem=f"A consulta não retornou dados. NSU: {nsu}. Data: {startDate.strftime('%d/%m/%Y')}")
+
+    async def consultar_item_lote(self,item:dict,token:str=None,ambiente:Literal['trn', 'prd']=None) -> dict:
+
+        resultado:dict = {**item, "sucesso": False, "dados": None, "erro": ""}
+        try:
+            resultado['dados'] = await self.consultar_vendas_parceladas(companyNumber=item['companyNumber'],
+                                                                        startDate=item['saleDate'],
+                                                                        endDate=item['saleDate'],
+                                                                        nsu=item['nsu'],
+                                                                        token=token,
+                                                                        ambiente=ambiente)
+            resultado['sucesso'] = True
+        except Exception as e:
+            resultado['erro'] = str(e)
+        finally:
+            pass
+        return resultado
+
+    async def consultar_vendas_parceladas_lote(self,itens:list[dict],token:str=None,ambiente:Literal['trn', 'prd']=None,limite:int=None) -> list[dict]:
+
+        return self.ordenar_lote(itens,await mapear_async(lambda item: self.consultar_item_lote(item=item,token=token,ambiente=ambiente),
+                                                          self.deduplicar_lote(itens),
+                                                          limite or self.limite_lote))
+
+    async def iterar_pagamentos_oc_periodo(self,companyNumber:int,startDate:date,endDate:date,token:str=None,ambiente:Literal['trn', 'prd']=None,prefetch:bool=False) -> AsyncIterator[list[dict]]:
+
+        async for registros in self.iterar_periodo(self.montar_consulta_pagamentos_oc(companyNumber=companyNumber,startDate=startDate,endDate=endDate,token=token,ambiente=ambiente),
+                                                   prefetch=prefetch):
+            yield registros
+
+    async def consultar_pagamentos_oc_periodo(self,companyNumber:int,startDate:date,endDate:date,token:str=None,ambiente:Literal['trn', 'prd']=None) -> dict:
+
+        return await self.consultar_periodo(self.montar_consulta_pagamentos_oc(companyNumber=companyNumber,startDate=startDate,endDate=endDate,token=token,ambiente=ambiente))
+
+    async def iterar_pagamentos_oc(self,companyNumber:int,startDate:date,endDate:date,token:str=None,ambiente:Literal['trn', 'prd']=None,prefetch:bool=False) -> AsyncIterator[list[dict]]:
+        """ Versão assíncrona de VendasService.iterar_pagamentos_oc """
+
+        periodos = self.dividir_periodo(startDate=startDate,endDate=endDate)
+        if len(periodos) == 1:
+            janelas = self.iterar_pagamentos_oc_periodo(companyNumber=companyNumber,startDate=startDate,endDate=endDate,token=token,ambiente=ambiente,prefetch=prefetch)
+        else:
+            janelas = self.iterar_janelas(lambda periodo: self.iterar_pagamentos_oc_periodo(companyNumber=companyNumber,startDate=periodo[0],endDate=periodo[1],token=token,ambiente=ambiente),
+                                          periodos)
+        async for registros in janelas:
+            yield registros
+
+    async def consultar_pagamentos_oc(self,companyNumber:int,startDate:date,endDate:date,token:str=None,ambiente:Literal['trn', 'prd']=None) -> dict:
+
+        periodos = self.dividir_periodo(startDate=startDate,endDate=endDate)
+        if len(periodos) == 1:
+            return await self.consultar_pagamentos_oc_periodo(companyNumber=companyNumber,startDate=startDate,endDate=endDate,token=token,ambiente=ambiente)
+
+        return await self.consultar_janelas(lambda periodo: self.consultar_pagamentos_oc_periodo(companyNumber=companyNumber,
+                                                                                               startDate=periodo[0],
+                                                                                               endDate=periodo[1],
+                                                                                               token=token,
+                                                                                               ambiente=ambiente),
+                                            periodos,
+                                            chave="paymentsCreditOrders",
+                                            mensagem=f"A consulta não retornou dados. Período: {startDate.strftime('%d/%m/%Y')} - {endDate.strftime('%d/%m/%Y')}")
+
+    async def consultar_pagamentos_id(self,companyNumber:int,paymentId:str,token:str=None,ambiente:Literal['trn', 'prd']=None) -> dict:
+
+        url:str=''
+        header:dict={}
+        res:httpx.Response=None
+
+        url=self.montar_url_pagamentos_id(companyNumber=companyNumber,paymentId=paymentId,ambiente=ambiente)
+        header=self.montar_cabecalho(token=token)
+
+        try:
+            res = await self.http_async.get(
+                url=url,
+                headers=header
+            )
+        except Exception as e:
+            raise ConnectionError(f"Erro na consulta de pagamentos por ID: {e}")
+        finally:
+            pass
+
+        return self.tratar_retorno_pagamentos_id(res,paymentId=paymentId)
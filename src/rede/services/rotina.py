@@ -1,38 +1,125 @@
-from datetime import date
+import os, time, threading
+from contextlib import contextmanager
+from datetime import date, timedelta
+from src.rede.database.database import get_session
 from src.rede.services.rede import VendasService
+from src.rede.utils.concorrencia import mapear_em_ordem
 from src.rede.services.sankhya import PagamentoService
+from src.rede.services.watermark import WatermarkService
 from dotenv import load_dotenv
-from src.rede.utils.log import set_logger
+from src.rede.utils.log import set_logger, resumir_payload
 logger = set_logger(__name__)
 load_dotenv()
 
-class RotinaService():
+ROTINA_PAGAMENTO = 'atualizar_dados_pagamento'
+
+class MedidorEtapas:
+    """
+    Duração (s) e quantidade de registros de cada etapa de uma execução da rotina:
+    autenticacao, busca_rede, busca_sankhya, formatacao e envio_sankhya.
+    """
 
     def __init__(self):
-        self.snk_pgto = PagamentoService()
-        self.rede_venda = VendasService()
+        self.etapas:dict[str,dict] = {}
+
+    @contextmanager
+    def medir(self,nome:str):
+        etapa = self.etapas.setdefault(nome, {"duracao": 0.0, "registros": 0})
+        inicio = time.monotonic()
+        try:
+            yield etapa
+        finally:
+            etapa['duracao'] = round(etapa['duracao'] + time.monotonic() - inicio, 3)
+
+class TravasEmpresas:
+    """
+    Uma trava por empresa, compartilhada pelo agendador e pelos jobs: uma empresa só é
+    conciliada por uma execução de cada vez, e uma execução abandonada por tempo limite
+    mantém a empresa travada até terminar.
+    """
+
+    def __init__(self):
+        self.travas:dict[int,threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def obter(self,companyNumber:int) -> threading.Lock:
+        with self._lock:
+            return self.travas.setdefault(int(companyNumber), threading.Lock())
+
+    @contextmanager
+    def travar(self,companyNumber:int):
+        """ Tenta travar a empresa sem aguardar; retorna se a trava foi obtida """
+
+        trava = self.obter(companyNumber)
+        obtida = trava.acquire(blocking=False)
+        try:
+            yield obtida
+        finally:
+            if obtida:
+                trava.release()
+
+travas_empresas = TravasEmpresas()
+
+def verificar_cancelamento(cancelamento:threading.Event=None):
+    """ Interrompe a execução entre etapas quando o chamador desistiu dela (ex.: tempo limite do agendador) """
+
+    if cancelamento is not None and cancelamento.is_set():
+        raise Exception("Execução cancelada pelo chamador.")
+
+def somar_etapas(resultados:list[dict]) -> dict[str,dict]:
+    """
+    Soma as etapas de várias execuções da rotina (ex.: uma por empresa).
+        :return dict: por etapa, duração e registros somados e número de execuções em que a etapa ocorreu.
+    """
+    total:dict[str,dict] = {}
+    for resultado in resultados:
+        for nome, etapa in ((resultado or {}).get('etapas') or {}).items():
+            soma = total.setdefault(nome, {"duracao": 0.0, "registros": 0, "execucoes": 0})
+            soma['duracao'] = round(soma['duracao'] + etapa.get('duracao', 0), 3)
+            soma['registros'] += etapa.get('registros', 0)
+            soma['execucoes'] += 1
+    return dict(sorted(total.items(), key=lambda item: item[1]['duracao'], reverse=True))
+
+class RotinaService():
+    """
+    Rotinas de integração Rede -> Sankhya.
+    Os dados de cada execução ficam em variáveis locais, e não na instância, para
+    que uma única instância possa ser compartilhada entre requisições e threads.
+    """
+
+    def __init__(self,snk_pgto:PagamentoService=None,rede_venda:VendasService=None):
+        self.snk_pgto = snk_pgto or PagamentoService()
+        self.rede_venda = rede_venda or VendasService()
+        # Execuções seguidas com falha no mesmo dia antes de a última data conciliada passar por ele
+        self.max_falhas_dia:int = int(os.getenv('ROTINA_MAX_FALHAS_DIA', '5'))
 
     def registrar_dados_pagamento(self,companyNumber:int,dataVendas:date,nsu:int) -> dict:
 
         payload_pgto:dict = {}
         dados_rede:dict = {}
-        retorno:dict = {"sucesso": False, "dados": [], "mensagem": ""}
+        medidor:MedidorEtapas = MedidorEtapas()
+        retorno:dict = {"sucesso": False, "dados": [], "mensagem": "", "etapas": medidor.etapas}
 
         logger.info(f"Registrando dados de pagamento para companyNumber={companyNumber}, dataVendas={dataVendas}, nsu={nsu}")
         try:
             logger.info("- Autenticando com as APIs...")
-            if not self.snk_pgto.autenticar():
-                raise Exception("Falha na autenticação com a API Sankhya.")
-            if not self.rede_venda.autenticar():
-                raise Exception("Falha na autenticação com a API Rede.")
+            with medidor.medir('autenticacao'):
+                if not self.snk_pgto.autenticar():
+                    raise Exception("Falha na autenticação com a API Sankhya.")
+                if not self.rede_venda.autenticar():
+                    raise Exception("Falha na autenticação com a API Rede.")
             
             logger.info("- Consultando dados de pagamento na API Rede...")
-            dados_rede = self.rede_venda.consultar_vendas_parceladas(companyNumber=companyNumber,startDate=dataVendas,endDate=dataVendas,nsu=nsu)
+            with medidor.medir('busca_rede') as etapa:
+                dados_rede = self.rede_venda.consultar_vendas_parceladas(companyNumber=companyNumber,startDate=dataVendas,endDate=dataVendas,nsu=nsu)
+                etapa['registros'] = len((dados_rede.get('content') or {}).get('installments') or [])
             if 'message' in dados_rede:
                 raise Exception(dados_rede.get('message'))
             
             logger.info("- Formatando payload de retorno...")
-            payload_pgto = self.rede_venda.formatar_payload_consulta_vendas_parceladas()
+            with medidor.medir('formatacao') as etapa:
+                payload_pgto = self.rede_venda.formatar_payload_consulta_vendas_parceladas(dados_vendas=dados_rede)
+                etapa['registros'] = len(payload_pgto or [])
             if not payload_pgto:
                 raise Exception("Falha ao formatar payload de registro.")
             retorno['dados'] = payload_pgto
@@ -43,70 +130,391 @@ class RotinaService():
             msg = f"Erro ao registrar dados de pagamento: {str(e)}"
             retorno['mensagem'] = msg
             logger.error(msg)
-            logger.info("dados_rede: %s", dados_rede)
-            logger.info("payload_pgto: %s", payload_pgto)
+            logger.info("dados_rede: %s", resumir_payload(dados_rede))
+            logger.info("payload_pgto: %s", resumir_payload(payload_pgto))
         finally:
             pass
 
         return retorno
 
-    def atualizar_dados_pagamento(self,companyNumber:int,startDate:date,endDate:date) -> dict:
+    def atualizar_dados_pagamento(self,companyNumber:int,startDate:date,endDate:date,cancelamento:threading.Event=None) -> dict:
 
-        dados_pagamento_raw:list[dict] = []
         dados_pagamento:list[dict] = []
         lista_salesumnum:list[int] = []
         dados_financeiro:list[dict] = []
-        upd_pgto_snk:dict = {}
-        retorno:dict = {"sucesso": False, "mensagem": ""}
+        payload:list[dict] = []
+        ignorados:int = 0
+        resultado_envio:dict = {}
+        upd_pgto_snk:bool = False
+        medidor:MedidorEtapas = MedidorEtapas()
+        retorno:dict = {"sucesso": False, "mensagem": "", "etapas": medidor.etapas}
 
         try:
             logger.info("- Autenticando com as APIs...")
-            if not self.rede_venda.autenticar():
-                raise Exception("Falha na autenticação com a API Sankhya.")
-            if not self.snk_pgto.autenticar():
-                raise Exception("Falha na autenticação com a API Rede.")
+            with medidor.medir('autenticacao'):
+                if not self.rede_venda.autenticar():
+                    raise Exception("Falha na autenticação com a API Sankhya.")
+                if not self.snk_pgto.autenticar():
+                    raise Exception("Falha na autenticação com a API Rede.")
             
+            verificar_cancelamento(cancelamento)
             logger.info("- Buscando dados de pagamento na API Rede...")
-            # Busca dados de pagamento na API Rede
-            dados_pagamento_raw = self.rede_venda.consultar_pagamentos_oc(companyNumber=companyNumber,
+            # Busca dados de pagamento na API Rede (todas as páginas, com cache de respostas)
+            with medidor.medir('busca_rede') as etapa:
+                dados_pagamento = self.rede_venda.consultar_pagamentos_oc(companyNumber=companyNumber,
                                                                           startDate=startDate,
-                                                                          endDate=endDate)
-            if 'message' in dados_pagamento_raw:
-                raise Exception(dados_pagamento_raw.get('message'))
-            if not dados_pagamento_raw['content'].get('paymentsCreditOrders'):
-                return {"sucesso": True, "mensagem": f"Nenhum pagamento encontrado para o período especificado ({startDate.strftime('%d/%m/%Y')}-{endDate.strftime('%d/%m/%Y')})."}
-            dados_pagamento = dados_pagamento_raw['content']['paymentsCreditOrders']
+                                                                          endDate=endDate).get("content",{}).get("paymentsCreditOrders",[])
+                etapa['registros'] = len(dados_pagamento)
+            verificar_cancelamento(cancelamento)
+            if not dados_pagamento:
+                return {**retorno, "sucesso": True, "mensagem": f"Nenhum pagamento encontrado para o período especificado ({startDate.strftime('%d/%m/%Y')}-{endDate.strftime('%d/%m/%Y')})."}
 
             logger.info("- Buscando dados financeiros na API Sankhya...")
             # Busca dados financeiros na API Sankhya com base nos salesSummaryNumber dos pagamentos encontrados
             lista_salesumnum = [d.get('saleSummaryNumber') for d in dados_pagamento]
             if not lista_salesumnum:
                 raise Exception("Nenhum saleSummaryNumber encontrado nos pagamentos")
-            
-            dados_financeiro = self.snk_pgto.buscar(lista_saleSummaryNumber=lista_salesumnum)                
+
+            verificar_cancelamento(cancelamento)
+            with medidor.medir('busca_sankhya') as etapa:
+                dados_financeiro = self.snk_pgto.buscar(lista_saleSummaryNumber=lista_salesumnum)
+                etapa['registros'] = len(dados_financeiro or [])
             if not dados_financeiro:
                 raise Exception("Nenhum registro financeiro encontrado para os salesSummaryNumber")
 
             logger.info("- Formatando payload de atualização para a API Sankhya...")
             # Formata payload de atualização para a API Sankhya com base nos dados de pagamento e financeiro encontrados
-            if not self.snk_pgto.formatar_payload_pagamento(dados_pagamento=dados_pagamento, dados_financeiro=dados_financeiro):
-                raise Exception("Falha ao formatar payload financeiro.")
+            with medidor.medir('formatacao') as etapa:
+                try:
+                    payload, ignorados = self.snk_pgto.montar_payload_pagamento(dados_pagamento=dados_pagamento, dados_financeiro=dados_financeiro)
+                except Exception as e:
+                    raise Exception(f"Falha ao formatar payload financeiro. {e}")
+                etapa['registros'] = len(payload)
+                etapa['ignorados'] = ignorados
+
+            if not payload and ignorados:
+                retorno['sucesso'] = True
+                retorno['mensagem'] = f"{ignorados} pagamento(s) já atualizado(s) no Sankhya."
+                retorno['envio'] = {"total": 0, "enviados": 0, "falhas": 0, "ignorados": ignorados}
+                return retorno
 
             logger.info("- Atualizando dados financeiros na API Sankhya...")
-            upd_pgto_snk = self.snk_pgto.atualizar()
+            if not payload:
+                raise Exception("Nenhum registro financeiro corresponde aos pagamentos encontrados.")
+            verificar_cancelamento(cancelamento)
+            with medidor.medir('envio_sankhya') as etapa:
+                resultado_envio = self.snk_pgto.salvar_registros(payload=payload,operacao='atualização')
+                etapa['registros'] = resultado_envio.get('enviados') or 0
+            upd_pgto_snk = resultado_envio.get('sucesso', False)
             retorno['sucesso'] = upd_pgto_snk
+            retorno['envio'] = {chave: resultado_envio.get(chave) for chave in ('total','enviados','falhas','ignorados')}
+            if not upd_pgto_snk:
+                raise Exception(f"Falha ao atualizar dados financeiro. {retorno['envio'].get('falhas')} de {retorno['envio'].get('total')} registro(s) não foram salvos.")
+            logger.info("- pass")
+        except Exception as e:
+            msg = f"Erro ao atualizar dados financeiro: {str(e)}"
+            retorno['mensagem'] = msg
+            logger.error(msg)
+            logger.info("dados_pagamento: %s", resumir_payload(dados_pagamento))
+            logger.info("dados_financeiro: %s", resumir_payload(dados_financeiro))
+            logger.info("payload: %s", resumir_payload(payload))
+        finally:
+            pass
+
+        return retorno
+    
+    def coletar_pagamentos_empresa(self,companyNumber:int,startDate:date,endDate:date) -> dict:
+        """
+        Coleta as ordens de crédito de uma empresa na API Rede.
+            :return dict: {companyNumber, dados, erro}.
+        """
+        dados:list[dict] = []
+        erro:str = ''
+        try:
+            dados = self.rede_venda.consultar_pagamentos_oc(companyNumber=companyNumber,
+                                                            startDate=startDate,
+                                                            endDate=endDate).get("content",{}).get("paymentsCreditOrders",[])
+        except Exception as e:
+            erro = str(e)
+            logger.error(f"Erro ao buscar pagamentos da empresa {companyNumber}: {erro}")
+        finally:
+            pass
+        return {"companyNumber": companyNumber, "dados": dados, "erro": erro}
+
+    def atualizar_dados_pagamento_empresas(self,companyNumbers:list[int],startDate:date,endDate:date,inicios:dict[int,date]=None) -> dict:
+        """
+        Versão multiempresa de atualizar_dados_pagamento: coleta as ordens de crédito de todas as
+        empresas e faz uma única busca (em lotes) e um único envio (em lotes) na API Sankhya, de modo
+        que o número de chamadas à Sankhya dependa do volume de dados e não do número de empresas.
+        Uma empresa com erro na consulta à Rede é reportada em 'empresas' sem interromper as demais.
+            :param companyNumbers: números das empresas.
+            :param startDate: data inicial.
+            :param endDate: data final.
+            :param inicios: data inicial de cada empresa, quando diferente de startDate (ex.: dia seguinte à última data conciliada).
+            :return dict: {sucesso, mensagem, empresas, envio}.
+        """
+        dados_pagamento:list[dict] = []
+        lista_salesumnum:list[int] = []
+        dados_financeiro:list[dict] = []
+        payload:list[dict] = []
+        ignorados:int = 0
+        resultado_envio:dict = {}
+        upd_pgto_snk:bool = False
+        inicios = inicios or {}
+        medidor:MedidorEtapas = MedidorEtapas()
+        retorno:dict = {"sucesso": False, "mensagem": "", "empresas": {}, "etapas": medidor.etapas}
+
+        try:
+            logger.info("- Autenticando com as APIs...")
+            with medidor.medir('autenticacao'):
+                if not self.rede_venda.autenticar():
+                    raise Exception("Falha na autenticação com a API Rede.")
+                if not self.snk_pgto.autenticar():
+                    raise Exception("Falha na autenticação com a API Sankhya.")
+
+            logger.info(f"- Buscando dados de pagamento na API Rede para {len(companyNumbers)} empresa(s)...")
+            with medidor.medir('busca_rede') as etapa:
+                for coleta in mapear_em_ordem(lambda cn: self.coletar_pagamentos_empresa(companyNumber=cn,startDate=inicios.get(cn,startDate),endDate=endDate),
+                                              companyNumbers,
+                                              self.rede_venda.max_workers):
+                    retorno['empresas'][coleta['companyNumber']] = {"sucesso": not coleta['erro'],
+                                                                    "startDate": inicios.get(coleta['companyNumber'],startDate),
+                                                                    "pagamentos": len(coleta['dados']),
+                                                                    "mensagem": coleta['erro']}
+                    dados_pagamento.extend(coleta['dados'])
+                etapa['registros'] = len(dados_pagamento)
+            empresas_erro = [cn for cn, r in retorno['empresas'].items() if not r['sucesso']]
+            if not dados_pagamento:
+                if empresas_erro:
+                    raise Exception(f"Falha ao buscar pagamentos das empresas {empresas_erro}.")
+                return {**retorno, "sucesso": True, "mensagem": f"Nenhum pagamento encontrado para o período especificado ({startDate.strftime('%d/%m/%Y')}-{endDate.strftime('%d/%m/%Y')})."}
+
+            logger.info("- Buscando dados financeiros na API Sankhya...")
+            lista_salesumnum = [d.get('saleSummaryNumber') for d in dados_pagamento]
+            with medidor.medir('busca_sankhya') as etapa:
+                dados_financeiro = self.snk_pgto.buscar(lista_saleSummaryNumber=lista_salesumnum)
+                etapa['registros'] = len(dados_financeiro or [])
+            if not dados_financeiro:
+                raise Exception("Nenhum registro financeiro encontrado para os salesSummaryNumber")
+
+            logger.info("- Formatando payload de atualização para a API Sankhya...")
+            with medidor.medir('formatacao') as etapa:
+                try:
+                    payload, ignorados = self.snk_pgto.montar_payload_pagamento(dados_pagamento=dados_pagamento, dados_financeiro=dados_financeiro)
+                except Exception as e:
+                    raise Exception(f"Falha ao formatar payload financeiro. {e}")
+                etapa['registros'] = len(payload)
+                etapa['ignorados'] = ignorados
+
+            if not payload and ignorados:
+                retorno['sucesso'] = not empresas_erro
+                retorno['mensagem'] = f"{ignorados} pagamento(s) já atualizado(s) no Sankhya." + (f" Falha ao buscar pagamentos das empresas {empresas_erro}." if empresas_erro else "")
+                retorno['envio'] = {"total": 0, "enviados": 0, "falhas": 0, "ignorados": ignorados}
+                return retorno
+
+            logger.info("- Atualizando dados financeiros na API Sankhya...")
+            if not payload:
+                raise Exception("Nenhum registro financeiro corresponde aos pagamentos encontrados.")
+            with medidor.medir('envio_sankhya') as etapa:
+                resultado_envio = self.snk_pgto.salvar_registros(payload=payload,operacao='atualização')
+                etapa['registros'] = resultado_envio.get('enviados') or 0
+            upd_pgto_snk = resultado_envio.get('sucesso', False)
+            retorno['envio'] = {chave: resultado_envio.get(chave) for chave in ('total','enviados','falhas','ignorados')}
             if not upd_pgto_snk:
-                raise Exception("Falha ao atualizar dados financeiro.")
+                raise Exception(f"Falha ao atualizar dados financeiro. {retorno['envio'].get('falhas')} de {retorno['envio'].get('total')} registro(s) não foram salvos.")
+            retorno['sucesso'] = not empresas_erro
+            if empresas_erro:
+                retorno['mensagem'] = f"Falha ao buscar pagamentos das empresas {empresas_erro}."
             logger.info("- pass")
         except Exception as e:
             msg = f"Erro ao atualizar dados financeiro: {str(e)}"
             retorno['mensagem'] = msg
             logger.error(msg)
-            logger.info("dados_pagamento_raw: %s", dados_pagamento_raw)
-            logger.info("dados_financeiro: %s", dados_financeiro)
-            logger.info("payload: %s", self.snk_pgto.payload_pagamento)
+            logger.info("dados_pagamento: %s", resumir_payload(dados_pagamento))
+            logger.info("dados_financeiro: %s", resumir_payload(dados_financeiro))
+            logger.info("payload: %s", resumir_payload(payload))
         finally:
             pass
 
         return retorno
-    
\ No newline at end of file
+
+    def carregar_watermark(self,companyNumber:int,rotina:str=ROTINA_PAGAMENTO) -> date | None:
+        """ Retorna a última data conciliada com sucesso para a empresa """
+
+        ultima_data:date = None
+        with get_session() as session:
+            watermark_servicedb = WatermarkService(db=session)
+            try:
+                ultima_data = watermark_servicedb.obter_ultima_data(rotina=rotina,company_number=companyNumber)
+            except Exception as e:
+                logger.error(f"Erro ao buscar a última data conciliada da empresa {companyNumber}: {e}")
+            finally:
+                session.close()
+        return ultima_data
+
+    def salvar_watermark(self,companyNumber:int,startDate:date,endDate:date,rotina:str=ROTINA_PAGAMENTO) -> bool:
+        """ Registra o período como conciliado, se ele for contíguo à última data conciliada """
+
+        status:bool = False
+        with get_session() as session:
+            watermark_servicedb = WatermarkService(db=session)
+            try:
+                watermark_servicedb.avancar(rotina=rotina,company_number=companyNumber,inicio=startDate,fim=endDate)
+                status = True
+            except Exception as e:
+                logger.error(f"Erro ao salvar a última data conciliada da empresa {companyNumber}: {e}")
+            finally:
+                session.close()
+        return status
+
+    def saltar_watermark(self,companyNumber:int,startDate:date,rotina:str=ROTINA_PAGAMENTO) -> bool:
+        """
+        Leva a última data conciliada para o dia anterior a startDate quando ela ficou para trás
+        da janela de recuperação, para que os períodos seguintes voltem a ser contíguos.
+        Os dias saltados ficam registrados no log e podem ser reprocessados com forcar.
+        """
+        status:bool = False
+        ate:date = startDate - timedelta(days=1)
+        with get_session() as session:
+            watermark_servicedb = WatermarkService(db=session)
+            try:
+                ultima_data = watermark_servicedb.obter_ultima_data(rotina=rotina,company_number=companyNumber)
+                if ultima_data and ultima_data < ate:
+                    logger.warning(f"Empresa {companyNumber}: o período de {ultima_data + timedelta(days=1)} a {ate} está fora da janela "
+                                   f"de recuperação e não será processado; a última data conciliada passa para {ate}.")
+                    watermark_servicedb.avancar(rotina=rotina,company_number=companyNumber,inicio=ate,fim=ate,saltar=True)
+                status = True
+            except Exception as e:
+                logger.error(f"Erro ao saltar a última data conciliada da empresa {companyNumber}: {e}")
+            finally:
+                session.close()
+        return status
+
+    def registrar_falha_dia(self,companyNumber:int,dia:date,rotina:str=ROTINA_PAGAMENTO) -> bool:
+        """
+        Conta a falha do dia pendente mais antigo da empresa. Depois de ROTINA_MAX_FALHAS_DIA execuções
+        seguidas com falha, o dia é descartado (registrado como conciliado) para que as próximas
+        execuções sigam adiante; ele pode ser reprocessado depois com forcar.
+            :return bool: se o dia foi descartado.
+        """
+        falhas:int = 0
+        with get_session() as session:
+            watermark_servicedb = WatermarkService(db=session)
+            try:
+                if watermark_servicedb.obter_ultima_data(rotina=rotina,company_number=companyNumber) == dia - timedelta(days=1):
+                    falhas = watermark_servicedb.registrar_falha(rotina=rotina,company_number=companyNumber)
+            except Exception as e:
+                logger.error(f"Erro ao registrar a falha do dia {dia} da empresa {companyNumber}: {e}")
+            finally:
+                session.close()
+        if falhas < self.max_falhas_dia:
+            return False
+        logger.error(f"Empresa {companyNumber}: o dia {dia} falhou em {falhas} execuções seguidas e foi descartado; "
+                     f"reprocesse-o com forcar para recuperar os pagamentos.")
+        return self.salvar_watermark(companyNumber=companyNumber,startDate=dia,endDate=dia,rotina=rotina)
+
+    def atualizar_dias(self,companyNumber:int,startDate:date,endDate:date,cancelamento:threading.Event=None,retorno_primeiro:dict=None) -> dict:
+        """
+        Processa o período dia a dia, avançando a última data conciliada a cada dia concluído e
+        parando no primeiro dia com falha, que é contado em registrar_falha_dia.
+            :param retorno_primeiro: resultado já obtido para startDate, que não é processado de novo.
+            :return dict: resultado do último dia processado, com 'concluido_ate' (último dia conciliado ou descartado)
+                          e as etapas somadas de todos os dias.
+        """
+        retorno:dict = {}
+        resultados:list[dict] = []
+        concluido_ate:date = None
+        dia:date = startDate
+        while dia <= endDate:
+            verificar_cancelamento(cancelamento)
+            retorno = retorno_primeiro if retorno_primeiro is not None and dia == startDate else \
+                      self.atualizar_dados_pagamento(companyNumber=companyNumber,startDate=dia,endDate=dia,cancelamento=cancelamento)
+            resultados.append(retorno)
+            if cancelamento is not None and cancelamento.is_set():
+                break
+            if not retorno.get('sucesso'):
+                if self.registrar_falha_dia(companyNumber=companyNumber,dia=dia):
+                    concluido_ate = dia
+                retorno['mensagem'] = f"Falha no dia {dia.strftime('%d/%m/%Y')}: {retorno.get('mensagem')}"
+                break
+            self.salvar_watermark(companyNumber=companyNumber,startDate=dia,endDate=dia)
+            concluido_ate = dia
+            dia += timedelta(days=1)
+        return {**retorno, "concluido_ate": concluido_ate, "etapas": somar_etapas(resultados)}
+
+    def obter_periodo_pendente(self,companyNumber:int,startDate:date,endDate:date,forcar:bool=False) -> tuple[date,date] | None:
+        """
+        Remove do período os dias já conciliados para a empresa.
+            :param forcar: ignora a última data conciliada e reprocessa o período inteiro.
+            :return tuple[date,date] | None: período a processar, ou None se já foi todo conciliado.
+        """
+        if not forcar:
+            ultima_data = self.carregar_watermark(companyNumber=companyNumber)
+            if ultima_data and ultima_data >= startDate:
+                startDate = ultima_data + timedelta(days=1)
+        if startDate > endDate:
+            return None
+        return (startDate, endDate)
+
+    def obter_inicio_recuperacao(self,companyNumber:int,endDate:date,max_dias:int) -> date:
+        """
+        Data inicial para a execução agendada: o dia seguinte à última data conciliada,
+        limitado aos max_dias anteriores a endDate. Sem data conciliada, processa apenas endDate.
+        """
+        ultima_data = self.carregar_watermark(companyNumber=companyNumber)
+        if not ultima_data:
+            return endDate
+        limite = endDate - timedelta(days=max(1, max_dias) - 1)
+        inicio = ultima_data + timedelta(days=1)
+        if inicio < limite:
+            logger.warning(f"Empresa {companyNumber}: recuperação limitada a {max_dias} dia(s); "
+                           f"o período de {inicio} a {limite - timedelta(days=1)} não será processado automaticamente.")
+            inicio = limite
+        return inicio
+
+    def atualizar_dados_pagamento_incremental(self,companyNumber:int,startDate:date,endDate:date,forcar:bool=False,
+                                              recuperacao:bool=False,cancelamento:threading.Event=None) -> dict:
+        """
+        Executa atualizar_dados_pagamento apenas para os dias ainda não conciliados da empresa
+        e, em caso de sucesso, avança a última data conciliada.
+        Se o período falhar, ele é refeito dia a dia (atualizar_dias), para que os dias concluídos
+        não sejam reprocessados nas próximas execuções.
+        A empresa fica travada durante a execução; se já estiver em processamento, nada é feito.
+            :param recuperacao: startDate é o início da janela de recuperação (obter_inicio_recuperacao);
+                                os dias entre a última data conciliada e startDate são deixados de lado.
+            :param cancelamento: evento sinalizado pelo chamador para interromper a execução entre etapas;
+                                 uma execução cancelada não avança a última data conciliada.
+        """
+        with travas_empresas.travar(companyNumber) as obtida:
+            if not obtida:
+                logger.warning(f"Empresa {companyNumber} já está em processamento; execução ignorada.")
+                return {"sucesso": False, "mensagem": f"Empresa {companyNumber} já está em processamento."}
+
+            if recuperacao:
+                self.saltar_watermark(companyNumber=companyNumber,startDate=startDate)
+            periodo = self.obter_periodo_pendente(companyNumber=companyNumber,startDate=startDate,endDate=endDate,forcar=forcar)
+            if not periodo:
+                logger.info(f"Período de {startDate} a {endDate} já conciliado para a empresa {companyNumber}.")
+                return {"sucesso": True, "mensagem": f"Período já processado ({startDate.strftime('%d/%m/%Y')}-{endDate.strftime('%d/%m/%Y')})."}
+
+            retorno = self.atualizar_dados_pagamento(companyNumber=companyNumber,startDate=periodo[0],endDate=periodo[1],cancelamento=cancelamento)
+            retorno['periodo'] = {"startDate": periodo[0], "endDate": periodo[1]}
+            if cancelamento is not None and cancelamento.is_set():
+                logger.warning(f"Execução da empresa {companyNumber} cancelada; a última data conciliada não foi alterada.")
+                return {**retorno, "sucesso": False, "mensagem": retorno.get('mensagem') or "Execução cancelada pelo chamador."}
+            if retorno.get('sucesso'):
+                self.salvar_watermark(companyNumber=companyNumber,startDate=periodo[0],endDate=periodo[1])
+                retorno['concluido_ate'] = periodo[1]
+                return retorno
+
+            um_dia:bool = periodo[0] == periodo[1]
+            try:
+                dias = self.atualizar_dias(companyNumber=companyNumber,startDate=periodo[0],endDate=periodo[1],
+                                           cancelamento=cancelamento,retorno_primeiro=retorno if um_dia else None)
+            except Exception as e:
+                logger.warning(f"Execução da empresa {companyNumber} interrompida: {e}")
+                return retorno
+            return {**dias,
+                    "sucesso": bool(dias.get('sucesso')) and dias.get('concluido_ate') == periodo[1],
+                    "periodo": retorno['periodo'],
+                    "etapas": retorno.get('etapas') if um_dia else somar_etapas([retorno, dias])}
@@ -1,19 +1,54 @@
-import os, requests, json
+import os, json, time, requests
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from src.rede.utils.log import set_logger
-from src.rede.services.token import TokenService
+from src.rede.utils.log import set_logger, resumir_payload
+from src.rede.services.token import TokenService, cache_token
 from src.rede.database.database import get_session
+from src.rede.utils.http import TransporteHttp, obter_transporte, resposta_ok
+from src.rede.utils.concorrencia import mapear_em_ordem
+from src.rede.utils.metricas import tokens_gerados, registros_buscados, registros_gravados
 logger = set_logger(__name__)
 load_dotenv()
 
+URL_LOAD_RECORDS:str = 'https://api.sankhya.com.br/gateway/v1/mge/service.sbr?serviceName=CRUDServiceProvider.loadRecords&outputType=json'
+URL_DATASET_SAVE:str = 'https://api.sankhya.com.br/gateway/v1/mge/service.sbr?serviceName=DatasetSP.save&outputType=json'
+
+def indexar_financeiro(dados_financeiro:list[dict],campo_salesumnum:str,campo_vencimento:str) -> dict[tuple[int,str],dict]:
+    """
+    Indexa os registros do Sankhya por (saleSummaryNumber, vencimento), com o vencimento
+    convertido uma única vez para o formato das datas da Rede (AAAA-MM-DD).
+    Em caso de chave repetida, prevalece o primeiro registro.
+        :param dados_financeiro: registros retornados pelo loadRecords.
+        :param campo_salesumnum: nome do campo com o saleSummaryNumber.
+        :param campo_vencimento: nome do campo com a data de vencimento (DD/MM/AAAA).
+        :return dict: registros indexados.
+    """
+    indice:dict[tuple[int,str],dict] = {}
+    for registro in dados_financeiro:
+        try:
+            chave = (int(registro.get(campo_salesumnum)), datetime.strptime(registro.get(campo_vencimento),'%d/%m/%Y').strftime('%Y-%m-%d'))
+        except (TypeError, ValueError):
+            continue
+        indice.setdefault(chave, registro)
+    return indice
+
 class AutenticacaoService:
 
-    def __init__(self):
+    # Falhas de comunicação em que o envio de um lote é repetido
+    erros_comunicacao:tuple[type[Exception],...] = (requests.ConnectionError, requests.Timeout)
+
+    def __init__(self,transporte:TransporteHttp=None):
         self.sistema = 'sankhya'
+        self.ambiente = 'prd'
+        self.pacote = 'api'
+        self.http = transporte or obter_transporte()
         self.url = os.getenv('URL_AUTH_SNK')
         self.x_token = os.getenv('XTOKEN')
         self.app_id = os.getenv('APP_ID')
+        self.tamanho_lote_busca:int = int(os.getenv('SNK_TAMANHO_LOTE_BUSCA', '500'))
+        self.max_workers_busca:int = int(os.getenv('SNK_MAX_WORKERS', '4'))
+        self.tamanho_lote_save:int = int(os.getenv('SNK_TAMANHO_LOTE_SAVE', '200'))
+        self.tentativas_save:int = int(os.getenv('SNK_TENTATIVAS_SAVE', '3'))
 
         if not any([self.url, self.x_token, self.app_id]):
             logger.critical("Variáveis de ambiente não configuradas corretamente para SANKHYA.")
@@ -29,7 +64,9 @@ class AutenticacaoService:
                     sistema=self.sistema,
                     access_token=token.get('token',''),
                     refresh_token='',
-                    expires_at=datetime.strptime(token.get('dhExpiracaoToken',''), "%Y-%m-%dT%H:%M:%S.%f") if token.get('dhExpiracaoToken') else None
+                    expires_at=datetime.strptime(token.get('dhExpiracaoToken',''), "%Y-%m-%dT%H:%M:%S.%f") if token.get('dhExpiracaoToken') else None,
+                    ambiente=self.ambiente,
+                    pacote=self.pacote
                 )
                 status = True
             except Exception as e:
@@ -43,7 +80,7 @@ class AutenticacaoService:
         with get_session() as session:
             token_servicedb = TokenService(db=session)
             try:
-                token_db = token_servicedb.obter_token(sistema=self.sistema)
+                token_db = token_servicedb.obter_token(sistema=self.sistema,ambiente=self.ambiente,pacote=self.pacote)
                 if token_db:
                     token = token_db.__dict__
                 else:
@@ -54,28 +91,26 @@ class AutenticacaoService:
                 session.close()
         return token
 
+    def montar_requisicao_login(self) -> dict:
+        return {
+            "url": self.url+f"/{self.app_id}",
+            "headers": {
+                'xToken': self.x_token
+            }
+        }
+
+    def tratar_retorno_login(self,res) -> dict:
+        if not resposta_ok(res):
+            raise Exception(f"Erro {res.status_code} ao autenticar: {res.text}")
+        return res.json()
+
     def logar(self) -> dict:
 
         auth:dict=''
 
-        # Header da requisição
-        header:dict = {
-            'xToken': self.x_token
-        }
-        
-        url:str = self.url+f"/{self.app_id}"
-
         try:
-            res = requests.post(
-                url=url,
-                headers=header
-            )
-            
-            if not res.ok:
-                raise Exception(f"Erro {res.status_code} ao autenticar: {res.get("mensagem")}")
-            
-            auth = res.json()
-                
+            res = self.http.post(**self.montar_requisicao_login())
+            auth = self.tratar_retorno_login(res)
         except Exception as e:
             logger.error(str(e))
         finally:
@@ -83,25 +118,219 @@ class AutenticacaoService:
 
         return auth
 
+    def chave_token(self) -> tuple:
+        return (self.sistema, self.ambiente, self.pacote)
+
+    def registrar_token_gerado(self,token:dict) -> dict:
+        """
+        Persiste o token recém-gerado e o converte para o formato do cache de tokens.
+            :param token: retorno de logar.
+            :return dict: {access_token, expires_at}.
+        """
+        tokens_gerados.incrementar(sistema=self.sistema,ambiente=self.ambiente,pacote=self.pacote,resultado="sucesso" if token else "falha")
+        if not token:
+            return {}
+        self.salvar_token(token)
+        return {
+            "access_token": token.get('token', ''),
+            "expires_at": datetime.strptime(token.get('dhExpiracaoToken',''), "%Y-%m-%dT%H:%M:%S.%f") if token.get('dhExpiracaoToken') else None
+        }
+
+    def renovar_token(self) -> dict:
+        return self.registrar_token_gerado(self.logar())
+
     def autenticar(self) -> bool:
 
-        token:dict = self.carregar_token()
-        if not token or not token.get('expires_at') or token.get('expires_at') <= datetime.now():
-            token = self.logar()
-            if token:
-                self.salvar_token(token)
-                self.token = token.get('token', '')
-                return True
-            else:
-                return False
-        else:
-            self.token = token.get('token', '')
-            return True
+        cache_token.registrar_renovacao(self.chave_token(), self.renovar_token)
+        token:dict = cache_token.obter_ou_renovar(chave=self.chave_token(),
+                                                  carregar=self.carregar_token,
+                                                  gerar=self.renovar_token)
+        if not token:
+            return False
+        self.token = token.get('access_token', '')
+        return True
+
+    def montar_cabecalho(self,token:str=None) -> dict:
+        if not token:
+            token = self.token
+        return { "Authorization":f"Bearer {token}" }
+
+    def montar_payload_save(self,entidade:str,payload:list[dict]) -> dict:
+        return {
+            "serviceName":"DatasetSP.save",
+            "requestBody":{
+                "entityName":entidade,
+                "standAlone":False,
+                "fields":self.fields,
+                "records": payload
+            }
+        }
+
+    def tratar_retorno_servico(self,res) -> dict:
+        """
+        Valida a resposta de um serviço do gateway Sankhya.
+            :param res: resposta HTTP (requests ou httpx).
+            :return dict: corpo da resposta quando o status do serviço é '0' ou '1'.
+        """
+        if resposta_ok(res):
+            dados = res.json()
+            if dados.get('status') in ['0','1']:
+                return dados
+        raise Exception(f"{res.status_code} - {res.text}")
+
+    def dividir_lista(self,lista:list) -> list[list[int]]:
+        """
+        Remove duplicidades e divide a lista de identificadores em lotes de SNK_TAMANHO_LOTE_BUSCA itens,
+        mantendo cada expressão IN (...) dentro do limite aceito pelo Sankhya.
+        """
+        unicos:list[int] = list(dict.fromkeys(int(i) for i in lista))
+        return [unicos[i:i+self.tamanho_lote_busca] for i in range(0, len(unicos), self.tamanho_lote_busca)]
+
+    def possui_mais_registros(self,dados:dict) -> bool:
+        entidades:dict = dados.get('responseBody',{}).get('entities') or {}
+        return str(entidades.get('hasMoreResult','false')).lower() == 'true'
+
+    def registrar_busca(self,payload:dict,registros:list[dict]) -> list[dict]:
+        """ Contabiliza nas métricas os registros retornados pelo loadRecords """
+
+        registros_buscados.incrementar(len(registros),origem=f"sankhya.{payload.get('requestBody',{}).get('dataSet',{}).get('rootEntity','')}")
+        return registros
+
+    def registrar_gravacao(self,entidade:str,resultado:dict) -> dict:
+        """ Contabiliza nas métricas os registros enviados, rejeitados e ignorados """
+
+        for chave in ('enviados','falhas','ignorados'):
+            if resultado.get(chave):
+                registros_gravados.incrementar(resultado[chave],entidade=entidade,resultado=chave)
+        return resultado
+
+    def carregar_registros(self,payload:dict,headers:dict) -> list[dict]:
+        """
+        Executa o CRUDServiceProvider.loadRecords percorrendo as páginas (offsetPage) enquanto houver resultados.
+            :param payload: payload do loadRecords.
+            :param headers: cabeçalhos da requisição.
+            :return list[dict]: registros de todas as páginas.
+        """
+        registros:list[dict] = []
+        pagina:int = 0
+        while True:
+            payload['requestBody']['dataSet']['offsetPage'] = str(pagina)
+            res = self.http.get(
+                url=URL_LOAD_RECORDS,
+                headers=headers,
+                json=payload
+            )
+            dados = self.tratar_retorno_servico(res)
+            registros.extend(self.formatar_retorno(dados) or [])
+            if not self.possui_mais_registros(dados):
+                break
+            pagina+=1
+        return self.registrar_busca(payload,registros)
+
+    def carregar_lotes(self,payloads:list[dict],headers:dict,chave:str) -> list[dict]:
+        """
+        Executa os payloads de busca em paralelo (até SNK_MAX_WORKERS) e junta os resultados.
+            :param payloads: um payload de loadRecords por lote.
+            :param headers: cabeçalhos da requisição.
+            :param chave: campo usado para eliminar registros repetidos entre os lotes.
+            :return list[dict]: registros de todos os lotes, sem duplicidade.
+        """
+        registros:list[dict] = []
+        vistos:set = set()
+        for resultado in mapear_em_ordem(lambda payload: self.carregar_registros(payload=payload,headers=headers),payloads,self.max_workers_busca):
+            for registro in resultado:
+                identificador = registro.get(chave)
+                if identificador is not None:
+                    if identificador in vistos:
+                        continue
+                    vistos.add(identificador)
+                registros.append(registro)
+        return registros
+
+    def enviar_lote(self,entidade:str,lote:list[dict],headers:dict) -> str:
+        """
+        Envia um lote de registros ao DatasetSP.save.
+            :return str: mensagem de rejeição do Sankhya, ou vazio quando o lote foi salvo.
+        """
+        res = self.http.post(
+            url=URL_DATASET_SAVE,
+            headers=headers,
+            json=self.montar_payload_save(entidade=entidade,payload=lote)
+        )
+        dados = self.tratar_retorno_servico(res)
+        if dados.get('status') == '1':
+            return ''
+        return dados.get('statusMessage') or f"Status {dados.get('status')} retornado pelo DatasetSP.save"
+
+    def salvar_lote(self,entidade:str,lote:list[dict],headers:dict) -> list[dict]:
+        """
+        Salva um lote, repetindo o envio apenas em falhas de conexão e timeouts (SNK_TENTATIVAS_SAVE),
+        com o mesmo backoff exponencial do transporte HTTP entre as tentativas.
+        Respostas 429 e 503 já são repetidas pelo transporte HTTP; demais erros HTTP não são repetidos.
+        Quando o Sankhya rejeita o lote, ele é dividido ao meio até isolar os registros com problema.
+            :return list[dict]: resultado de cada registro do lote (pk, sucesso, erro).
+        """
+        erro:str = ''
+        rejeitado:bool = False
+        for tentativa in range(1, self.tentativas_save+1):
+            try:
+                erro = self.enviar_lote(entidade=entidade,lote=lote,headers=headers)
+            except self.erros_comunicacao as e:
+                erro = str(e)
+                if tentativa < self.tentativas_save:
+                    espera = self.http.calcular_backoff(tentativa)
+                    logger.warning(f"Falha no envio do lote de {len(lote)} registro(s) para {entidade} (tentativa {tentativa}/{self.tentativas_save}), nova tentativa em {espera:.2f}s: {e}")
+                    time.sleep(espera)
+                else:
+                    logger.error(f"Falha no envio do lote de {len(lote)} registro(s) para {entidade} após {self.tentativas_save} tentativa(s): {e}")
+                continue
+            except Exception as e:
+                erro = str(e)
+                logger.error(f"Erro no envio do lote de {len(lote)} registro(s) para {entidade}: {e}")
+                break
+            if not erro:
+                return [{"pk": registro.get("pk"), "sucesso": True, "erro": ""} for registro in lote]
+            rejeitado = True
+            break
+
+        if rejeitado and len(lote) > 1:
+            meio = len(lote) // 2
+            return self.salvar_lote(entidade=entidade,lote=lote[:meio],headers=headers) + self.salvar_lote(entidade=entidade,lote=lote[meio:],headers=headers)
+        return [{"pk": registro.get("pk"), "sucesso": False, "erro": erro} for registro in lote]
+
+    def salvar_em_lotes(self,entidade:str,registros:list[dict],token:str=None) -> dict:
+        """
+        Salva os registros no DatasetSP.save em lotes de SNK_TAMANHO_LOTE_SAVE, com até SNK_MAX_WORKERS envios simultâneos.
+            :param entidade: entidade do Sankhya.
+            :param registros: registros no formato {"pk": {...}, "values": {...}}.
+            :param token: token de acesso. Padrão: token da instância.
+            :return dict: sucesso (todos salvos), total, enviados, falhas, ignorados e o resultado de cada registro.
+        """
+        headers = self.montar_cabecalho(token=token)
+        lotes = [registros[i:i+self.tamanho_lote_save] for i in range(0, len(registros), self.tamanho_lote_save)]
+        resultado:dict = {"sucesso": False, "total": len(registros), "enviados": 0, "falhas": 0, "ignorados": 0, "registros": []}
+
+        for resultado_lote in mapear_em_ordem(lambda lote: self.salvar_lote(entidade=entidade,lote=lote,headers=headers),lotes,self.max_workers_busca):
+            resultado['registros'].extend(resultado_lote)
+
+        resultado['enviados'] = sum(1 for registro in resultado['registros'] if registro.get('sucesso'))
+        resultado['falhas'] = resultado['total'] - resultado['enviados']
+        resultado['sucesso'] = resultado['total'] > 0 and resultado['falhas'] == 0
+        return self.registrar_gravacao(entidade,resultado)
+
+    def logar_resultado_envio(self,resultado:dict,descricao:str) -> bool:
+
+        if resultado.get('falhas'):
+            logger.error(f"Erro na {descricao}: {resultado.get('falhas')} de {resultado.get('total')} registro(s) não foram salvos")
+            for registro in resultado.get('registros',[]):
+                if not registro.get('sucesso'):
+                    logger.error(f"- {registro.get('pk')}: {registro.get('erro')}")
+        return resultado.get('sucesso', False)
 
 class FinanceiroService(AutenticacaoService):
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self,transporte:TransporteHttp=None):
+        super().__init__(transporte=transporte)
         self.fields:list = [
                     "AD_REDE_AMOUNT",
                     "AD_REDE_EXPIRATIONDATE",
@@ -194,84 +423,64 @@ class FinanceiroService(AutenticacaoService):
                     pass
                 return new_res
 
-    def buscar(self,token:str=None,saleSummaryNumber:int=None,lista:list=None) -> dict:
-
-        def monta_expressao(saleSummaryNumber:int=None,lista:list=None):
-            nonlocal criteria
+    def montar_payload_busca(self,saleSummaryNumber:int=None,lista:list=None) -> dict:
 
-            if not any([saleSummaryNumber,lista]):
-                return False
-            
-            try:
-                if saleSummaryNumber:
-                    criteria = {
-                        "expression": {
-                            "$": "this.AD_REDE_SALESUMNUM = ?"
-                        },
-                        "parameter": [
-                            {
-                                "$": f"{saleSummaryNumber}",
-                                "type": "I"
-                            }
-                        ]
-                    }
-                elif lista:
-                    criteria = {
-                        "expression": {
-                            "$": "this.AD_REDE_SALESUMNUM IN ("+','.join('?' for _ in lista)+")"
-                        },
-                        "parameter": [ { "$": str(i), "type": "I" } for i in lista ]
-                    }
-                else:
-                    pass
-                return True
-            except Exception as e:
-                logger.error(f"Erro ao montar expressão: {e}")
-                return False
-
-        dados_financeiro:dict = {}
-        url:str = 'https://api.sankhya.com.br/gateway/v1/mge/service.sbr?serviceName=CRUDServiceProvider.loadRecords&outputType=json'
-        fieldset_list:str = 'AD_REDE_AMOUNT,AD_REDE_EXPIRATIONDATE,AD_REDE_INSTALLMENTNUM,AD_REDE_MDRAMOUNT,AD_REDE_MDRFEE,AD_REDE_NETAMOUNT,AD_REDE_PAYMENTDATE,AD_REDE_PAYMENTID,AD_REDE_PROCESSADO,AD_REDE_TID,AD_REDE_SALESUMNUM,NUFIN'
         criteria:dict={}
-        payload:dict={}
-
-        if not token:
-            token = self.token
+        fieldset_list:str = 'AD_REDE_AMOUNT,AD_REDE_EXPIRATIONDATE,AD_REDE_INSTALLMENTNUM,AD_REDE_MDRAMOUNT,AD_REDE_MDRFEE,AD_REDE_NETAMOUNT,AD_REDE_PAYMENTDATE,AD_REDE_PAYMENTID,AD_REDE_PROCESSADO,AD_REDE_TID,AD_REDE_SALESUMNUM,NUFIN'
 
-        try:
-            saleSummaryNumber = int(saleSummaryNumber) if saleSummaryNumber else None
-            lista = [int(i) for i in lista] if lista else None
-            
-            if not monta_expressao(saleSummaryNumber=saleSummaryNumber,lista=lista):
-                raise ValueError("Nenhum critério de busca fornecido.")
-
-            payload = {
-                    "serviceName": "CRUDServiceProvider.loadRecords",
-                    "requestBody": {
-                        "dataSet": {
-                            "rootEntity": "Financeiro",
-                            "includePresentationFields": "N",
-                            "offsetPage": "0",
-                            "criteria": criteria,
-                            "entity": {
-                                "fieldset": {
-                                    "list": fieldset_list
-                                }
+        saleSummaryNumber = int(saleSummaryNumber) if saleSummaryNumber else None
+        lista = [int(i) for i in lista] if lista else None
+
+        if saleSummaryNumber:
+            criteria = {
+                "expression": {
+                    "$": "this.AD_REDE_SALESUMNUM = ?"
+                },
+                "parameter": [
+                    {
+                        "$": f"{saleSummaryNumber}",
+                        "type": "I"
+                    }
+                ]
+            }
+        elif lista:
+            criteria = {
+                "expression": {
+                    "$": "this.AD_REDE_SALESUMNUM IN ("+','.join('?' for _ in lista)+")"
+                },
+                "parameter": [ { "$": str(i), "type": "I" } for i in lista ]
+            }
+        else:
+            raise ValueError("Nenhum critério de busca fornecido.")
+
+        return {
+                "serviceName": "CRUDServiceProvider.loadRecords",
+                "requestBody": {
+                    "dataSet": {
+                        "rootEntity": "Financeiro",
+                        "includePresentationFields": "N",
+                        "offsetPage": "0",
+                        "criteria": criteria,
+                        "entity": {
+                            "fieldset": {
+                                "list": fieldset_list
                             }
                         }
                     }
                 }
+            }
 
-            res = requests.get(
-                url=url,
-                headers={ "Authorization":f"Bearer {token}" },
-                json=payload
-            )
-            
-            if res.ok and res.json().get('status') in ['0','1']:
-                dados_financeiro = self.formatar_retorno(res.json())
+    def buscar(self,token:str=None,saleSummaryNumber:int=None,lista:list=None) -> dict:
+
+        dados_financeiro:dict = {}
+        payloads:list[dict]=[]
+
+        try:
+            if lista and not saleSummaryNumber:
+                payloads = [self.montar_payload_busca(lista=lote) for lote in self.dividir_lista(lista)]
             else:
-                raise Exception(f"{res.status_code} - {res.text}")
+                payloads = [self.montar_payload_busca(saleSummaryNumber=saleSummaryNumber,lista=lista)]
+            dados_financeiro = self.carregar_lotes(payloads=payloads,headers=self.montar_cabecalho(token=token),chave="nufin")
         except Exception as e:
             logger.error(f"Erro ao buscar dados financeiro: {e}")
         finally:
@@ -279,40 +488,17 @@ class FinanceiroService(AutenticacaoService):
 
         return dados_financeiro
         
-    def atualizar(self,payload:list[dict],token:str=None) -> bool:
+    def atualizar(self,*,payload:list[dict],token:str=None) -> bool:
         
         sucesso:bool = False
-        url:str = 'https://api.sankhya.com.br/gateway/v1/mge/service.sbr?serviceName=DatasetSP.save&outputType=json'        
-        if not token:
-            token = self.token        
-        payload_send = {
-            "serviceName":"DatasetSP.save",
-            "requestBody":{
-                "entityName":"Financeiro",
-                "standAlone":False,
-                "fields":self.fields,
-                "records": payload
-            }
-        }
-        headers = { "Authorization":f"Bearer {token}" }
 
-        logger.info(f"Enviando headers de atualização para a API Sankhya: {headers}")
-        logger.info(f"Enviando payload de atualização para a API Sankhya: {payload_send}")        
+        logger.info("Enviando payload de atualização para a API Sankhya: %s", resumir_payload(payload))
 
         try:
-            res = requests.post(
-                url=url,
-                headers=headers,
-                json=payload_send
-            )
-            if res.ok and res.json().get('status') in ['0','1']:
-                sucesso = True if res.json().get('status') == '1' else False
-            else:
-                raise Exception(f"{res.status_code} - {res.text}")
+            sucesso = self.logar_resultado_envio(self.salvar_em_lotes(entidade="Financeiro",registros=payload,token=token),
+                                                 descricao="atualização dos dados financeiro")
         except Exception as e:
             logger.error(f"Erro ao atualizar dados financeiro: {e}")
-            logger.info("headers: %s", { "Authorization":f"Bearer {token}" })
-            logger.info("payload: %s", payload_send)
         finally:
             pass
 
@@ -350,9 +536,10 @@ class FinanceiroService(AutenticacaoService):
         update:dict = {}       
 
         try:
+            indice = indexar_financeiro(dados_financeiro,campo_salesumnum="ad_rede_salesumnum",campo_vencimento="ad_rede_expirationdate")
             # Formata payload de atualização para a API Sankhya
             for i, pagamento in enumerate(dados_pagamento):
-                matching_financeiro = next((f for f in dados_financeiro if int(f.get("ad_rede_salesumnum")) == pagamento.get("saleSummaryNumber") and datetime.strptime(f.get('ad_rede_expirationdate'),'%d/%m/%Y').strftime('%Y-%m-%d') == pagamento.get("paymentDate")), None)
+                matching_financeiro = indice.get((pagamento.get("saleSummaryNumber"), pagamento.get("paymentDate")))
                 if matching_financeiro:
                     update = {
                         "pk": {
@@ -371,8 +558,8 @@ class FinanceiroService(AutenticacaoService):
 
 class PagamentoService(AutenticacaoService):
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self,transporte:TransporteHttp=None):
+        super().__init__(transporte=transporte)
         self.fields:list = [
                     "AMOUNT",
                     "BANDEIRA",
@@ -383,8 +570,6 @@ class PagamentoService(AutenticacaoService):
                     "PAYMENTDATE",
                     "PAYMENTID"
                 ]
-        self.payload_registro:list[dict] = []
-        self.payload_pagamento:list[dict] = []
 
     def formatar_retorno(self, res:dict) -> list:
 
@@ -464,16 +649,19 @@ class PagamentoService(AutenticacaoService):
                     pass
                 return new_res
 
-    def formatar_payload_registro(self,dados_rede:dict,dados_sankhya:dict) -> bool:
+    def formatar_payload_registro(self,dados_rede:dict,dados_sankhya:dict) -> list[dict]:
 
         matching:dict = {}
         payload_upd_snk:list[dict] = []
         update:dict = {}       
 
         try:
+            parcelas:dict[int,dict] = {}
+            for parcela in dados_rede.get("content",{}).get("installments",[]):
+                parcelas.setdefault(int(parcela.get("installmentNumber")), parcela)
             # Formata payload de atualização para a API Sankhya
             for i, item in enumerate(dados_sankhya):
-                matching = next((f for f in dados_rede.get("content",{}).get("installments",[]) if int(f.get("installmentNumber")) == int(item.get("desdobramento"))), None)
+                matching = parcelas.get(int(item.get("desdobramento")))
                 if matching:
                     update = {
                         "pk":{
@@ -489,140 +677,138 @@ class PagamentoService(AutenticacaoService):
                         }
                     }
                     payload_upd_snk.append(update)
-            self.payload_registro = payload_upd_snk
-            return True
+            return payload_upd_snk
         except Exception as e:
             logger.error(f"Erro ao formatar payload de registro: {e}")
-            return False
-
-    def formatar_payload_pagamento(self,dados_pagamento:dict,dados_financeiro:dict) -> bool:
+            return []
 
+    def montar_payload_pagamento(self,dados_pagamento:list[dict],dados_financeiro:list[dict]) -> tuple[list[dict],int]:
+        """
+        Monta o payload de atualização dos pagamentos.
+            :return tuple[list[dict],int]: payload e quantidade de pagamentos já atualizados no Sankhya.
+        """
         pagamento:dict = {}
         matching_financeiro:dict = {}
         payload_upd_snk:list[dict] = []
         update:dict = {}       
-
-        try:
-            # Formata payload de atualização para a API Sankhya
-            for i, pagamento in enumerate(dados_pagamento):
-                matching_financeiro = next((f for f in dados_financeiro if int(f.get("salesumnum")) == pagamento.get("saleSummaryNumber") and datetime.strptime(f.get('expirationdate'),'%d/%m/%Y').strftime('%Y-%m-%d') == pagamento.get("paymentDate")), None)
-                if matching_financeiro:
-                    update = {
-                        "pk": {
-                            "ID": matching_financeiro.get("id")
-                        },
-                        "values": {
-                            "6": datetime.strptime(pagamento.get("paymentDate"), '%Y-%m-%d').strftime('%d/%m/%Y'),
-                            "7": pagamento.get("paymentId")
-                        }
+        ignorados:int = 0
+
+        indice = indexar_financeiro(dados_financeiro,campo_salesumnum="salesumnum",campo_vencimento="expirationdate")
+        # Formata payload de atualização para a API Sankhya
+        for i, pagamento in enumerate(dados_pagamento):
+            matching_financeiro = indice.get((pagamento.get("saleSummaryNumber"), pagamento.get("paymentDate")))
+            if matching_financeiro:
+                update = {
+                    "pk": {
+                        "ID": matching_financeiro.get("id")
+                    },
+                    "values": {
+                        "6": datetime.strptime(pagamento.get("paymentDate"), '%Y-%m-%d').strftime('%d/%m/%Y'),
+                        "7": pagamento.get("paymentId")
                     }
-                    payload_upd_snk.append(update)
-            self.payload_pagamento = payload_upd_snk
-            return True
-        except Exception as e:
-            logger.error(f"Erro ao formatar payload de pagamento: {e}")
-            return False
+                }
+                # O registro já contém a data e o id do pagamento: não há o que atualizar
+                if str(matching_financeiro.get("paymentdate") or '')[:10] == update["values"]["6"] and str(matching_financeiro.get("paymentid") or '') == str(update["values"]["7"]):
+                    ignorados += 1
+                    continue
+                payload_upd_snk.append(update)
+        if ignorados:
+            logger.info(f"{ignorados} pagamento(s) já atualizado(s) no Sankhya ignorado(s).")
+        return payload_upd_snk, ignorados
 
-    def buscar(self,token:str=None,saleSummaryNumber:int=None,nsu:int=None,lista_saleSummaryNumber:list=None,lista_nsu:list=None) -> dict:
+    def montar_payload_busca(self,saleSummaryNumber:int=None,nsu:int=None,lista_saleSummaryNumber:list=None,lista_nsu:list=None) -> dict:
 
-        def valida_parametros(saleSummaryNumber,nsu,lista_saleSummaryNumber,lista_nsu):
-            saleSummaryNumber = int(saleSummaryNumber) if saleSummaryNumber else None
-            nsu = int(nsu) if nsu else None
-            lista_saleSummaryNumber = [int(i) for i in lista_saleSummaryNumber] if lista_saleSummaryNumber else None
-            lista_nsu = [int(i) for i in lista_nsu] if lista_nsu else None
-            
-            if not any([saleSummaryNumber,nsu,lista_saleSummaryNumber,lista_nsu]):
-                raise ValueError("Nenhum critério de busca fornecido.")                
-
-        def monta_expressao(saleSummaryNumber,nsu,lista_saleSummaryNumber,lista_nsu):
-            nonlocal criteria
-            
-            try:
-                if saleSummaryNumber:
-                    criteria = {
-                        "expression": {
-                            "$": "this.SALESUMNUM = ?"
-                        },
-                        "parameter": [
-                            {
-                                "$": f"{saleSummaryNumber}",
-                                "type": "I"
-                            }
-                        ]
-                    }
-                elif nsu:
-                    criteria = {
-                        "expression": {
-                            "$": "this.NSU = ?"
-                        },
-                        "parameter": [
-                            {
-                                "$": f"{nsu}",
-                                "type": "I"
-                            }
-                        ]
+        criteria:dict={}
+        fieldset_list:str = '*'
+
+        saleSummaryNumber = int(saleSummaryNumber) if saleSummaryNumber else None
+        nsu = int(nsu) if nsu else None
+        lista_saleSummaryNumber = [int(i) for i in lista_saleSummaryNumber] if lista_saleSummaryNumber else None
+        lista_nsu = [int(i) for i in lista_nsu] if lista_nsu else None
+
+        if saleSummaryNumber:
+            criteria = {
+                "expression": {
+                    "$": "this.SALESUMNUM = ?"
+                },
+                "parameter": [
+                    {
+                        "$": f"{saleSummaryNumber}",
+                        "type": "I"
                     }
-                elif lista_saleSummaryNumber:
-                    criteria = {
-                        "expression": {
-                            "$": "this.SALESUMNUM IN ("+','.join('?' for _ in lista_saleSummaryNumber)+")"
-                        },
-                        "parameter": [ { "$": str(i), "type": "I" } for i in lista_saleSummaryNumber ]
+                ]
+            }
+        elif nsu:
+            criteria = {
+                "expression": {
+                    "$": "this.NSU = ?"
+                },
+                "parameter": [
+                    {
+                        "$": f"{nsu}",
+                        "type": "I"
                     }
-                elif lista_nsu:
-                    criteria = {
-                        "expression": {
-                            "$": "this.NSU IN ("+','.join('?' for _ in lista_nsu)+")"
-                        },
-                        "parameter": [ { "$": str(i), "type": "I" } for i in lista_nsu ]
+                ]
+            }
+        elif lista_saleSummaryNumber:
+            criteria = {
+                "expression": {
+                    "$": "this.SALESUMNUM IN ("+','.join('?' for _ in lista_saleSummaryNumber)+")"
+                },
+                "parameter": [ { "$": str(i), "type": "I" } for i in lista_saleSummaryNumber ]
+            }
+        elif lista_nsu:
+            criteria = {
+                "expression": {
+                    "$": "this.NSU IN ("+','.join('?' for _ in lista_nsu)+")"
+                },
+                "parameter": [ { "$": str(i), "type": "I" } for i in lista_nsu ]
+            }
+        else:
+            raise ValueError("Nenhum critério de busca fornecido.")
+
+        return {
+                "serviceName": "CRUDServiceProvider.loadRecords",
+                "requestBody": {
+                    "dataSet": {
+                        "rootEntity": "AD_REDEPAGAMENTO",
+                        "includePresentationFields": "N",
+                        "offsetPage": "0",
+                        "criteria": criteria,
+                        "entity": {
+                            "fieldset": {
+                                "list": fieldset_list
+                            }
+                        }
                     }
-                else:
-                    pass
-                return True
-            except Exception as e:
-                logger.error(f"Erro ao montar expressão: {e}")
-                return False
+                }
+            }
 
-        dados_pagamento:dict = {}
-        url:str = 'https://api.sankhya.com.br/gateway/v1/mge/service.sbr?serviceName=CRUDServiceProvider.loadRecords&outputType=json'
-        fieldset_list:str = '*'
-        criteria:dict={}
-        payload:dict={}
+    def montar_payloads_busca(self,saleSummaryNumber:int=None,nsu:int=None,lista_saleSummaryNumber:list=None,lista_nsu:list=None) -> list[dict]:
+        """ Monta os payloads de busca, um por lote quando o critério for uma lista """
 
-        if not token:
-            token = self.token
+        if not any([saleSummaryNumber,nsu]):
+            if lista_saleSummaryNumber:
+                return [self.montar_payload_busca(lista_saleSummaryNumber=lote) for lote in self.dividir_lista(lista_saleSummaryNumber)]
+            if lista_nsu:
+                return [self.montar_payload_busca(lista_nsu=lote) for lote in self.dividir_lista(lista_nsu)]
+        return [self.montar_payload_busca(saleSummaryNumber=saleSummaryNumber,
+                                          nsu=nsu,
+                                          lista_saleSummaryNumber=lista_saleSummaryNumber,
+                                          lista_nsu=lista_nsu)]
 
-        valida_parametros(saleSummaryNumber,nsu,lista_saleSummaryNumber,lista_nsu)
-        monta_expressao(saleSummaryNumber,nsu,lista_saleSummaryNumber,lista_nsu)
+    def buscar(self,token:str=None,saleSummaryNumber:int=None,nsu:int=None,lista_saleSummaryNumber:list=None,lista_nsu:list=None) -> dict:
 
-        try:
-            payload = {
-                    "serviceName": "CRUDServiceProvider.loadRecords",
-                    "requestBody": {
-                        "dataSet": {
-                            "rootEntity": "AD_REDEPAGAMENTO",
-                            "includePresentationFields": "N",
-                            "offsetPage": "0",
-                            "criteria": criteria,
-                            "entity": {
-                                "fieldset": {
-                                    "list": fieldset_list
-                                }
-                            }
-                        }
-                    }
-                }
+        dados_pagamento:dict = {}
+        payloads:list[dict]=[]
 
-            res = requests.get(
-                url=url,
-                headers={ "Authorization":f"Bearer {token}" },
-                json=payload
-            )
-            
-            if res.ok and res.json().get('status') in ['0','1']:
-                dados_pagamento = self.formatar_retorno(res.json())
-            else:
-                raise Exception(f"{res.status_code} - {res.text}")
+        payloads = self.montar_payloads_busca(saleSummaryNumber=saleSummaryNumber,
+                                              nsu=nsu,
+                                              lista_saleSummaryNumber=lista_saleSummaryNumber,
+                                              lista_nsu=lista_nsu)
+
+        try:
+            dados_pagamento = self.carregar_lotes(payloads=payloads,headers=self.montar_cabecalho(token=token),chave="id")
         except Exception as e:
             logger.error(f"Erro ao buscar dados do pagamento: {e}")
         finally:
@@ -630,92 +816,37 @@ class PagamentoService(AutenticacaoService):
 
         return dados_pagamento
 
-    def enviar(self,token:str=None,payload:list[dict]=None) -> bool:
-        
-        sucesso:bool = False
-        url:str = 'https://api.sankhya.com.br/gateway/v1/mge/service.sbr?serviceName=DatasetSP.save&outputType=json'       
-        if not payload:
-            payload = self.payload_registro
-            if not payload:
-                return False
-
-        if not token:
-            token = self.token
+    def salvar_registros(self,*,payload:list[dict],token:str=None,operacao:str='atualização') -> dict:
+        """ Como salvar, mas retorna o resultado completo do envio (total, enviados, falhas e registros) """
 
-        payload_send = {
-            "serviceName":"DatasetSP.save",
-            "requestBody":{
-                "entityName":"AD_REDEPAGAMENTO",
-                "standAlone":False,
-                "fields":self.fields,
-                "records": payload
-            }
-        }
-        headers = { "Authorization":f"Bearer {token}" }
+        resultado:dict = {"sucesso": False, "total": len(payload), "enviados": 0, "falhas": len(payload), "ignorados": 0, "registros": []}
 
-        logger.info(f"Enviando headers de registro para a API Sankhya: {headers}")
-        logger.info(f"Enviando payload de registro para a API Sankhya: {payload_send}")        
+        logger.info("Enviando payload de %s para a API Sankhya: %s", operacao, resumir_payload(payload))
 
         try:
-            res = requests.post(
-                url=url,
-                headers=headers,
-                json=payload_send
-            )
-            if res.ok and res.json().get('status') in ['0','1']:
-                sucesso = True if res.json().get('status') == '1' else False
-            else:
-                raise Exception(f"{res.status_code} - {res.text}")
+            # montar_payload_pagamento já descarta o que o Sankhya tem igual à Rede, então todo
+            # registro que chega aqui diverge do Sankhya e precisa ser reenviado, mesmo que já tenha sido gravado antes
+            resultado = self.salvar_em_lotes(entidade="AD_REDEPAGAMENTO",registros=payload,token=token)
+            self.logar_resultado_envio(resultado=resultado,descricao=f"{operacao} dos dados do pagamento")
         except Exception as e:
-            logger.error(f"Erro ao enviar dados pagamento: {e}")
-            logger.info("headers: %s", { "Authorization":f"Bearer {token}" })
-            logger.info("payload: %s", payload_send)
+            logger.error(f"Erro na {operacao} dos dados do pagamento: {e}")
         finally:
             pass
 
-        return sucesso
-    
-    def atualizar(self,token:str=None,payload:list[dict]=None) -> bool:
-        
-        sucesso:bool = False
-        url:str = 'https://api.sankhya.com.br/gateway/v1/mge/service.sbr?serviceName=DatasetSP.save&outputType=json'        
-        if not payload:
-            payload = self.payload_pagamento
-            if not payload:
-                return False
+        return resultado
 
-        if not token:
-            token = self.token
-                    
-        payload_send = {
-            "serviceName":"DatasetSP.save",
-            "requestBody":{
-                "entityName":"AD_REDEPAGAMENTO",
-                "standAlone":False,
-                "fields":self.fields,
-                "records": payload
-            }
-        }
-        headers = { "Authorization":f"Bearer {token}" }
+    def salvar(self,*,payload:list[dict],token:str=None,operacao:str='atualização') -> bool:
 
-        logger.info(f"Enviando headers de atualização para a API Sankhya: {headers}")
-        logger.info(f"Enviando payload de atualização para a API Sankhya: {payload_send}")        
+        return self.salvar_registros(payload=payload,token=token,operacao=operacao).get('sucesso', False)
 
-        try:
-            res = requests.post(
-                url=url,
-                headers=headers,
-                json=payload_send
-            )
-            if res.ok and res.json().get('status') in ['0','1']:
-                sucesso = True if res.json().get('status') == '1' else False
-            else:
-                raise Exception(f"{res.status_code} - {res.text}")
-        except Exception as e:
-            logger.error(f"Erro ao atualizar dados do pagamento: {e}")
-            logger.info("headers: %s", { "Authorization":f"Bearer {token}" })
-            logger.info("payload: %s", payload_send)
-        finally:
-            pass
-
-        return sucesso    
\ No newline at end of file
+    def enviar(self,*,payload:list[dict],token:str=None) -> bool:
+        
+        if not payload:
+            return False
+        return self.salvar(payload=payload,token=token,operacao='registro')
+    
+    def atualizar(self,*,payload:list[dict],token:str=None) -> bool:
+        
+        if not payload:
+            return False
+        return self.salvar(payload=payload,token=token,operacao='atualização')
@@ -1,8 +1,12 @@
-import os
+import os, time, threading
+from contextlib import ExitStack
 from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor as PoolEmpresas, Future, wait, FIRST_COMPLETED
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.executors.pool import ThreadPoolExecutor
-from src.rede.services.rotina import RotinaService
+from src.rede.services.rotina import RotinaService, somar_etapas, travas_empresas
+from src.rede.services.cache_resposta import CacheRespostaService
+from src.rede.database.database import get_session
 from src.rede.utils.log import set_logger
 from dotenv import load_dotenv
 
@@ -13,6 +17,11 @@ class SchedulerService:
 
     def __init__(self):
         self.scheduler = None
+        self.max_workers:int = int(os.getenv('SCHEDULER_MAX_WORKERS', '4'))
+        self.timeout_empresa:float = float(os.getenv('SCHEDULER_TIMEOUT_EMPRESA', '1800'))
+        # empresa: uma rotina por empresa, em paralelo | lote: uma única busca e envio na Sankhya para todas as empresas
+        self.modo:str = os.getenv('SCHEDULER_MODO', 'empresa')
+        self.max_dias_recuperacao:int = int(os.getenv('SCHEDULER_MAX_DIAS_RECUPERACAO', '30'))
 
     def start_scheduler(self):
         self.inicializar_tarefas()
@@ -24,49 +33,205 @@ class SchedulerService:
             self.scheduler.shutdown(wait=False)
             logger.info("APScheduler encerrado.")
 
-    def job_atualizar_dados_pagamento(self):
-        """
-        Job que executa a rotina de atualização de dados de pagamento da Rede.
-        Busca os pagamentos do dia anterior para as empresas configuradas.
-        """
-        logger.info("Iniciando job de atualização de dados de pagamento.")
-        
+    def limpar_cache_respostas(self) -> int:
+        """ Remove do cache de respostas da Rede as entradas vencidas """
+
+        removidos:int = 0
+        with get_session() as session:
+            try:
+                removidos = CacheRespostaService(db=session).limpar_expirados()
+                if removidos:
+                    logger.info(f"{removidos} resposta(s) vencida(s) removida(s) do cache.")
+            except Exception as e:
+                logger.error(f"Erro ao limpar o cache de respostas: {e}")
+            finally:
+                session.close()
+        return removidos
+
+    def registrar_etapas(self,etapas:dict[str,dict]):
+        """ Registra no log as etapas da execução, da mais demorada para a mais rápida """
+
+        if not etapas:
+            return
+        logger.info("Tempo por etapa: " + ", ".join(f"{nome}={etapa.get('duracao')}s ({etapa.get('registros')} registro(s))" for nome, etapa in etapas.items()))
+
+    def obter_company_numbers(self) -> list[int]:
         company_numbers_str = os.getenv("COMPANY_NUMBER_LIST")
         if not company_numbers_str:
             logger.error("Variável de ambiente COMPANY_NUMBER_LIST não configurada. O job não será executado.")
-            return
+            return []
 
         try:
-            company_numbers = [int(cn.strip()) for cn in company_numbers_str.split(',')]
+            return [int(cn.strip()) for cn in company_numbers_str.split(',')]
         except ValueError:
             logger.error(f"Valor inválido para COMPANY_NUMBERS: '{company_numbers_str}'. Deve ser uma lista de números separados por vírgula.")
-            return
-        
-        # A rotina é executada para o dia anterior.
+            return []
+
+    def processar_empresa(self,company_number:int,end_date:date,inicio:dict,cancelamento:threading.Event=None) -> dict:
+        """
+        Executa a rotina para uma empresa, com instâncias de serviço próprias, a partir
+        do dia seguinte à última data conciliada da empresa.
+        Os tokens são compartilhados entre as threads pelo cache de tokens do processo.
+            :param cancelamento: sinalizado pelo job quando a empresa excede o tempo limite.
+        """
+        inicio[company_number] = time.monotonic()
+        try:
+            rotina = RotinaService()
+            start_date = rotina.obter_inicio_recuperacao(companyNumber=company_number,endDate=end_date,max_dias=self.max_dias_recuperacao)
+            logger.info(f"Processando pagamentos para a empresa {company_number} para o período de {start_date} a {end_date}.")
+            result = rotina.atualizar_dados_pagamento_incremental(
+                companyNumber=company_number,
+                startDate=start_date,
+                endDate=end_date,
+                recuperacao=True,
+                cancelamento=cancelamento
+            )
+        except Exception as e:
+            logger.error(f"Erro inesperado ao processar empresa {company_number}: {e}", exc_info=True)
+            result = {"sucesso": False, "mensagem": f"Erro inesperado: {e}"}
+        finally:
+            pass
+
+        if result.get("sucesso"):
+            logger.info(f"Sucesso ao atualizar pagamentos para a empresa {company_number}.")
+        else:
+            logger.error(f"Falha ao atualizar pagamentos para a empresa {company_number}: {result.get('mensagem')}")
+        result['duracao'] = round(time.monotonic() - inicio[company_number], 3)
+        return result
+
+    def processar_lote(self,company_numbers:list[int],end_date:date) -> dict:
+        """
+        Executa a rotina multiempresa, com uma única busca e um único envio na Sankhya.
+        O período começa no dia pendente mais antigo entre as empresas que ainda não estão em dia.
+        Empresas em processamento por outra execução (ex.: um job) ficam fora do lote.
+        """
+        inicio_job = time.monotonic()
+        travas = ExitStack()
+        try:
+            rotina = RotinaService()
+            livres = [cn for cn in company_numbers if travas.enter_context(travas_empresas.travar(cn))]
+            if len(livres) < len(company_numbers):
+                logger.warning(f"Empresas {[cn for cn in company_numbers if cn not in livres]} já estão em processamento e ficarão fora do lote.")
+            inicios = {cn: rotina.obter_inicio_recuperacao(companyNumber=cn,endDate=end_date,max_dias=self.max_dias_recuperacao) for cn in livres}
+            for cn in livres:
+                rotina.saltar_watermark(companyNumber=cn,startDate=inicios[cn])
+            pendentes = [cn for cn in livres if rotina.obter_periodo_pendente(companyNumber=cn,startDate=inicios[cn],endDate=end_date)]
+            if not pendentes:
+                logger.info(f"Todas as empresas já estão conciliadas até {end_date}.")
+                return {"total": len(company_numbers), "sucesso": len(livres), "falha": len(company_numbers) - len(livres), "timeout": 0,
+                        "duracao": round(time.monotonic() - inicio_job, 3), "empresas": {}, "etapas": {}, "envio": None, "mensagem": "Período já processado."}
+            # Cada empresa é consultada a partir do seu próprio dia pendente, para não reprocessar dias já conciliados
+            start_date = min(inicios[cn] for cn in pendentes)
+            logger.info(f"Processando pagamentos em lote para as empresas {pendentes} até {end_date} (início por empresa: { {cn: str(inicios[cn]) for cn in pendentes} }).")
+            result = rotina.atualizar_dados_pagamento_empresas(
+                companyNumbers=pendentes,
+                startDate=start_date,
+                endDate=end_date,
+                inicios={cn: inicios[cn] for cn in pendentes}
+            )
+            if result.get("sucesso") or result.get("envio") and not result["envio"].get("falhas"):
+                for cn, r in (result.get("empresas") or {}).items():
+                    if r.get("sucesso"):
+                        rotina.salvar_watermark(companyNumber=cn,startDate=inicios[cn],endDate=end_date)
+        except Exception as e:
+            logger.error(f"Erro inesperado ao processar empresas em lote: {e}", exc_info=True)
+            result = {"sucesso": False, "mensagem": f"Erro inesperado: {e}", "empresas": {}}
+        finally:
+            travas.close()
+
+        empresas:dict = result.get('empresas') or {}
+        # O envio à Sankhya é único: se falhar, nenhuma empresa é contada como sucesso
+        envio_ok:bool = result.get("sucesso") or bool(result.get("envio")) and not result["envio"].get("falhas")
+        sucesso:int = sum(1 for r in empresas.values() if r.get("sucesso")) if envio_ok else 0
+        resumo:dict = {
+            "total": len(company_numbers),
+            "sucesso": sucesso,
+            "falha": len(company_numbers) - sucesso,
+            "timeout": 0,
+            "duracao": round(time.monotonic() - inicio_job, 3),
+            "empresas": empresas,
+            "etapas": somar_etapas([result]),
+            "envio": result.get('envio'),
+            "mensagem": result.get('mensagem')
+        }
+        if result.get("sucesso"):
+            logger.info(f"Job de atualização de dados de pagamento em lote finalizado em {resumo['duracao']}s. Envio: {resumo['envio']}")
+        else:
+            logger.error(f"Falha na atualização de dados de pagamento em lote: {result.get('mensagem')}")
+        self.registrar_etapas(resumo['etapas'])
+        return resumo
+
+    def job_atualizar_dados_pagamento(self) -> dict:
+        """
+        Job que executa a rotina de atualização de dados de pagamento da Rede.
+        Busca os pagamentos pendentes até o dia anterior para as empresas configuradas, distribuindo
+        as empresas entre até SCHEDULER_MAX_WORKERS threads. Empresas que excedem
+        SCHEDULER_TIMEOUT_EMPRESA segundos são reportadas como expiradas no resumo.
+            :return dict: resumo da execução por empresa.
+        """
+        logger.info("Iniciando job de atualização de dados de pagamento.")
+        self.limpar_cache_respostas()
+
+        company_numbers = self.obter_company_numbers()
+        if not company_numbers:
+            return {}
+
+        # A rotina é executada até o dia anterior, recuperando os dias pendentes desde a última data conciliada.
         yesterday = date.today() - timedelta(days=1)
-        start_date = yesterday
         end_date = yesterday
 
-        rotina = RotinaService()
+        if self.modo == 'lote':
+            return self.processar_lote(company_numbers, end_date)
 
-        for company_number in company_numbers:
-            logger.info(f"Processando pagamentos para a empresa {company_number} para o período de {start_date} a {end_date}.")
-            try:
-                result = rotina.atualizar_dados_pagamento(
-                    companyNumber=company_number,
-                    startDate=start_date,
-                    endDate=end_date
-                )
-                if result.get("sucesso"):
-                    logger.info(f"Sucesso ao atualizar pagamentos para a empresa {company_number}.")
-                else:
-                    logger.error(f"Falha ao atualizar pagamentos para a empresa {company_number}: {result.get('mensagem')}")
-            except Exception as e:
-                logger.error(f"Erro inesperado ao processar empresa {company_number}: {e}", exc_info=True)
+        inicio_job = time.monotonic()
+        inicio:dict[int,float] = {}
+        cancelamentos:dict[int,threading.Event] = {cn: threading.Event() for cn in company_numbers}
+        empresas:dict[int,dict] = {}
+        pool = PoolEmpresas(max_workers=max(1, min(self.max_workers, len(company_numbers))), thread_name_prefix="empresa")
+        futuros:dict[Future,int] = {
+            pool.submit(self.processar_empresa, cn, end_date, inicio, cancelamentos[cn]): cn
+            for cn in company_numbers
+        }
+        pendentes = set(futuros)
+        try:
+            while pendentes:
+                concluidos, pendentes = wait(pendentes, timeout=1, return_when=FIRST_COMPLETED)
+                for futuro in concluidos:
+                    empresas[futuros[futuro]] = futuro.result()
+                agora = time.monotonic()
+                for futuro in list(pendentes):
+                    cn = futuros[futuro]
+                    if cn in inicio and agora - inicio[cn] > self.timeout_empresa:
+                        # A thread não pode ser interrompida: ela é sinalizada para parar na próxima etapa,
+                        # não avança a última data conciliada e mantém a empresa travada até terminar.
+                        cancelamentos[cn].set()
+                        logger.error(f"Tempo limite de {self.timeout_empresa}s excedido ao processar a empresa {cn}.")
+                        empresas[cn] = {"sucesso": False, "timeout": True, "mensagem": f"Tempo limite de {self.timeout_empresa}s excedido.", "duracao": round(agora - inicio[cn], 3)}
+                        pendentes.discard(futuro)
+        finally:
+            for cancelamento in cancelamentos.values():
+                cancelamento.set()
+            pool.shutdown(wait=False, cancel_futures=True)
 
-        logger.info("Job de atualização de dados de pagamento finalizado.")
+        resumo:dict = {
+            "total": len(company_numbers),
+            "sucesso": sum(1 for r in empresas.values() if r.get("sucesso")),
+            "falha": sum(1 for r in empresas.values() if not r.get("sucesso") and not r.get("timeout")),
+            "timeout": sum(1 for r in empresas.values() if r.get("timeout")),
+            "duracao": round(time.monotonic() - inicio_job, 3),
+            "empresas": {cn: empresas.get(cn) for cn in company_numbers},
+            # Soma das etapas de todas as empresas, da mais demorada para a mais rápida
+            "etapas": somar_etapas(list(empresas.values()))
+        }
+        logger.info(f"Job de atualização de dados de pagamento finalizado em {resumo['duracao']}s: "
+                    f"{resumo['sucesso']} sucesso(s), {resumo['falha']} falha(s), {resumo['timeout']} timeout(s) de {resumo['total']} empresa(s).")
+        for cn in company_numbers:
+            r = empresas.get(cn) or {}
+            if not r.get("sucesso"):
+                logger.warning(f"Empresa {cn}: {r.get('mensagem')}")
+        self.registrar_etapas(resumo['etapas'])
 
-        return True
+        return resumo
 
 
     def inicializar_tarefas(self):
@@ -1,6 +1,10 @@
-from datetime import datetime
+import os, threading
+from typing import Callable
+from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
 from src.rede.database.models import Token
+from src.rede.utils.log import set_logger
+logger = set_logger(__name__)
 
 class TokenService:
 
@@ -13,13 +17,11 @@ class TokenService:
         access_token: str,
         refresh_token: str | None = None,
         expires_at: datetime | None = None,
+        ambiente: str = "prd",
+        pacote: str = "",
     ):
 
-        token = (
-            self.db.query(Token)
-            .filter(Token.sistema == sistema)
-            .first()
-        )
+        token = self.obter_token(sistema=sistema, ambiente=ambiente, pacote=pacote)
 
         if token:
             token.access_token = access_token
@@ -28,6 +30,8 @@ class TokenService:
         else:
             token = Token(
                 sistema=sistema,
+                ambiente=ambiente,
+                pacote=pacote,
                 access_token=access_token,
                 refresh_token=refresh_token,
                 expires_at=expires_at,
@@ -38,9 +42,162 @@ class TokenService:
         self.db.refresh(token)
         return token
     
-    def obter_token(self, sistema: str) -> Token | None:
+    def obter_token(self, sistema: str, ambiente: str = "prd", pacote: str = "") -> Token | None:
         return (
             self.db.query(Token)
-            .filter(Token.sistema == sistema)
+            .filter(
+                Token.sistema == sistema,
+                Token.ambiente == ambiente,
+                Token.pacote == pacote,
+            )
             .first()
-        )
\ No newline at end of file
+        )
+
+class CacheToken:
+    """
+    Cache de tokens do processo, por (sistema, ambiente, pacote).
+    A renovação de cada chave é feita por uma única thread por vez: chamadas
+    simultâneas aguardam a renovação em andamento e reaproveitam o token gerado.
+    """
+
+    def __init__(self, margem_segundos: int | None = None):
+        self.margem = timedelta(seconds=margem_segundos if margem_segundos is not None else int(os.getenv('TOKEN_MARGEM_SEGUNDOS', '60')))
+        self.tokens: dict[tuple, dict] = {}
+        self.locks: dict[tuple, threading.Lock] = {}
+        self.renovadores: dict[tuple, Callable[[], dict]] = {}
+        self._lock = threading.Lock()
+
+    def valido(self, token: dict | None) -> bool:
+        if not token or not token.get('access_token') or not token.get('expires_at'):
+            return False
+        return token.get('expires_at') - self.margem > datetime.now()
+
+    def obter(self, chave: tuple) -> dict | None:
+        token = self.tokens.get(chave)
+        return token if self.valido(token) else None
+
+    def armazenar(self, chave: tuple, token: dict) -> dict:
+        token = {
+            "access_token": token.get('access_token'),
+            "expires_at": token.get('expires_at'),
+            "emitido_em": token.get('emitido_em') or datetime.now(),
+        }
+        self.tokens[chave] = token
+        return token
+
+    def invalidar(self, chave: tuple):
+        self.tokens.pop(chave, None)
+
+    def obter_lock(self, chave: tuple) -> threading.Lock:
+        with self._lock:
+            return self.locks.setdefault(chave, threading.Lock())
+
+    def obter_ou_renovar(self, chave: tuple, carregar: Callable[[], dict], gerar: Callable[[], dict]) -> dict | None:
+        """
+        Retorna o token válido da chave, consultando o banco ou gerando um novo apenas quando necessário.
+            :param chave: (sistema, ambiente, pacote).
+            :param carregar: função que lê o token persistido ({access_token, expires_at}).
+            :param gerar: função que gera e persiste um novo token, retornando {access_token, expires_at}.
+            :return dict: token válido ou None se não foi possível obtê-lo.
+        """
+        token = self.obter(chave)
+        if token:
+            return token
+
+        with self.obter_lock(chave):
+            # Outra thread pode ter renovado o token enquanto esta aguardava
+            token = self.obter(chave)
+            if token:
+                return token
+
+            token = carregar()
+            if self.valido(token):
+                return self.armazenar(chave, token)
+
+            token = gerar()
+            if self.valido(token):
+                return self.armazenar(chave, token)
+            # Token sem validade conhecida: é usado, mas não fica em cache
+            if token and token.get('access_token'):
+                return token
+        return None
+
+    def registrar_renovacao(self, chave: tuple, gerar: Callable[[], dict]):
+        """ Registra a função síncrona usada pelo RenovadorToken para renovar a chave em segundo plano """
+        self.renovadores[chave] = gerar
+
+    def precisa_renovar(self, chave: tuple, fracao: float) -> bool:
+        token = self.tokens.get(chave)
+        if not self.valido(token):
+            return True
+        emitido_em = token.get('emitido_em')
+        return datetime.now() >= emitido_em + (token.get('expires_at') - emitido_em) * fracao
+
+    def renovar(self, chave: tuple) -> dict | None:
+        """ Gera um novo token para a chave, mesmo que o atual ainda seja válido """
+
+        gerar = self.renovadores.get(chave)
+        if not gerar:
+            return None
+        with self.obter_lock(chave):
+            token = gerar()
+            if self.valido(token):
+                return self.armazenar(chave, token)
+        return None
+
+cache_token = CacheToken()
+
+class RenovadorToken:
+    """
+    Renova em segundo plano os tokens do cache ao atingir TOKEN_FRACAO_RENOVACAO do seu tempo de vida,
+    para que a geração de token não fique no caminho das requisições.
+    """
+
+    def __init__(self, cache: CacheToken = None, fracao: float | None = None, intervalo: float | None = None):
+        self.cache = cache or cache_token
+        self.fracao = fracao or float(os.getenv('TOKEN_FRACAO_RENOVACAO', '0.8'))
+        self.intervalo = intervalo or float(os.getenv('TOKEN_INTERVALO_VERIFICACAO', '30'))
+        self.servicos: list = []
+        self._parar = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def registrar(self, servico):
+        """ Registra um serviço de autenticação para ser autenticado ao iniciar o renovador """
+        self.servicos.append(servico)
+
+    def iniciar(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._parar.clear()
+        self._thread = threading.Thread(target=self.executar, name="renovador-token", daemon=True)
+        self._thread.start()
+        logger.info(f"Renovador de tokens iniciado (fração={self.fracao}, intervalo={self.intervalo}s).")
+
+    def parar(self):
+        self._parar.set()
+        if self._thread:
+            self._thread.join(timeout=self.intervalo)
+            self._thread = None
+            logger.info("Renovador de tokens encerrado.")
+
+    def executar(self):
+        for servico in self.servicos:
+            try:
+                if not servico.autenticar():
+                    logger.warning(f"Não foi possível obter o token inicial de {servico.chave_token()}.")
+            except Exception as e:
+                logger.error(f"Erro ao obter o token inicial de {servico.chave_token()}: {e}")
+        while not self._parar.wait(self.intervalo):
+            self.renovar_pendentes()
+
+    def renovar_pendentes(self):
+        for chave in list(self.cache.renovadores):
+            if not self.cache.precisa_renovar(chave, self.fracao):
+                continue
+            try:
+                if self.cache.renovar(chave):
+                    logger.info(f"Token {chave} renovado em segundo plano.")
+                else:
+                    logger.warning(f"Falha ao renovar o token {chave} em segundo plano.")
+            except Exception as e:
+                logger.error(f"Erro ao renovar o token {chave} em segundo plano: {e}")
@@ -0,0 +1,63 @@
+from datetime import date, timedelta
+from sqlalchemy.orm import Session
+from src.rede.database.models import Watermark
+
+class WatermarkService:
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def obter_watermark(self, rotina: str, company_number: int) -> Watermark | None:
+        return (
+            self.db.query(Watermark)
+            .filter(
+                Watermark.rotina == rotina,
+                Watermark.company_number == company_number,
+            )
+            .first()
+        )
+
+    def obter_ultima_data(self, rotina: str, company_number: int) -> date | None:
+        watermark = self.obter_watermark(rotina=rotina, company_number=company_number)
+        return watermark.ultima_data if watermark else None
+
+    def avancar(self, rotina: str, company_number: int, inicio: date, fim: date, saltar: bool = False) -> Watermark | None:
+        """
+        Avança a última data conciliada da empresa para fim.
+        O período só é considerado quando é contíguo ao já conciliado, para que a
+        marca nunca salte dias que ainda não foram processados.
+            :param saltar: aceita um período não contíguo; os dias entre a última data conciliada
+                           e inicio são deixados de lado de propósito pelo chamador.
+        """
+        watermark = self.obter_watermark(rotina=rotina, company_number=company_number)
+
+        if watermark:
+            if fim <= watermark.ultima_data:
+                return watermark
+            if inicio > watermark.ultima_data + timedelta(days=1) and not saltar:
+                return watermark
+            watermark.ultima_data = fim
+            watermark.falhas = 0
+        else:
+            watermark = Watermark(
+                rotina=rotina,
+                company_number=company_number,
+                ultima_data=fim,
+            )
+            self.db.add(watermark)
+
+        self.db.commit()
+        self.db.refresh(watermark)
+        return watermark
+
+    def registrar_falha(self, rotina: str, company_number: int) -> int:
+        """
+        Conta mais uma execução com falha no dia seguinte à última data conciliada.
+            :return int: falhas seguidas desse dia, ou 0 se a empresa ainda não tem data conciliada.
+        """
+        watermark = self.obter_watermark(rotina=rotina, company_number=company_number)
+        if not watermark:
+            return 0
+        watermark.falhas = (watermark.falhas or 0) + 1
+        self.db.commit()
+        return watermark.falhas
@@ -0,0 +1,59 @@
+import asyncio
+from collections import deque
+from typing import Callable, Iterable, Iterator, AsyncIterator, Awaitable, Any
+from concurrent.futures import ThreadPoolExecutor, Future
+
+def mapear_em_ordem(func:Callable[[Any],Any],itens:Iterable,max_workers:int) -> Iterator:
+    """
+    Executa func sobre os itens em um pool de threads, retornando os resultados na ordem de entrada.
+    No máximo max_workers itens ficam em execução ou aguardando consumo ao mesmo tempo.
+        :param func: função aplicada a cada item.
+        :param itens: itens a processar.
+        :param max_workers: número máximo de execuções simultâneas.
+        :return Iterator: resultados na ordem dos itens.
+    """
+    max_workers = max(1, int(max_workers))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pendentes:deque[Future] = deque()
+        try:
+            for item in itens:
+                pendentes.append(executor.submit(func, item))
+                if len(pendentes) >= max_workers:
+                    yield pendentes.popleft().result()
+            while pendentes:
+                yield pendentes.popleft().result()
+        finally:
+            for futuro in pendentes:
+                futuro.cancel()
+
+async def mapear_async(func:Callable[[Any],Awaitable],itens:Iterable,limite:int) -> list:
+    """
+    Versão assíncrona de mapear_em_ordem que aguarda todos os resultados.
+        :param func: corrotina aplicada a cada item.
+        :param itens: itens a processar.
+        :param limite: número máximo de corrotinas em execução ao mesmo tempo.
+        :return list: resultados na ordem dos itens.
+    """
+    semaforo = asyncio.Semaphore(max(1, int(limite)))
+
+    async def executar(item):
+        async with semaforo:
+            return await func(item)
+
+    return await asyncio.gather(*(executar(item) for item in itens))
+
+async def mapear_em_ordem_async(func:Callable[[Any],Awaitable],itens:Iterable,limite:int) -> AsyncIterator:
+    """ Versão assíncrona de mapear_em_ordem, retornando os resultados à medida que ficam prontos na ordem de entrada """
+
+    limite = max(1, int(limite))
+    pendentes:deque[asyncio.Task] = deque()
+    try:
+        for item in itens:
+            pendentes.append(asyncio.create_task(func(item)))
+            if len(pendentes) >= limite:
+                yield await pendentes.popleft()
+        while pendentes:
+            yield await pendentes.popleft()
+    finally:
+        for tarefa in pendentes:
+            tarefa.cancel()
@@ -0,0 +1,361 @@
+import os, time, random, asyncio, threading, requests, httpx
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from src.rede.utils.log import set_logger
+from src.rede.utils.metricas import nomear_endpoint, http_duracao, http_requisicoes, http_repeticoes
+logger = set_logger(__name__)
+load_dotenv()
+
+def resposta_ok(res) -> bool:
+    """ Equivalente a requests.Response.ok para respostas requests ou httpx """
+
+    return res.status_code < 400
+
+STATUS_REPETIR:set[int] = {429, 503}
+
+def ler_taxas_hosts(valor:str) -> dict[str,float]:
+    """
+    Lê a taxa máxima de requisições por host, no formato "host=taxa,host=taxa".
+        :param valor: conteúdo da variável HTTP_TAXA_HOSTS.
+        :return dict: taxa em requisições/segundo por host.
+    """
+    taxas:dict[str,float] = {}
+    for item in (valor or '').split(','):
+        if '=' not in item:
+            continue
+        host, taxa = item.split('=', 1)
+        try:
+            taxas[host.strip()] = float(taxa)
+        except ValueError:
+            logger.warning(f"Taxa inválida para o host {host.strip()} em HTTP_TAXA_HOSTS: '{taxa}'")
+    return taxas
+
+def ler_retry_after(res) -> float | None:
+    """
+    Converte o cabeçalho Retry-After, em segundos ou data HTTP, no tempo de espera em segundos.
+        :return float | None: segundos a aguardar, ou None se o cabeçalho estiver ausente ou inválido.
+    """
+    valor = res.headers.get('Retry-After')
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(valor) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+class LimitadorTaxa:
+    """
+    Token bucket de um host: libera até `taxa` requisições por segundo, com rajadas de até `capacidade`.
+    As fichas são reservadas sob o lock e a espera acontece fora dele, o que permite usar o mesmo
+    limitador com time.sleep (threads) e asyncio.sleep (corrotinas).
+    """
+
+    def __init__(self,taxa:float,capacidade:float=None):
+        self.taxa = taxa
+        self.capacidade = max(1.0, capacidade or taxa)
+        self.fichas = self.capacidade
+        self.atualizado_em = time.monotonic()
+        self.pausado_ate = 0.0
+        self._lock = threading.Lock()
+
+    def reservar(self) -> float:
+        """
+        Reserva uma ficha para a próxima requisição.
+            :return float: segundos a aguardar antes de enviar a requisição.
+        """
+        if self.taxa <= 0:
+            return max(0.0, self.pausado_ate - time.monotonic())
+        with self._lock:
+            agora = time.monotonic()
+            self.fichas = min(self.capacidade, self.fichas + (agora - self.atualizado_em) * self.taxa)
+            self.atualizado_em = agora
+            self.fichas -= 1
+            espera = -self.fichas / self.taxa if self.fichas < 0 else 0.0
+            return max(espera, self.pausado_ate - agora)
+
+    def pausar(self,segundos:float):
+        """ Suspende as requisições ao host, ex. após um 429 com Retry-After """
+        with self._lock:
+            self.pausado_ate = max(self.pausado_ate, time.monotonic() + segundos)
+
+# Limitadores por host compartilhados entre os transportes síncrono e assíncrono, para que a taxa
+# e as pausas de um 429/Retry-After valham para todas as requisições ao host
+limitadores_hosts:dict[str,LimitadorTaxa] = {}
+_lock_limitadores = threading.Lock()
+
+def obter_limitador_host(host:str,taxa:float) -> LimitadorTaxa:
+    """
+    Retorna o limitador de taxa do host, criando-o na primeira chamada.
+        :param host: host da requisição.
+        :param taxa: requisições/segundo usadas ao criar o limitador.
+        :return LimitadorTaxa: limitador compartilhado do host.
+    """
+    limitador = limitadores_hosts.get(host)
+    if limitador is None:
+        with _lock_limitadores:
+            limitador = limitadores_hosts.get(host)
+            if limitador is None:
+                limitador = LimitadorTaxa(taxa=taxa)
+                limitadores_hosts[host] = limitador
+    return limitador
+
+class ControleHost:
+    """
+    Regras compartilhadas pelos transportes síncrono e assíncrono: limitador de taxa por host,
+    número máximo de requisições simultâneas por host e repetição com backoff exponencial e jitter
+    para as respostas 429 e 503.
+    """
+
+    def __init__(self,max_concorrencia:int=None):
+        self.taxa_padrao:float = float(os.getenv('HTTP_TAXA_MAXIMA', '0'))
+        self.taxas_hosts:dict[str,float] = ler_taxas_hosts(os.getenv('HTTP_TAXA_HOSTS', ''))
+        self.max_concorrencia:int = max_concorrencia or int(os.getenv('HTTP_MAX_CONCORRENCIA', '10'))
+        self.tentativas:int = max(1, int(os.getenv('HTTP_TENTATIVAS', '3')))
+        self.espera_base:float = float(os.getenv('REQ_TIME_SLEEP', '1.5'))
+        self.espera_maxima:float = float(os.getenv('HTTP_ESPERA_MAXIMA', '60'))
+
+    def obter_limitador(self,host:str) -> LimitadorTaxa:
+        return obter_limitador_host(host,self.taxas_hosts.get(host, self.taxa_padrao))
+
+    def calcular_backoff(self,tentativa:int) -> float:
+        """
+        Backoff exponencial a partir de REQ_TIME_SLEEP com jitter, limitado a HTTP_ESPERA_MAXIMA.
+            :param tentativa: número da tentativa que falhou, a partir de 1.
+        """
+        espera = self.espera_base * 2 ** (tentativa - 1)
+        espera += random.uniform(0, espera / 2)
+        return min(espera, self.espera_maxima)
+
+    def calcular_espera(self,res,tentativa:int) -> float:
+        """
+        Tempo de espera antes de repetir a requisição: o Retry-After informado pelo servidor ou,
+        na falta dele, o backoff exponencial.
+            :param tentativa: número da tentativa que falhou, a partir de 1.
+        """
+        espera = ler_retry_after(res)
+        if espera is None:
+            return self.calcular_backoff(tentativa)
+        return min(espera, self.espera_maxima)
+
+    def deve_repetir(self,res,tentativa:int) -> bool:
+        return res.status_code in STATUS_REPETIR and tentativa < self.tentativas
+
+    def registrar_chamada(self,metodo:str,endpoint:str,inicio:float,status) -> None:
+        http_duracao.observar(time.monotonic() - inicio, metodo=metodo, endpoint=endpoint)
+        http_requisicoes.incrementar(metodo=metodo, endpoint=endpoint, status=status)
+
+    def registrar_repeticao(self,host:str,res,tentativa:int,endpoint:str='') -> float:
+        http_repeticoes.incrementar(endpoint=endpoint or host, status=res.status_code)
+        espera = self.calcular_espera(res,tentativa)
+        if res.status_code == 429:
+            # O limite vale para o host: todas as requisições a ele aguardam, não só esta
+            self.obter_limitador(host).pausar(espera)
+        logger.warning(f"{host} respondeu {res.status_code}. Tentativa {tentativa}/{self.tentativas}, nova tentativa em {espera:.2f}s.")
+        return espera
+
+class TransporteHttp(ControleHost):
+    """
+    Camada de transporte HTTP compartilhada pelos serviços da Rede e da Sankhya.
+    Mantém uma sessão por host, com pool de conexões e keep-alive, para que as
+    chamadas reaproveitem conexões já abertas em vez de refazer o handshake TCP+TLS.
+    """
+
+    def __init__(self,pool_size:int=None,timeout_conexao:float=None,timeout_leitura:float=None):
+        self.pool_size = pool_size or int(os.getenv('HTTP_POOL_SIZE', '10'))
+        self.timeout_conexao = timeout_conexao or float(os.getenv('HTTP_TIMEOUT_CONEXAO', '5'))
+        self.timeout_leitura = timeout_leitura or float(os.getenv('HTTP_TIMEOUT_LEITURA', '60'))
+        self.sessoes:dict[str,requests.Session] = {}
+        self.semaforos:dict[str,threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        super().__init__()
+
+    @property
+    def timeout(self) -> tuple[float,float]:
+        return (self.timeout_conexao, self.timeout_leitura)
+
+    def criar_sessao(self) -> requests.Session:
+        sessao = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            pool_block=True
+        )
+        sessao.mount("https://", adapter)
+        sessao.mount("http://", adapter)
+        sessao.headers.update({"Connection": "keep-alive"})
+        return sessao
+
+    def obter_sessao(self,url:str) -> requests.Session:
+        """
+        Retorna a sessão do host da URL, criando-a na primeira chamada.
+            :param url: URL completa da requisição.
+            :return requests.Session: sessão com pool de conexões do host.
+        """
+        host = urlsplit(url).netloc
+        sessao = self.sessoes.get(host)
+        if sessao is None:
+            with self._lock:
+                sessao = self.sessoes.get(host)
+                if sessao is None:
+                    sessao = self.criar_sessao()
+                    self.sessoes[host] = sessao
+                    logger.info(f"Pool de conexões criado para {host} (tamanho={self.pool_size})")
+        return sessao
+
+    def obter_semaforo(self,host:str) -> threading.BoundedSemaphore:
+        semaforo = self.semaforos.get(host)
+        if semaforo is None:
+            with self._lock:
+                semaforo = self.semaforos.setdefault(host, threading.BoundedSemaphore(self.max_concorrencia))
+        return semaforo
+
+    def request(self,method:str,url:str,**kwargs) -> requests.Response:
+        """
+        Envia a requisição respeitando a taxa e a concorrência máximas do host.
+        Respostas 429 e 503 são repetidas até HTTP_TENTATIVAS vezes; a última resposta é
+        sempre devolvida ao chamador, que continua responsável por tratar o erro.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        host = urlsplit(url).netloc
+        endpoint = nomear_endpoint(url)
+        sessao = self.obter_sessao(url)
+        limitador = self.obter_limitador(host)
+        tentativa:int = 1
+        while True:
+            espera = limitador.reservar()
+            if espera > 0:
+                time.sleep(espera)
+            with self.obter_semaforo(host):
+                inicio = time.monotonic()
+                try:
+                    res = sessao.request(method=method, url=url, **kwargs)
+                except Exception:
+                    self.registrar_chamada(method,endpoint,inicio,'erro')
+                    raise
+                self.registrar_chamada(method,endpoint,inicio,res.status_code)
+            if not self.deve_repetir(res,tentativa):
+                return res
+            espera = self.registrar_repeticao(host,res,tentativa,endpoint)
+            res.close()
+            time.sleep(espera)
+            tentativa += 1
+
+    def get(self,url:str,**kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self,url:str,**kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def fechar(self):
+        with self._lock:
+            for sessao in self.sessoes.values():
+                sessao.close()
+            self.sessoes.clear()
+
+_transporte:TransporteHttp = None
+_transporte_lock = threading.Lock()
+
+def obter_transporte() -> TransporteHttp:
+    """ Retorna o transporte HTTP do processo, criando-o na primeira chamada """
+
+    global _transporte
+    if _transporte is None:
+        with _transporte_lock:
+            if _transporte is None:
+                _transporte = TransporteHttp()
+    return _transporte
+
+def fechar_transporte():
+    """ Encerra as conexões abertas do transporte HTTP do processo """
+
+    global _transporte
+    with _transporte_lock:
+        if _transporte is not None:
+            _transporte.fechar()
+            _transporte = None
+
+class TransporteHttpAsync(ControleHost):
+    """
+    Versão assíncrona do transporte HTTP, sobre httpx.AsyncClient.
+    O cliente mantém internamente um pool de conexões por host com keep-alive.
+    """
+
+    def __init__(self,pool_size:int=None,timeout_conexao:float=None,timeout_leitura:float=None):
+        super().__init__()
+        self.semaforos:dict[str,asyncio.Semaphore] = {}
+        self.pool_size = pool_size or int(os.getenv('HTTP_POOL_SIZE_ASYNC', '100'))
+        self.timeout_conexao = timeout_conexao or float(os.getenv('HTTP_TIMEOUT_CONEXAO', '5'))
+        self.timeout_leitura = timeout_leitura or float(os.getenv('HTTP_TIMEOUT_LEITURA', '60'))
+        self.cliente = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.pool_size,
+                max_keepalive_connections=self.pool_size
+            ),
+            timeout=httpx.Timeout(self.timeout_leitura, connect=self.timeout_conexao),
+            headers={"Connection": "keep-alive"}
+        )
+
+    def obter_semaforo(self,host:str) -> asyncio.Semaphore:
+        semaforo = self.semaforos.get(host)
+        if semaforo is None:
+            semaforo = self.semaforos[host] = asyncio.Semaphore(self.max_concorrencia)
+        return semaforo
+
+    async def request(self,method:str,url:str,**kwargs) -> httpx.Response:
+        """ Como TransporteHttp.request, aguardando com asyncio.sleep """
+        host = urlsplit(url).netloc
+        endpoint = nomear_endpoint(url)
+        limitador = self.obter_limitador(host)
+        tentativa:int = 1
+        while True:
+            espera = limitador.reservar()
+            if espera > 0:
+                await asyncio.sleep(espera)
+            async with self.obter_semaforo(host):
+                inicio = time.monotonic()
+                try:
+                    res = await self.cliente.request(method=method, url=url, **kwargs)
+                except Exception:
+                    self.registrar_chamada(method,endpoint,inicio,'erro')
+                    raise
+                self.registrar_chamada(method,endpoint,inicio,res.status_code)
+            if not self.deve_repetir(res,tentativa):
+                return res
+            espera = self.registrar_repeticao(host,res,tentativa,endpoint)
+            await res.aclose()
+            await asyncio.sleep(espera)
+            tentativa += 1
+
+    async def get(self,url:str,**kwargs) -> httpx.Response:
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self,url:str,**kwargs) -> httpx.Response:
+        return await self.request('POST', url, **kwargs)
+
+    async def fechar(self):
+        await self.cliente.aclose()
+
+_transporte_async:TransporteHttpAsync = None
+
+def obter_transporte_async() -> TransporteHttpAsync:
+    """ Retorna o transporte HTTP assíncrono do processo, criando-o na primeira chamada """
+
+    global _transporte_async
+    if _transporte_async is None:
+        _transporte_async = TransporteHttpAsync()
+    return _transporte_async
+
+async def fechar_transporte_async():
+    """ Encerra as conexões abertas do transporte HTTP assíncrono do processo """
+
+    global _transporte_async
+    if _transporte_async is not None:
+        await _transporte_async.fechar()
+        _transporte_async = None
@@ -1,8 +1,13 @@
-import os, logging
+import os, re, json, queue, atexit, logging, threading
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from dotenv import load_dotenv
 load_dotenv()
 
+_listener:QueueListener = None
+_fila_handler:QueueHandler = None
+_logging_lock = threading.Lock()
+
 def buscar_path() -> str:
     """ Busca o caminho do log atual ou cria um novo caso não exista """
 
@@ -20,22 +25,153 @@ def buscar_path() -> str:
         pass
     return path_atual
 
-def set_logger(name:str) -> logging:
+class ArquivoLogMensal(RotatingFileHandler):
+    """
+    Arquivo de log ./logs/AAAAMM.log, trocado na virada do mês e rotacionado
+    por tamanho (AAAAMM.log.1, AAAAMM.log.2, ...) dentro do mesmo mês.
+    """
+
+    def __init__(self,tamanho_maximo:int,backups:int):
+        self.mes:str = datetime.now().strftime('%Y%m')
+        super().__init__(buscar_path(),maxBytes=tamanho_maximo,backupCount=backups,encoding='utf-8')
+
+    def shouldRollover(self,record:logging.LogRecord) -> bool:
+        if datetime.now().strftime('%Y%m') != self.mes:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self):
+        mes_atual = datetime.now().strftime('%Y%m')
+        if mes_atual == self.mes:
+            super().doRollover()
+            return
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        self.mes = mes_atual
+        self.baseFilename = os.path.abspath(buscar_path())
+        self.stream = self._open()
+
+def configurar_logging():
+    """
+    Configura o logging do processo uma única vez.
+    Os módulos apenas enfileiram os registros; a escrita em arquivo é feita por
+    uma thread dedicada (QueueListener), fora das threads de requisição e do agendador.
+    """
+
+    global _listener, _fila_handler
+    if _listener is not None:
+        return
+    with _logging_lock:
+        if _listener is not None:
+            return
+
+        arquivo = ArquivoLogMensal(tamanho_maximo=int(os.getenv('LOG_TAMANHO_MAXIMO', str(10 * 1024 * 1024))),
+                                   backups=int(os.getenv('LOG_BACKUPS', '5')))
+        arquivo.setFormatter(logging.Formatter(fmt=os.getenv('LOGGER_FORMAT'),datefmt='%Y-%m-%d %H:%M:%S'))
+
+        fila:queue.SimpleQueue = queue.SimpleQueue()
+        raiz = logging.getLogger()
+        _fila_handler = QueueHandler(fila)
+        raiz.addHandler(_fila_handler)
+        raiz.setLevel(os.getenv('LOG_NIVEL', 'INFO').upper())
+
+        # silencia libs verbosas
+        logging.getLogger("apscheduler").setLevel(logging.WARNING)
+        logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
+
+        _listener = QueueListener(fila, arquivo, respect_handler_level=True)
+        _listener.start()
+        atexit.register(encerrar_logging)
+
+def encerrar_logging():
+    """ Grava os registros ainda na fila e encerra a thread de escrita """
+
+    global _listener, _fila_handler
+    with _logging_lock:
+        if _listener is not None:
+            logging.getLogger().removeHandler(_fila_handler)
+            _fila_handler = None
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
+_padrao_bearer = re.compile(r'(Bearer\s+)[^\s"\',]+', re.IGNORECASE)
+_padrao_segredo = re.compile(r'(["\']?(?:access_token|refresh_token|authorization|bearertoken|x_?token|password|senha|client_secret)["\']?\s*[:=]\s*["\']?)[^"\',}\s]+', re.IGNORECASE)
+
+def mascarar_segredos(texto:str) -> str:
+    """ Oculta tokens bearer e campos de credenciais em um texto de log """
+
+    return _padrao_segredo.sub(r'\1***', _padrao_bearer.sub(r'\1***', texto))
+
+def contar_registros(dados) -> int:
+    """ Quantidade de registros de um payload: itens da lista ou da primeira lista em "content" """
+
+    if isinstance(dados, (list, tuple, set)):
+        return len(dados)
+    if isinstance(dados, dict):
+        conteudo = dados.get("content", dados)
+        if isinstance(conteudo, dict):
+            for valor in conteudo.values():
+                if isinstance(valor, list):
+                    return len(valor)
+        return 1
+    return 0 if dados is None else 1
+
+class PayloadLog:
+    """
+    Representação de um payload para log, formatada somente quando o registro é emitido.
+    LOG_PAYLOAD_MODO define o conteúdo:
+        contagem: apenas a quantidade de registros (padrão);
+        amostra: os LOG_PAYLOAD_AMOSTRA primeiros registros;
+        truncado: o corpo serializado até LOG_PAYLOAD_LIMITE caracteres;
+        completo: o corpo inteiro, para depuração.
+    Tokens e credenciais são sempre mascarados.
+    """
+
+    def __init__(self,dados):
+        self.dados = dados
+
+    def serializar(self,dados,limite:int=None) -> str:
+        if limite is None or not isinstance(dados, list):
+            texto = json.dumps(dados, ensure_ascii=False, default=str)
+            return texto if limite is None or len(texto) <= limite else texto[:limite] + "..."
+        # Serializa item a item para não montar o corpo inteiro só para descartá-lo
+        partes:list[str] = []
+        tamanho:int = 0
+        for item in dados:
+            parte = json.dumps(item, ensure_ascii=False, default=str)
+            partes.append(parte)
+            tamanho += len(parte) + 2
+            if tamanho > limite:
+                return ("[" + ", ".join(partes))[:limite] + "..."
+        return "[" + ", ".join(partes) + "]"
+
+    def __str__(self) -> str:
+        modo:str = os.getenv('LOG_PAYLOAD_MODO', 'contagem').lower()
+        total:int = contar_registros(self.dados)
+        if modo == 'completo':
+            return mascarar_segredos(self.serializar(self.dados))
+        if modo == 'amostra':
+            amostra = self.dados[:int(os.getenv('LOG_PAYLOAD_AMOSTRA', '3'))] if isinstance(self.dados, list) else self.dados
+            return f"{total} registro(s), amostra: {mascarar_segredos(self.serializar(amostra, int(os.getenv('LOG_PAYLOAD_LIMITE', '2000'))))}"
+        if modo == 'truncado':
+            return f"{total} registro(s): {mascarar_segredos(self.serializar(self.dados, int(os.getenv('LOG_PAYLOAD_LIMITE', '2000'))))}"
+        return f"{total} registro(s)"
+
+def resumir_payload(dados) -> PayloadLog:
+    """
+    Payload para uso como argumento do logger, ex.: logger.info("payload: %s", resumir_payload(payload)).
+    """
+
+    return PayloadLog(dados)
+
+def set_logger(name:str) -> logging.Logger:
     """
     Configura o logger.
         :param name: nome da função que está sendo executada
     """
 
-    logger = logging.getLogger(name)
-   
-    logging.basicConfig(filename=buscar_path(),
-                        encoding='utf-8',
-                        format=os.getenv('LOGGER_FORMAT'),
-                        datefmt='%Y-%m-%d %H:%M:%S',
-                        level=logging.INFO)
-    
-    # silencia libs verbosas
-    logging.getLogger("apscheduler").setLevel(logging.WARNING)
-    logging.getLogger("uvicorn.access").setLevel(logging.WARNING)
-
-    return logger
\ No newline at end of file
+    configurar_logging()
+    return logging.getLogger(name)
@@ -0,0 +1,121 @@
+import re, bisect, threading
+from urllib.parse import urlsplit, parse_qs
+
+LIMITES_DURACAO:tuple[float,...] = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_segmento_id = re.compile(r'^(\d+|[0-9a-fA-F-]{16,}|(?=.*\d)[\w-]{12,})$')
+
+def nomear_endpoint(url:str) -> str:
+    """
+    Nome do endpoint para os rótulos das métricas, sem identificadores variáveis.
+    No gateway Sankhya o serviço vem no parâmetro serviceName; nas demais URLs os
+    segmentos com identificadores (números, UUIDs, ids longos) viram {id}.
+        :param url: URL completa da requisição.
+        :return str: ex.: "api.userede.com.br/redelabs/merchant-statement/v1/payments/{id}/{id}".
+    """
+    partes = urlsplit(url)
+    servico = parse_qs(partes.query).get('serviceName')
+    if servico:
+        return f"{partes.netloc}/{servico[0]}"
+    caminho = "/".join("{id}" if _segmento_id.match(segmento) else segmento for segmento in partes.path.split("/"))
+    return f"{partes.netloc}{caminho}"
+
+def escapar_rotulo(valor) -> str:
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def formatar_rotulos(rotulos:tuple[tuple[str,str],...]) -> str:
+    if not rotulos:
+        return ""
+    return "{" + ",".join(f'{nome}="{escapar_rotulo(valor)}"' for nome, valor in rotulos) + "}"
+
+class Contador:
+
+    def __init__(self,nome:str,ajuda:str):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.valores:dict[tuple,float] = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self,valor:float=1,**rotulos):
+        chave = tuple(sorted(rotulos.items()))
+        with self._lock:
+            self.valores[chave] = self.valores.get(chave, 0) + valor
+
+    def exportar(self) -> list[str]:
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} counter"]
+        with self._lock:
+            for chave, valor in sorted(self.valores.items()):
+                linhas.append(f"{self.nome}{formatar_rotulos(chave)} {valor}")
+        return linhas
+
+class Histograma:
+
+    def __init__(self,nome:str,ajuda:str,limites:tuple[float,...]=LIMITES_DURACAO):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.limites = tuple(sorted(limites))
+        # por rótulos: [contagem por faixa..., soma, total]
+        self.valores:dict[tuple,list[float]] = {}
+        self._lock = threading.Lock()
+
+    def observar(self,valor:float,**rotulos):
+        chave = tuple(sorted(rotulos.items()))
+        faixa = bisect.bisect_left(self.limites, valor)
+        with self._lock:
+            dados = self.valores.get(chave)
+            if dados is None:
+                dados = self.valores[chave] = [0] * (len(self.limites) + 2)
+            if faixa < len(self.limites):
+                dados[faixa] += 1
+            dados[-2] += valor
+            dados[-1] += 1
+
+    def exportar(self) -> list[str]:
+        linhas = [f"# HELP {self.nome} {self.ajuda}", f"# TYPE {self.nome} histogram"]
+        with self._lock:
+            for chave, dados in sorted(self.valores.items()):
+                acumulado = 0
+                for limite, quantidade in zip(self.limites, dados):
+                    acumulado += quantidade
+                    linhas.append(f"{self.nome}_bucket{formatar_rotulos(chave + (('le', f'{limite:g}'),))} {acumulado}")
+                linhas.append(f"{self.nome}_bucket{formatar_rotulos(chave + (('le', '+Inf'),))} {dados[-1]}")
+                linhas.append(f"{self.nome}_sum{formatar_rotulos(chave)} {round(dados[-2], 6)}")
+                linhas.append(f"{self.nome}_count{formatar_rotulos(chave)} {dados[-1]}")
+        return linhas
+
+class RegistroMetricas:
+    """
+    Registro em memória das métricas do processo, exportado no formato texto do Prometheus.
+    Os valores são zerados quando o processo reinicia.
+    """
+
+    def __init__(self):
+        self.metricas:dict[str,Contador|Histograma] = {}
+        self._lock = threading.Lock()
+
+    def registrar(self,metrica:Contador|Histograma) -> Contador|Histograma:
+        with self._lock:
+            return self.metricas.setdefault(metrica.nome, metrica)
+
+    def contador(self,nome:str,ajuda:str) -> Contador:
+        return self.registrar(Contador(nome=nome,ajuda=ajuda))
+
+    def histograma(self,nome:str,ajuda:str,limites:tuple[float,...]=LIMITES_DURACAO) -> Histograma:
+        return self.registrar(Histograma(nome=nome,ajuda=ajuda,limites=limites))
+
+    def exportar(self) -> str:
+        linhas:list[str] = []
+        with self._lock:
+            metricas = list(self.metricas.values())
+        for metrica in metricas:
+            linhas.extend(metrica.exportar())
+        return "\n".join(linhas) + "\n"
+
+metricas = RegistroMetricas()
+
+http_duracao = metricas.histograma("rede_http_duracao_segundos", "Duração das chamadas HTTP às APIs externas, por endpoint.")
+http_requisicoes = metricas.contador("rede_http_requisicoes_total", "Chamadas HTTP às APIs externas, por endpoint e status.")
+http_repeticoes = metricas.contador("rede_http_repeticoes_total", "Chamadas HTTP repetidas após 429 ou 503, por endpoint e status.")
+tokens_gerados = metricas.contador("rede_tokens_gerados_total", "Tokens gerados ou renovados, por sistema, ambiente, pacote e resultado.")
+registros_buscados = metricas.contador("rede_registros_buscados_total", "Registros recebidos das APIs externas, por origem.")
+registros_gravados = metricas.contador("rede_registros_gravados_total", "Registros enviados ao Sankhya, por entidade e resultado.")